@@ -0,0 +1,80 @@
+"""Currency parsing benchmarks.
+
+Compares the regex clean_currency the calculator used to run with the
+currency module, one value at a time (clean_currency, inferring the
+separators) and a column at a time (parse_amounts in the sheet's locale, as
+the importer calls it), over corpora of plain numbers, UK formatted amounts,
+European amounts, negatives and the repeated fees a sourcing sheet holds.
+
+    python benchmarks/bench_currency.py [--values 20000]
+"""
+import argparse
+import os
+import random
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from financial_calculator_app.calculator import currency  # noqa: E402
+from financial_calculator_app.calculator.kernel import clean_currency  # noqa: E402
+
+_NON_NUMERIC = re.compile(r'[^\d.]')
+
+
+def legacy_clean_currency(value):
+    """The implementation clean_currency replaced"""
+    if value is None or value == "":
+        return 0
+    if isinstance(value, str):
+        value = _NON_NUMERIC.sub('', value)
+        try:
+            return float(value) if value else 0
+        except ValueError:
+            return 0
+    return float(value)
+
+
+def corpora(size, seed=7):
+    """Corpus name -> (locale of its values, values)"""
+    rng = random.Random(seed)
+    amounts = [round(rng.uniform(-5e4, 2e6), rng.choice((0, 2))) for _ in range(size)]
+    return {
+        "numeric": ("en_GB", amounts),
+        "plain": ("en_GB", [str(amount) for amount in amounts]),
+        "uk": ("en_GB", ["£{:,.2f}".format(abs(amount)) for amount in amounts]),
+        "european": ("de_DE", ["{:,.2f} €".format(abs(amount)).translate(str.maketrans(",.", ".,")) for amount in amounts]),
+        "negative": ("en_GB", ["({:,.0f})".format(-amount) if amount < 0 else "{:,.0f}".format(amount) for amount in amounts]),
+        # Sheets repeat the same handful of fees and rents
+        "repeated": ("en_GB", ["£{:,}".format(rng.choice((550, 600, 700, 2500, 3000))) for _ in range(size)]),
+    }
+
+
+def bench(function, repeat=7):
+    """Best time of repeat runs, in seconds"""
+    return min(timeit.repeat(function, number=1, repeat=repeat))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--values", type=int, default=20000)
+    args = parser.parse_args()
+
+    print("{:<10} {:>14} {:>14} {:>14} {:>10}".format(
+        "corpus", "legacy ns/val", "single ns/val", "column ns/val", "column speedup"))
+    for name, (locale, values) in corpora(args.values).items():
+        legacy = bench(lambda: [legacy_clean_currency(value) for value in values])
+        single = bench(lambda: [clean_currency(value) for value in values])
+        column = bench(lambda: currency.parse_amounts(values, locale))
+        print("{:<10} {:>14.0f} {:>14.0f} {:>14.0f} {:>9.1f}x".format(
+            name, legacy / len(values) * 1e9, single / len(values) * 1e9, column / len(values) * 1e9,
+            legacy / column))
+
+    # What the old parser did to amounts it could not read
+    for value in ("1.250.000,00", "-1,250.00", "(1,250)"):
+        print("{!r:>16}: legacy {!r}, now {!r}".format(value, legacy_clean_currency(value), clean_currency(value)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,291 @@
+"""Benchmarks of the calculation pipeline that runs on every save.
+
+Times FinancialCalculatorNew.run_calculations, each calculate_* stage of the
+calculation graph, the SDLT functions and clean_currency over seeded corpora
+of deals. The controller runs against the frappe stand-in in
+benchmarks/standin, so no site or database is needed.
+
+Each case records the best time per call over several repeats. Results are
+compared with a baseline recorded on the same machine and the run exits with
+status 1 when a case is slower than its baseline by more than the threshold.
+
+    python benchmarks/bench_pipeline.py --save-baseline    # record a baseline before a change
+    python benchmarks/bench_pipeline.py                    # compare with it after the change
+    python benchmarks/bench_pipeline.py --output results.json --threshold 0.3 --filter sdlt
+
+Timings are only comparable on the machine that recorded them, so no
+baseline is kept in the repository: benchmarks/baseline.json is ignored by
+git and written locally. A baseline recorded on another machine is shown
+for reference but does not fail the run.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import time
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+# The stand-in goes first so it is used even where frappe is installed
+sys.path[:0] = [os.path.join(BENCHMARKS, "standin"), os.path.dirname(BENCHMARKS)]
+
+import numpy as np  # noqa: E402
+
+from financial_calculator_app.calculator import currency, kernel, sdlt  # noqa: E402
+from financial_calculator_app.financial_calculator_app.doctype.financial_calculator_new.financial_calculator_new import (  # noqa: E402
+    CALCULATION_GRAPH,
+    RESULT_CACHE,
+    FinancialCalculatorNew,
+)
+
+BASELINE = os.path.join(BENCHMARKS, "baseline.json")
+THRESHOLD = 0.2
+SDLT_TYPES = ("Resi", "Non-Resi", "Mixed-Use", "Land", "Chain-Break", "Exempt")
+
+
+def make_deal(rng, profile):
+    """Details tab values of one deal, typed the way the form stores them"""
+    price = {
+        "hmo": lambda: rng.randrange(90000, 450000, 5000),
+        "commercial": lambda: rng.randrange(150000, 2500000, 25000),
+        "prime": lambda: rng.randrange(900000, 6000000, 50000),
+    }[profile]()
+    rooms = rng.randint(3, 12) if profile != "commercial" else rng.randint(1, 4)
+    rent = rooms * rng.randrange(450, 1200 if profile == "prime" else 800, 25)
+    renovation = int(price * rng.uniform(0.02, 0.3))
+    deal = {
+        "doctype": "Financial Calculator New",
+        "forecast_type": rng.choice(("Proposed", "Actual")),
+        "main_asking_price": str(price + rng.randrange(0, 30000, 1000)),
+        # Prices are typed in with and without separators
+        "main_purchase_price": rng.choice((str(price), "{:,}".format(price), "£{:,}".format(price))),
+        "main_renovation": str(renovation),
+        "main_architectplanning": str(rng.choice((0, 700, 1500))),
+        "main_building_control": str(rng.choice((0, 700))),
+        "main_furniture": str(rooms * rng.choice((400, 600))),
+        "main_survey": "600",
+        "main_legals": str(rng.choice((1500, 2500, 4000))),
+        "main_insurance": "550",
+        "main_sourcing": rng.choice((None, "3000", "5000")),
+        "main_rooms": str(rooms),
+        "main_rentm_rm_rate_reverse_calc": str(rent),
+        "main_lease_setup": rng.choice((None, "1200")),
+        "main_gross_development_value": str(int(price * rng.uniform(1.0, 1.5))),
+        "main_sdlt": rng.choice(("Resi", "Resi", "Chain-Break") if profile != "commercial"
+                                else ("Non-Resi", "Mixed-Use", "Land")),
+        "main_project_management_percentage": rng.choice((0, 10)),
+        "first_charge_lending_ltv": rng.choice((65, 70, 75)),
+        "mortgage_percent": rng.choice((5.5, 6, 6.5)),
+        "operational_expenses_percent": rng.choice((0, 10)),
+        "management_percent": rng.choice((0, 12)),
+        "int_first_charge_lending_ltv": 75,
+        "int_mortgage_percent": 7.5,
+        "int_operational_expenses_percent": rng.choice((0, 5)),
+        "int_management_percent": 0,
+    }
+    if profile == "prime":
+        deal.update({
+            "mortgage_type": "Repayment",
+            "mortgage_term_years": 25,
+            "fixed_rate_years": 5,
+            "reversion_rate": 8,
+            "rent_escalation_percent": 2,
+            "void_percent": 5,
+        })
+    return deal
+
+
+def corpora(deals, seed=20):
+    rng = random.Random(seed)
+    return {profile: [make_deal(rng, profile) for _ in range(deals)] for profile in ("hmo", "commercial", "prime")}
+
+
+def currency_corpora(size, seed=20):
+    rng = random.Random(seed)
+    amounts = [rng.randrange(100, 3000000) for _ in range(size)]
+    return {
+        "plain": [str(amount) for amount in amounts],
+        "formatted": ["£{:,}.00".format(amount) for amount in amounts],
+        "european": ["{:,}".format(amount).replace(",", ".") + ",00" for amount in amounts],
+        "blank": [rng.choice((None, "", "£")) for _ in range(size)],
+    }
+
+
+def new_doc(values):
+    return FinancialCalculatorNew(dict(values))
+
+
+def calculated_doc(values):
+    doc = new_doc(values)
+    doc.calculate()
+    return doc
+
+
+class Case:
+    """A benchmark: setup builds the arguments of each call, untimed"""
+
+    def __init__(self, name, setup, call):
+        self.name = name
+        self.setup = setup
+        self.call = call
+
+    def run(self, repeat):
+        """Best time per call over repeat runs, in microseconds, and the calls per run"""
+        best = None
+        for _ in range(repeat):
+            items = self.setup()
+            call = self.call
+            start = time.perf_counter()
+            for item in items:
+                call(item)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return best / len(items) * 1e6, len(items)
+
+
+def cold_docs(deals):
+    def setup():
+        # Every deal is evaluated, as on a first save
+        RESULT_CACHE.clear()
+        return [new_doc(values) for values in deals]
+    return setup
+
+
+def get_cases(deals, values):
+    cases = []
+    for profile, corpus in corpora(deals).items():
+        cases.append(Case("run_calculations/" + profile, cold_docs(corpus),
+                          FinancialCalculatorNew.run_calculations))
+
+        # Unchanged deals are served from the result cache, as on a repeated Calculate click
+        def warm(corpus=corpus):
+            for values in corpus:
+                calculated_doc(values)
+            return [new_doc(values) for values in corpus]
+        cases.append(Case("run_calculations_cached/" + profile, warm, FinancialCalculatorNew.run_calculations))
+
+    # Stages run against documents that have been calculated once, as a partial recalculation does.
+    # Each stage only rewrites what it computes from their stored fields, so the documents are shared.
+    stage_docs = []
+
+    def calculated_docs():
+        if not stage_docs:
+            stage_docs.extend(calculated_doc(deal) for corpus in corpora(deals).values() for deal in corpus)
+        return stage_docs
+
+    for node in CALCULATION_GRAPH.nodes:
+        cases.append(Case("stage/" + node.name, calculated_docs, getattr(FinancialCalculatorNew, node.name)))
+
+    # Every investor profile of a deal in one pass against one profile at a time
+    profile_inputs = [
+        {profile: kernel.DealInputs.from_fields(doc, profile.input_fields) for profile in kernel.PROFILES.values()}
+        for doc in calculated_docs()
+    ]
+    cases.append(Case("profiles/evaluate_profiles", lambda: profile_inputs, kernel.evaluate_profiles))
+    cases.append(Case("profiles/evaluate_each", lambda: profile_inputs,
+                      lambda deal: {profile: kernel.evaluate(inputs, profile) for profile, inputs in deal.items()}))
+
+    rng = random.Random(20)
+    prices =[float(rng.randrange(40000, 3000000)) for _ in range(values)]
+    for kind in sdlt.SCHEDULES:
+        cases.append(Case("sdlt/" + kind, lambda: prices, lambda price, kind=kind: sdlt.sdlt(kind, price)))
+    price_array = np.array(prices)
+    cases.append(Case("sdlt/vectorised", lambda: [price_array],
+                      lambda array: [sdlt.sdlt(kind, array) for kind in sdlt.SCHEDULES]))
+    typed = [(rng.choice(SDLT_TYPES), price) for price in prices]
+    cases.append(Case("sdlt/sdlt_uk", lambda: typed, lambda item: kernel.sdlt_uk(*item)))
+    cases.append(Case("sdlt/sdlt_int", lambda: typed, lambda item: kernel.sdlt_int(*item)))
+
+    def uncached(corpus):
+        # Parse every amount afresh rather than from the previous repeat's cache
+        currency._parse_text.cache_clear()
+        return corpus
+
+    for name, corpus in currency_corpora(values).items():
+        cases.append(Case("clean_currency/" + name, lambda corpus=corpus: uncached(corpus), kernel.clean_currency))
+    return cases
+
+
+def compare(results, baseline, threshold):
+    """Names of the cases slower than their baseline by more than threshold"""
+    regressions = []
+    print("{:<48} {:>12} {:>12} {:>8}".format("case", "baseline us", "current us", "change"))
+    for name, result in results.items():
+        before = baseline.get(name, {}).get("per_call_us")
+        current = result["per_call_us"]
+        if not before:
+            print("{:<48} {:>12} {:>12.2f} {:>8}".format(name, "-", current, "new"))
+            continue
+        change = current / before - 1
+        flag = ""
+        if change > threshold:
+            regressions.append(name)
+            flag = "  REGRESSED"
+        print("{:<48} {:>12.2f} {:>12.2f} {:>+7.0%}{}".format(name, before, current, change, flag))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--deals", type=int, default=50, help="deals per corpus")
+    parser.add_argument("--values", type=int, default=5000, help="prices and amounts per SDLT and currency case")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--filter", help="only run cases whose name contains this")
+    parser.add_argument("--threshold", type=float, default=THRESHOLD,
+                        help="allowed slowdown against the baseline, 0.2 for 20%%")
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--save-baseline", action="store_true", help="write the results as the new baseline")
+    args = parser.parse_args(argv)
+
+    results = {}
+    for case in get_cases(args.deals, args.values):
+        if args.filter and args.filter not in case.name:
+            continue
+        per_call, calls = case.run(args.repeat)
+        results[case.name] = {"per_call_us": round(per_call, 3), "calls": calls}
+
+    report = {
+        "recorded": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.platform(),
+        "cases": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=1, sort_keys=True)
+
+    if args.save_baseline:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                baseline = json.load(f).get("cases", {})
+        # A filtered run only replaces the cases it ran
+        report["cases"] = dict(baseline, **results)
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=1, sort_keys=True)
+        print("Saved {0} cases to {1}".format(len(results), args.baseline))
+        return 0
+
+    if not os.path.exists(args.baseline):
+        compare(results, {}, args.threshold)
+        print("\nNo baseline at {0}; record one with --save-baseline".format(args.baseline))
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline.get("cases", {}), args.threshold)
+    if baseline.get("machine") != report["machine"]:
+        print("\nBaseline recorded on {0}, not comparable with this machine; "
+              "record one here with --save-baseline".format(baseline.get("machine") or "an unknown machine"))
+        return 0
+    if regressions:
+        print("\n{0} case(s) regressed by more than {1:.0%}: {2}".format(
+            len(regressions), args.threshold, ", ".join(regressions)))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
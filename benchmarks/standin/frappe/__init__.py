@@ -0,0 +1,90 @@
+"""A lightweight stand-in for frappe, enough to run the calculator without a site.
+
+Only what the Financial Calculator New controller touches while calculating
+is provided. Messages are collected in memory and the cache is a dict, so a
+benchmark measures the calculator and nothing else.
+"""
+import json
+
+messages = []
+conf = {}
+
+
+class _dict(dict):
+    """dict with attribute access, as frappe._dict"""
+
+    __getattr__ = dict.get
+    __setattr__ = dict.__setitem__
+    __delattr__ = dict.__delitem__
+
+
+flags = _dict()
+
+
+class ValidationError(Exception):
+    pass
+
+
+def _(message, *args, **kwargs):
+    return message
+
+
+def whitelist(*args, **kwargs):
+    if args and callable(args[0]):
+        return args[0]
+    return lambda method: method
+
+
+def msgprint(message, *args, **kwargs):
+    messages.append(message)
+
+
+def throw(message, exc=ValidationError, *args, **kwargs):
+    raise exc(message)
+
+
+def parse_json(value):
+    return json.loads(value) if isinstance(value, str) else value
+
+
+def as_json(value, indent=1):
+    return json.dumps(value, indent=indent, sort_keys=True, default=str)
+
+
+def has_permission(*args, **kwargs):
+    return True
+
+
+class _Cache:
+    """In-memory stand-in for frappe.cache()"""
+
+    def __init__(self):
+        self.values = {}
+
+    def get_value(self, key, *args, **kwargs):
+        return self.values.get(key)
+
+    def set_value(self, key, value, *args, **kwargs):
+        self.values[key] = value
+
+    def delete_value(self, key, *args, **kwargs):
+        self.values.pop(key, None)
+
+    def delete_keys(self, prefix):
+        self.values = {key: value for key, value in self.values.items() if not str(key).startswith(prefix)}
+
+    def hget(self, name, key, *args, **kwargs):
+        return self.values.get((name, key))
+
+    def hset(self, name, key, value, *args, **kwargs):
+        self.values[(name, key)] = value
+
+    def hgetall(self, name):
+        return {key[1]: value for key, value in self.values.items() if isinstance(key, tuple) and key[0] == name}
+
+
+_cache = _Cache()
+
+
+def cache():
+    return _cache
@@ -0,0 +1,53 @@
+import frappe
+
+
+class _Row(frappe._dict):
+    """A child table row"""
+
+    def set(self, fieldname, value):
+        self[fieldname] = value
+
+
+class Document:
+    """Field values held as attributes; unset fields read as None, as they do on a loaded document"""
+
+    def __init__(self, *args, **kwargs):
+        values = args[0] if args and isinstance(args[0], dict) else kwargs
+        self.__dict__["flags"] = frappe._dict()
+        self.__dict__["_doc_before_save"] = None
+        for fieldname, value in values.items():
+            setattr(self, fieldname, value)
+
+    def __getattr__(self, fieldname):
+        if fieldname.startswith("_"):
+            raise AttributeError(fieldname)
+        return None
+
+    def get(self, fieldname, default=None):
+        return self.__dict__.get(fieldname, default)
+
+    def set(self, fieldname, value):
+        setattr(self, fieldname, value)
+
+    def update(self, values):
+        for fieldname, value in values.items():
+            setattr(self, fieldname, value)
+        return self
+
+    def append(self, table, values=None):
+        rows = self.__dict__.get(table)
+        if rows is None:
+            rows = self.__dict__[table] = []
+        row = _Row(values or {})
+        row.idx = len(rows) + 1
+        rows.append(row)
+        return row
+
+    def get_doc_before_save(self):
+        return self._doc_before_save
+
+    def as_dict(self, *args, **kwargs):
+        return {
+            fieldname: value for fieldname, value in self.__dict__.items()
+            if not fieldname.startswith("_") and fieldname != "flags"
+        }
@@ -0,0 +1,15 @@
+def cint(value):
+    try:
+        return int(float(value or 0))
+    except (TypeError, ValueError):
+        return 0
+
+
+def flt(value, precision=None):
+    if isinstance(value, str):
+        value = value.replace(",", "")
+    try:
+        value = float(value or 0)
+    except (TypeError, ValueError):
+        value = 0.0
+    return round(value, precision) if precision is not None else value
@@ -0,0 +1,17 @@
+from financial_calculator_app.calculator.kernel import (
+    DealInputs,
+    InvestorProfile,
+    InvestorResult,
+    INT_INPUT_FIELDS,
+    INT_PROFILE,
+    INT_RESULT_FIELDS,
+    PROFILES,
+    UK_INPUT_FIELDS,
+    UK_PROFILE,
+    UK_RESULT_FIELDS,
+    clean_currency,
+    evaluate,
+    evaluate_int,
+    evaluate_profiles,
+    evaluate_uk,
+)
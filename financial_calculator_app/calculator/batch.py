@@ -0,0 +1,173 @@
+"""NumPy batch evaluation of many deals at once.
+
+Columns are keyed by the DealInputs names from the kernel and hold one value
+per deal. Every array operation mirrors the scalar kernel step for step so a
+batch gives the same figures as evaluating each deal through the document.
+"""
+import numpy as np
+
+from financial_calculator_app.calculator import growth, kernel, sdlt
+
+BATCH_RESULTS = (
+    'sdlt_amount',
+    'lending_and_brokerage_fees',
+    'capital_in',
+    'uplift',
+    'first_charge_lending',
+    'capital_released',
+    'capital_left_in',
+    'gross_rent_pa',
+    'mortgage_pa',
+    'operational_expenses_pa',
+    'management_pa',
+    'net_cash_flow_pa',
+    'capital_value_10yr',
+    'capital_gain',
+    'lifetime_cashflow',
+    'total_return',
+    'annualised_roi',
+    'lifetime_roi',
+)
+
+
+def as_columns(columns):
+    """Normalise a mapping of input columns to float arrays of equal length"""
+    unknown = set(columns) - set(kernel.DealInputs.__slots__)
+    if unknown:
+        raise TypeError("Unknown deal inputs: {0}".format(", ".join(sorted(unknown))))
+
+    size = None
+    for name, values in columns.items():
+        length = np.size(values)
+        if size is None:
+            size = length
+        elif length != size:
+            raise ValueError("Column {0} has {1} rows, expected {2}".format(name, length, size))
+    size = size or 0
+
+    normalised = {}
+    for name in kernel.DealInputs.__slots__:
+        values = columns.get(name)
+        if name == 'sdlt_type':
+            normalised[name] = np.asarray(values if values is not None else [None] * size, dtype=object)
+        elif values is None:
+            normalised[name] = np.zeros(size)
+        else:
+            normalised[name] = np.asarray(values, dtype=float)
+    return normalised
+
+
+def sdlt_amounts(profile, sdlt_type, price):
+    """SDLT due under an investor profile for every deal"""
+    kinds = [profile.sdlt_schedule(value) for value in sdlt_type]
+    amount = np.zeros(len(price))
+    for kind in set(kinds) - {None}:
+        due = np.fromiter((value == kind for value in kinds), dtype=bool, count=len(kinds))
+        amount[due] = sdlt.sdlt(kind, price[due])
+    if profile.sdlt_digits is not None:
+        amount = np.round(amount, profile.sdlt_digits)
+    return np.where(price != 0, amount, 0.0)
+
+
+def sdlt_uk(sdlt_type, price):
+    return sdlt_amounts(kernel.UK_PROFILE, sdlt_type, price)
+
+
+def sdlt_int(sdlt_type, price):
+    return sdlt_amounts(kernel.INT_PROFILE, sdlt_type, price)
+
+
+def lending_and_brokerage_fees(price):
+    loan_amount = price * 0.75
+    fees = (600 + 500 + 350 + 1500) + loan_amount * 0.03
+    return np.where(price != 0, np.round(fees), 0.0)
+
+
+def _round_percent(numerator, denominator):
+    """round(numerator / denominator * 100, 2), 0 where the denominator is 0"""
+    safe = np.where(denominator != 0, denominator, 1.0)
+    return np.where(denominator != 0, np.round((numerator / safe) * 100, 2), 0.0)
+
+
+def evaluate_batch(columns, profile=None, projection=None, growth_rates=None):
+    """Evaluate one investor view for every deal in the columns.
+
+    growth_rates optionally gives each deal its own flat growth rate over the
+    projection horizon instead of the projection's rates.
+    """
+    profile = kernel.get_profile(profile)
+    c = as_columns(columns)
+    n = len(c['purchase_price'])
+    r = {}
+
+    r['sdlt_amount'] = sdlt_amounts(profile, c['sdlt_type'], c['purchase_price'])
+    if profile.lending_fees:
+        r['lending_and_brokerage_fees'] = lending_and_brokerage_fees(c['purchase_price'])
+    else:
+        r['lending_and_brokerage_fees'] = np.zeros(n)
+
+    # Acquisition costs
+    total = 0
+    for name in ('purchase_price', 'renovation', 'architectplanning', 'building_control',
+                 'furniture', 'survey', 'legals', 'insurance', 'sourcing'):
+        total = total + c[name]
+    total = total + r['sdlt_amount']
+    for name in profile.extra_costs:
+        total = total + c[name]
+    if profile.lending_fees:
+        total = total + r['lending_and_brokerage_fees']
+    r['capital_in'] = total
+
+    # Post works refinance
+    gdv = c['gross_development_value']
+    r['uplift'] = gdv - c['purchase_price']
+    r['first_charge_lending'] = gdv * (c['first_charge_lending_ltv'] / 100)
+    total_investment = c['purchase_price'] + c['renovation'] + c['architectplanning'] + \
+        c['building_control'] + c['furniture'] + r['sdlt_amount'] + c['survey'] + \
+        c['legals'] + c['insurance'] + c['sourcing']
+    for name in profile.extra_costs:
+        total_investment = total_investment + c[name]
+    if profile.lending_fees:
+        total_investment = total_investment + r['lending_and_brokerage_fees']
+    r['capital_left_in'] = total_investment - r['first_charge_lending']
+    if profile.release_from_investment:
+        r['capital_released'] = total_investment - r['capital_left_in']
+    else:
+        r['capital_released'] = r['first_charge_lending']
+
+    # Rental income
+    rooms = c['rooms']
+    safe_rooms = np.where(rooms != 0, rooms, 1.0)
+    average_rate = np.where(rooms != 0, (c['rent_per_month'] * 12) / 52 / safe_rooms, 0.0)
+    r['gross_rent_pa'] = rooms * average_rate * 52
+    mortgage_pa = r['first_charge_lending'] * (c['mortgage_percent'] / 100)
+    r['mortgage_pa'] = np.round(mortgage_pa) if profile.round_mortgage else mortgage_pa
+    r['operational_expenses_pa'] = r['gross_rent_pa'] * (c['operational_expenses_percent'] / 100)
+    r['management_pa'] = r['gross_rent_pa'] * (c['management_percent'] / 100)
+    r['net_cash_flow_pa'] = np.round(
+        r['gross_rent_pa'] - r['mortgage_pa'] - r['operational_expenses_pa'] - r['management_pa']
+    )
+
+    # Capital gain and returns
+    projection = projection or growth.get_projection()
+    if growth_rates is None:
+        r['capital_value_10yr'] = projection.value_at(gdv)
+    else:
+        # A flat growth rate per deal over the projection horizon
+        r['capital_value_10yr'] = gdv * (1 + np.asarray(growth_rates, dtype=float)) ** projection.years
+    r['capital_gain'] = r['capital_value_10yr'] - r['first_charge_lending'] - r['capital_left_in']
+    r['lifetime_cashflow'] = r['net_cash_flow_pa'] * projection.years
+    r['total_return'] = r['lifetime_cashflow'] + r['capital_gain']
+    r['annualised_roi'] = _round_percent(r['net_cash_flow_pa'], r['capital_left_in'])
+    r['lifetime_roi'] = _round_percent(r['total_return'], r['capital_left_in'])
+    return r
+
+
+def evaluate_uk_batch(columns, projection=None, growth_rates=None):
+    """Evaluate the UK investor view for every deal in the columns"""
+    return evaluate_batch(columns, kernel.UK_PROFILE, projection, growth_rates)
+
+
+def evaluate_int_batch(columns, projection=None, growth_rates=None):
+    """Evaluate the international investor view for every deal in the columns"""
+    return evaluate_batch(columns, kernel.INT_PROFILE, projection, growth_rates)
@@ -0,0 +1,149 @@
+"""Shared cache of deal evaluations.
+
+Results are keyed by a canonical hash of the deal inputs, the investor profile,
+the growth projection and the rate assumptions in force, so identical deals -
+the Proposed and Actual copies of a forecast, duplicated documents, repeated
+Calculate clicks - are evaluated once. An in-process LRU tier with a TTL sits
+in front of an optional shared tier such as frappe.cache().
+
+Cached results are shared between callers and must be treated as read-only.
+"""
+import hashlib
+import json
+import time
+from collections import OrderedDict
+
+from financial_calculator_app.calculator import growth, kernel, sdlt
+
+
+def assumptions_key(on_date=None):
+    """The rate assumptions in force, part of every key so a rate change misses"""
+    return [
+        (schedule.kind, schedule.effective_from.isoformat(), schedule.threshold, schedule.bands)
+        for schedule in (sdlt.get_schedule(kind, on_date) for kind in sorted(sdlt.SCHEDULES))
+    ]
+
+
+def result_key(inputs, profile=None, projection=None):
+    """Canonical hash of everything an evaluation depends on"""
+    projection = projection or growth.get_projection()
+    payload = [
+        kernel.CALCULATION_VERSION,
+        kernel.get_profile(profile).settings(),
+        sorted(inputs.as_dict().items()),
+        projection.rates.tolist(),
+        assumptions_key(),
+    ]
+    return hashlib.sha1(json.dumps(payload, default=str).encode()).hexdigest()
+
+
+class ResultCache:
+    """LRU cache of InvestorResults with a TTL and an optional shared tier.
+
+    shared is a callable returning an object with get_value, set_value and
+    delete_keys (frappe.cache), or None when the shared tier is disabled.
+    """
+
+    def __init__(self, maxsize=1024, ttl=3600, shared=None, namespace="financial_calculator_result"):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.shared = shared
+        self.namespace = namespace
+        self._entries = OrderedDict()
+        self.reset_stats()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def reset_stats(self):
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def stats(self):
+        """Hit, miss and eviction counters with the current size"""
+        lookups = self.hits + self.shared_hits + self.misses
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "shared_hits": self.shared_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round((self.hits + self.shared_hits) / lookups, 4) if lookups else 0,
+        }
+
+    def _shared_cache(self):
+        return self.shared() if self.shared else None
+
+    def _shared_key(self, key):
+        return "{0}:{1}".format(self.namespace, key)
+
+    def get(self, key):
+        """Cached result for a key, None on a miss"""
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires, value = entry
+            if expires > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+            del self._entries[key]
+
+        shared = self._shared_cache()
+        if shared is not None:
+            value = shared.get_value(self._shared_key(key))
+            if value is not None:
+                self.shared_hits += 1
+                self._store(key, value)
+                return value
+
+        self.misses += 1
+        return None
+
+    def set(self, key, value):
+        self._store(key, value)
+        shared = self._shared_cache()
+        if shared is not None:
+            shared.set_value(self._shared_key(key), value, expires_in_sec=self.ttl)
+
+    def _store(self, key, value):
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        """Drop every cached result from both tiers"""
+        self._entries.clear()
+        shared = self._shared_cache()
+        if shared is not None:
+            shared.delete_keys(self.namespace)
+
+    def evaluate(self, inputs, profile=None, projection=None):
+        """Evaluate one investor view of a deal, served from the cache when possible"""
+        profile = kernel.get_profile(profile)
+        return self.evaluate_profiles({profile: inputs}, projection)[profile]
+
+    def evaluate_profiles(self, inputs_by_profile, projection=None):
+        """Evaluate several investor views of a deal, the uncached ones together in one pass"""
+        projection = projection or growth.get_projection()
+        results = {}
+        missing = {}
+        for profile, inputs in inputs_by_profile.items():
+            key = result_key(inputs, profile, projection)
+            result = self.get(key)
+            if result is None:
+                missing[profile] = (key, inputs)
+            else:
+                results[profile] = result
+
+        if missing:
+            evaluated = kernel.evaluate_profiles(
+                {profile: inputs for profile, (key, inputs) in missing.items()}, projection)
+            for profile, (key, inputs) in missing.items():
+                self.set(key, evaluated[profile])
+            results.update(evaluated)
+        return results
@@ -0,0 +1,253 @@
+"""Monthly cash-flow engine.
+
+The headline figures treat the mortgage as interest-only and the lifetime
+cash flow as ten copies of year one. This engine builds the investor's
+monthly equity cash flows instead: rent with yearly escalation and voids,
+operating costs, interest-only or repayment mortgage payments with an
+optional fixed-rate period before a reversion rate, and the sale of the
+property less the outstanding loan at the end of the horizon. From those it
+derives IRR, NPV and equity multiple.
+
+Everything works on arrays with one row per deal, so the same code prices a
+single document on save or the whole book in a batch.
+"""
+from collections import namedtuple
+
+import numpy as np
+
+from financial_calculator_app.calculator import growth
+
+INTEREST_ONLY = "Interest Only"
+REPAYMENT = "Repayment"
+MORTGAGE_TYPES = (INTEREST_ONLY, REPAYMENT)
+
+# Rates are annual fractions. reversion_rate None keeps the initial rate
+# after the fixed period.
+CashFlowAssumptions = namedtuple("CashFlowAssumptions", [
+    "mortgage_type",
+    "term_years",
+    "fixed_years",
+    "reversion_rate",
+    "rent_escalation",
+    "void_rate",
+    "discount_rate",
+], defaults=[INTEREST_ONLY, 25, 0, None, 0.0, 0.0, 0.08])
+
+CASH_FLOW_RESULTS = ('irr', 'npv', 'equity_multiple')
+
+IRR_TOLERANCE = 1e-10
+IRR_ITERATIONS = 50
+
+
+def _column(value, size):
+    return np.broadcast_to(np.asarray(value, dtype=float), (size,)).copy()
+
+
+def _annuity(principal, rate, months):
+    """Level monthly payment repaying principal over months at a monthly rate"""
+    months = np.maximum(months, 1)
+    safe_rate = np.where(rate != 0, rate, 1.0)
+    return np.where(rate != 0, principal * safe_rate / (1 - (1 + safe_rate) ** -months), principal / months)
+
+
+def _balance(principal, rate, payment, months):
+    """Outstanding balance after paying `payment` for `months` at a monthly rate"""
+    safe_rate = np.where(rate != 0, rate, 1.0)
+    with np.errstate(over="ignore", invalid="ignore"):
+        factor = (1 + safe_rate) ** months
+        balance = np.where(rate != 0, principal * factor - payment * (factor - 1) / safe_rate, principal - payment * months)
+    return np.maximum(balance, 0)
+
+
+def mortgage_schedule(principal, annual_rate, months, repayment, term_years=25, fixed_years=0, reversion_rate=None):
+    """Monthly payments (deals x months) and the balance left after the last month.
+
+    The initial rate applies for fixed_years, the reversion rate after that;
+    repayment mortgages are re-amortised over the remaining term when the
+    rate changes.
+    """
+    principal = np.atleast_1d(np.asarray(principal, dtype=float))
+    size = len(principal)
+    initial = _column(annual_rate, size) / 12
+    reversion = initial if reversion_rate is None else _column(reversion_rate, size) / 12
+    # A blank reversion rate in a batch keeps that deal's initial rate
+    reversion = np.where(np.isnan(reversion), initial, reversion)
+    repayment = np.broadcast_to(np.asarray(repayment, dtype=bool), (size,))
+    term = _column(term_years, size) * 12
+    fixed = np.minimum(_column(fixed_years, size) * 12, term)
+
+    month = np.arange(1, months + 1)
+    in_fixed = month[None, :] <= fixed[:, None]
+    in_term = month[None, :] <= term[:, None]
+    rate = np.where(in_fixed, initial[:, None], reversion[:, None])
+
+    # Repayment: level payment for the fixed period, re-amortised on reversion
+    first_payment = _annuity(principal, initial, term)
+    reverted_balance = _balance(principal, initial, first_payment, fixed)
+    second_payment = _annuity(reverted_balance, reversion, term - fixed)
+    level = np.where(in_fixed, first_payment[:, None], second_payment[:, None])
+
+    paid = np.minimum(months, term)
+    after_fixed = np.maximum(paid - fixed, 0)
+    repaid_balance = np.where(
+        paid <= fixed,
+        _balance(principal, initial, first_payment, paid),
+        _balance(reverted_balance, reversion, second_payment, after_fixed),
+    )
+    # Interest-only loans still owe the full principal; both are cleared at term
+    repaid_balance = np.where(months >= term, 0.0, repaid_balance)
+    interest_only_balance = np.where(months >= term, 0.0, principal)
+
+    payments = np.where(repayment[:, None], level, principal[:, None] * rate)
+    # Interest-only loans repay the principal with the last payment of the term
+    balloon = (month[None, :] == term[:, None]) & ~repayment[:, None]
+    payments = np.where(in_term, payments, 0.0) + np.where(balloon, principal[:, None], 0.0)
+    balance = np.where(repayment, repaid_balance, interest_only_balance)
+    return payments, balance
+
+
+def equity_cash_flows(equity, gross_rent_pa, cost_rate, principal, mortgage_rate, sale_value,
+                      assumptions=None, years=growth.PROJECTION_YEARS):
+    """Monthly equity cash flows (deals x months + 1), month 0 being the equity left in"""
+    assumptions = assumptions or CashFlowAssumptions()
+    equity = np.atleast_1d(np.asarray(equity, dtype=float))
+    size = len(equity)
+    months = years * 12
+
+    # Rent steps up once a year and loses the void share
+    year = (np.arange(months) // 12)[None, :]
+    escalation = (1 + _column(assumptions.rent_escalation, size)[:, None]) ** year
+    rent = _column(gross_rent_pa, size)[:, None] / 12 * escalation * (1 - _column(assumptions.void_rate, size)[:, None])
+    operating = rent * (1 - _column(cost_rate, size)[:, None])
+
+    payments, balance = mortgage_schedule(
+        principal, mortgage_rate, months,
+        np.asarray(assumptions.mortgage_type) == REPAYMENT,
+        assumptions.term_years, assumptions.fixed_years, assumptions.reversion_rate,
+    )
+
+    flows = np.empty((size, months + 1))
+    flows[:, 0] = -equity
+    flows[:, 1:] = operating - payments
+    flows[:, -1] += _column(sale_value, size) - balance
+    return flows
+
+
+def npv(flows, annual_rate):
+    """Net present value of monthly flows at an annual discount rate"""
+    monthly = (1 + _column(annual_rate, len(flows))) ** (1 / 12) - 1
+    t = np.arange(flows.shape[1])
+    return (flows * (1 + monthly[:, None]) ** -t).sum(axis=1)
+
+
+def irr(flows):
+    """Annual IRR of monthly flows, NaN where it is undefined.
+
+    Newton's method on all deals at once, started below the root so it
+    converges from one side in a handful of steps; any deal it fails on is
+    finished by bisection, which always converges for a conventional
+    investment (an outflow followed by net inflows).
+    """
+    t = np.arange(flows.shape[1])
+    weighted = flows * t
+    # Only flows with both signs have an IRR
+    defined = (flows.min(axis=1) < 0) & (flows.max(axis=1) > 0)
+
+    rate = _irr_guess(flows)
+    converged = ~defined
+    with np.errstate(all="ignore"):
+        for _ in range(IRR_ITERATIONS):
+            discount = (1 + rate[:, None]) ** -t
+            value = (flows * discount).sum(axis=1)
+            slope = (weighted * discount).sum(axis=1) / -(1 + rate)
+            step = np.where(converged, 0.0, value / slope)
+            rate = rate - step
+            converged |= np.abs(step) < IRR_TOLERANCE
+            if converged.all():
+                break
+
+    retry = defined & ~(converged & np.isfinite(rate) & (rate > -1))
+    if retry.any():
+        rate[retry] = _bisect_irr(flows[retry], t)
+    rate[~defined] = np.nan
+    return (1 + rate) ** 12 - 1
+
+
+def _irr_guess(flows):
+    """Monthly rate growing the equity into everything returned, as if it all came back at the end.
+
+    Returning any of it earlier only raises the IRR, so this is at or below
+    the root for a conventional investment.
+    """
+    equity = -flows[:, 0]
+    returned = flows[:, 1:].sum(axis=1)
+    with np.errstate(all="ignore"):
+        guess = (returned / equity) ** (1 / (flows.shape[1] - 1)) - 1
+    return np.where(np.isfinite(guess) & (guess > -1), guess, 0.01)
+
+
+def _bisect_irr(flows, t, low=-0.99, high=1.0, iterations=100):
+    low = np.full(len(flows), low)
+    high = np.full(len(flows), high)
+    sign_low = np.sign((flows * (1 + low[:, None]) ** -t).sum(axis=1))
+    for _ in range(iterations):
+        mid = (low + high) / 2
+        value = (flows * (1 + mid[:, None]) ** -t).sum(axis=1)
+        same = np.sign(value) == sign_low
+        low = np.where(same, mid, low)
+        high = np.where(same, high, mid)
+    sign_high = np.sign((flows * (1 + high[:, None]) ** -t).sum(axis=1))
+    return np.where(sign_low != sign_high, (low + high) / 2, np.nan)
+
+
+def equity_multiple(flows):
+    """Everything returned to the investor per pound of equity left in"""
+    equity = -flows[:, 0]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(equity > 0, flows[:, 1:].sum(axis=1) / equity, np.nan)
+
+
+def evaluate_batch(columns, assumptions=None, projection=None):
+    """IRR, NPV and equity multiple for deals given as columns.
+
+    columns holds capital_left_in, first_charge_lending, gross_rent_pa and
+    gross_development_value from the kernel, plus mortgage_percent,
+    operational_expenses_percent and management_percent as percentages.
+    """
+    assumptions = assumptions or CashFlowAssumptions()
+    projection = projection or growth.get_projection()
+    cost_rate = (np.asarray(columns['operational_expenses_percent'], dtype=float) +
+                 np.asarray(columns['management_percent'], dtype=float)) / 100
+    flows = equity_cash_flows(
+        columns['capital_left_in'],
+        columns['gross_rent_pa'],
+        cost_rate,
+        columns['first_charge_lending'],
+        np.asarray(columns['mortgage_percent'], dtype=float) / 100,
+        projection.value_at(np.asarray(columns['gross_development_value'], dtype=float)),
+        assumptions,
+        projection.years,
+    )
+    return {
+        'irr': irr(flows),
+        'npv': npv(flows, assumptions.discount_rate),
+        'equity_multiple': equity_multiple(flows),
+    }
+
+
+def evaluate(inputs, result, assumptions=None, projection=None):
+    """IRR, NPV and equity multiple for one investor view, None where undefined"""
+    columns = {
+        'capital_left_in': [result.capital_left_in],
+        'first_charge_lending': [result.first_charge_lending],
+        'gross_rent_pa': [result.gross_rent_pa],
+        'gross_development_value': [inputs.gross_development_value],
+        'mortgage_percent': [inputs.mortgage_percent],
+        'operational_expenses_percent': [inputs.operational_expenses_percent],
+        'management_percent': [inputs.management_percent],
+    }
+    metrics = evaluate_batch(columns, assumptions, projection)
+    return {
+        name: float(values[0]) if np.isfinite(values[0]) else None
+        for name, values in metrics.items()
+    }
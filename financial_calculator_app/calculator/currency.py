@@ -0,0 +1,231 @@
+"""Parsing of currency amounts typed into forms or read from sheets.
+
+Amounts arrive as plain numbers ("250000", "-1250.5"), UK formatted strings
+("£1,250,000.00"), European ones ("1.250.000,00", "1 250 000,00") and
+accounting negatives ("(1,250)"). Each value is read by a single
+precompiled pattern of a locale's decimal and group separators, sign and
+currency symbol included. With AUTO, plain numbers and UK amounts match the
+default pattern at once and only the rest have their separators inferred.
+A misplaced separator is an error instead of a silently different number.
+
+parse_amounts parses a whole column at once, as an import or a batch
+evaluation needs: a numeric column converts in one NumPy call, and the
+distinct strings of any other column are read by one regex scan over the
+joined column.
+"""
+import math
+import re
+from collections import namedtuple
+from functools import lru_cache
+
+import numpy as np
+
+CurrencyFormat = namedtuple("CurrencyFormat", ["decimal", "group"])
+
+LOCALES = {
+    "en_GB": CurrencyFormat(".", ","),
+    "en_US": CurrencyFormat(".", ","),
+    "de_DE": CurrencyFormat(",", "."),
+    "es_ES": CurrencyFormat(",", "."),
+    "it_IT": CurrencyFormat(",", "."),
+    "nl_NL": CurrencyFormat(",", "."),
+    "fr_FR": CurrencyFormat(",", " "),
+    "de_CH": CurrencyFormat(".", "'"),
+}
+DEFAULT_LOCALE = "en_GB"
+# Infer the separators from each value instead of assuming a locale
+AUTO = "auto"
+
+# Currency symbols and codes, percent signs and spacing that may surround an amount,
+# given the class of spacing allowed
+_SURROUNDING = r"[{0}£$€¥%A-Z]*"
+# Spaces used as group separators
+_SPACES = "\u0020\u00a0\u202f\u2009"
+# Everything that may surround the digits, signs included
+_AROUND = "£$€¥%()-\t\r\nABCDEFGHIJKLMNOPQRSTUVWXYZ" + _SPACES
+_SPACE = re.compile("[{0}]".format(_SPACES))
+# Formats infer_format returns, by decimal mark or by space group and decimal mark
+_INFERRED = {
+    ".": CurrencyFormat(".", ","),
+    ",": CurrencyFormat(",", "."),
+    "'": CurrencyFormat(".", "'"),
+    " .": CurrencyFormat(".", " "),
+    " ,": CurrencyFormat(",", " "),
+}
+_PATTERNS = {}
+
+
+def get_format(locale=None):
+    """Separators for a locale name or a CurrencyFormat; None is the default locale"""
+    if isinstance(locale, CurrencyFormat):
+        return locale
+    try:
+        return LOCALES[locale or DEFAULT_LOCALE]
+    except KeyError:
+        raise ValueError("Unknown number locale {0}".format(locale)) from None
+
+
+def infer_format(text):
+    """Separators implied by a value.
+
+    Where both separators appear the last one is the decimal mark, a mark
+    repeated is a group separator, and a single mark is a decimal mark unless
+    exactly three digits follow it - which is ambiguous and read the default
+    locale's way.
+    """
+    if "'" in text:
+        return _INFERRED["'"]
+    if _SPACE.search(text):
+        return _INFERRED[" ,"] if "," in text else _INFERRED[" ."]
+
+    last_dot, last_comma = text.rfind("."), text.rfind(",")
+    if last_dot >= 0 and last_comma >= 0:
+        return _INFERRED["." if last_dot > last_comma else ","]
+    mark = "." if last_dot >= 0 else "," if last_comma >= 0 else None
+    if mark is None or len(text) - text.rfind(mark) - 1 == 3 and text.count(mark) == 1:
+        return get_format()
+    if text.count(mark) > 1:
+        return _INFERRED["," if mark == "." else "."]
+    return _INFERRED[mark]
+
+
+def _pattern(locale):
+    """Compiled regexes of an amount in a locale, its group separators and its decimal mark.
+
+    The number is digits grouped in threes or not grouped at all, then the
+    decimals, with an optional minus sign or parentheses and any currency
+    symbol around it. The first regex matches one value; the second matches
+    every line of a newline-joined column, with an empty number where the
+    line is not an amount.
+    """
+    compiled = _PATTERNS.get(locale)
+    if compiled is None:
+        number_format = get_format(locale)
+        decimal = re.escape(number_format.decimal)
+        groups = tuple(_SPACES) if number_format.group == " " else (number_format.group,)
+        group = "[{0}]".format("".join(re.escape(mark) for mark in groups))
+        body = (
+            r"{s}(?:(?P<open>\(){s})?(?:(?P<minus>-){s})?"
+            r"(?P<number>(?=\d|{d}\d)(?:\d{{1,3}}(?:{g}\d{{3}})+|\d*)(?:{d}\d*)?)"
+            r"{s}(?:(?P<close>\)){s})?"
+        )
+        pattern = re.compile("^{0}$".format(body.format(s=_SURROUNDING.format(r"\s"), d=decimal, g=group)))
+        lines = re.compile("^(?:{0}|.*)$".format(
+            body.format(s=_SURROUNDING.format(r" \t\r\f\v" + _SPACES), d=decimal, g=group)), re.MULTILINE)
+        compiled = _PATTERNS[locale] = pattern, lines, groups, number_format.decimal
+    return compiled
+
+
+def parse_amount(value, locale=DEFAULT_LOCALE, default=None):
+    """An amount as a float, default when blank.
+
+    locale is a locale name, a CurrencyFormat or AUTO. Raises ValueError
+    when the value is not an amount in that format.
+    """
+    if value is None:
+        return default
+    if not isinstance(value, str):
+        return float(value)
+    # Fast path: whole numbers, and decimals where the decimal mark is a point
+    digits = value.removeprefix("-")
+    if digits.isdecimal() or digits.replace(".", "", 1).isdecimal() and _point_decimal(locale):
+        return float(value)
+    amount = _parse_text(value, locale)
+    return default if amount is None else amount
+
+
+# Forms and sheets repeat the same few amounts, so formatted strings are parsed once
+@lru_cache(maxsize=4096)
+def _parse_text(value, locale):
+    """A formatted amount as a float, None when blank"""
+    # The default locale's pattern reads UK amounts too, so AUTO only infers for the rest
+    pattern, lines, groups, decimal = _pattern(DEFAULT_LOCALE if locale == AUTO else locale)
+    match = pattern.match(value)
+    if match is None and locale == AUTO:
+        text = value.strip(_AROUND)
+        # A lone currency symbol or dash is an empty cell
+        if not text:
+            return None
+        pattern, lines, groups, decimal = _pattern(infer_format(text))
+        match = pattern.match(value)
+    if match is None:
+        if not value.strip(_AROUND):
+            return None
+        # Exponents and the like that only float() reads
+        try:
+            amount = float(value) if _point_decimal(locale) else math.nan
+        except ValueError:
+            amount = math.nan
+        if not math.isfinite(amount):
+            raise ValueError("{0!r} is not an amount".format(value))
+        return amount
+
+    opening, minus, number, closing = match.groups()
+    if (opening is None) != (closing is None):
+        raise ValueError("{0!r} is not an amount".format(value))
+    for group in groups:
+        number = number.replace(group, "")
+    if decimal != ".":
+        number = number.replace(decimal, ".")
+    negative = (opening is not None) != (minus is not None)
+    return -float(number) if negative else float(number)
+
+
+def _point_decimal(locale):
+    return locale == AUTO or get_format(locale).decimal == "."
+
+
+def parse_amounts(values, locale=DEFAULT_LOCALE):
+    """A column of amounts as a float array, NaN where a value is blank or not an amount"""
+    values = list(values)
+    # Fast path: a column of numbers and blanks, or of plain number strings
+    # where NumPy reads the decimal mark the locale's way
+    if _point_decimal(locale) or not any(isinstance(value, str) for value in values):
+        try:
+            amounts = np.array([np.nan if value is None else value for value in values], dtype=float)
+        except (TypeError, ValueError):
+            pass
+        else:
+            amounts[~np.isfinite(amounts)] = np.nan
+            return amounts
+
+    strings = list(dict.fromkeys(value for value in values if isinstance(value, str)))
+    parsed = dict(zip(strings, _parse_column(strings, locale)))
+    return np.array([
+        parsed[value] if isinstance(value, str) else np.nan if value is None else float(value)
+        for value in values
+    ])
+
+
+def _parse_column(strings, locale):
+    """Amounts of distinct strings, NaN where one is blank or not an amount.
+
+    One regex scan over the joined column reads every well-formed amount and
+    NumPy converts them together; only the strings it cannot read, such as
+    European amounts under AUTO, go through parse_amount one at a time.
+    """
+    if not strings:
+        return np.empty(0)
+    pattern, lines, groups, decimal = _pattern(DEFAULT_LOCALE if locale == AUTO else locale)
+    rows = lines.findall("\n".join(strings))
+    if len(rows) != len(strings):
+        # A string holds a line break; read them all one at a time
+        rows = [("", "", "", "")] * len(strings)
+    openings, minuses, numbers, closings = zip(*rows)
+
+    numbers = "\n".join(numbers)
+    for group in groups:
+        numbers = numbers.replace(group, "")
+    if decimal != ".":
+        numbers = numbers.replace(decimal, ".")
+    amounts = np.array([number or "nan" for number in numbers.split("\n")], dtype=float)
+    opened = np.array(openings) != ""
+    amounts[opened != (np.array(minuses) != "")] *= -1
+    amounts[opened != (np.array(closings) != "")] = np.nan
+
+    for i in np.flatnonzero(np.isnan(amounts)):
+        try:
+            amounts[i] = parse_amount(strings[i], locale, np.nan)
+        except ValueError:
+            amounts[i] = np.nan
+    return amounts
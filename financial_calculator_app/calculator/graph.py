@@ -0,0 +1,111 @@
+"""Dependency graph for incremental recalculation.
+
+Each node is one calculation step that reads a set of fields and writes
+another. Given the fields that changed, the graph works out which steps are
+dirty and returns them in dependency order, so a save only reruns the part of
+the pipeline that can be affected.
+"""
+
+
+class CalculationNode:
+    """One calculation step: a method on the target reading inputs and writing outputs"""
+    __slots__ = ("name", "method", "inputs", "outputs", "mapping")
+
+    def __init__(self, method, inputs=(), outputs=(), name=None, mapping=None):
+        self.method = method
+        self.name = name or method
+        # A mapping node copies each input to one output, so only the outputs
+        # of changed inputs become dirty
+        self.mapping = dict(mapping) if mapping is not None else None
+        if mapping is not None:
+            inputs, outputs = self.mapping.keys(), self.mapping.values()
+        self.inputs = frozenset(inputs)
+        self.outputs = frozenset(outputs)
+
+    def dirty_outputs(self, dirty):
+        """Outputs made dirty by running this node for a set of dirty fields"""
+        if self.mapping is None:
+            return self.outputs
+        return frozenset(self.mapping[field] for field in self.inputs & dirty) | (self.outputs & dirty)
+
+    def as_dict(self):
+        return {
+            "name": self.name,
+            "method": self.method,
+            "inputs": sorted(self.inputs),
+            "outputs": sorted(self.outputs),
+        }
+
+
+class CalculationGraph:
+    """Calculation nodes in topological order"""
+
+    def __init__(self, nodes):
+        producers = {}
+        for node in nodes:
+            for field in node.outputs:
+                if field in producers:
+                    raise ValueError("{0} is written by both {1} and {2}".format(
+                        field, producers[field].name, node.name))
+                producers[field] = node
+
+        self.producers = producers
+        self.nodes = self._sort(nodes, producers)
+        self.fields = frozenset().union(*(node.inputs | node.outputs for node in self.nodes))
+
+    @staticmethod
+    def _sort(nodes, producers):
+        """Topological order, keeping declaration order between independent nodes"""
+        ordered = []
+        state = {}
+
+        def visit(node):
+            if state.get(node.name) == "done":
+                return
+            if state.get(node.name) == "visiting":
+                raise ValueError("Calculation graph has a cycle through {0}".format(node.name))
+            state[node.name] = "visiting"
+            for field in sorted(node.inputs):
+                producer = producers.get(field)
+                if producer is not None and producer is not node:
+                    visit(producer)
+            state[node.name] = "done"
+            ordered.append(node)
+
+        for node in nodes:
+            visit(node)
+        return tuple(ordered)
+
+    def plan(self, changed_fields=None):
+        """Nodes to run for a set of changed fields, every node when None.
+
+        A node is dirty when any of its inputs changed or was recomputed, or
+        when one of its own outputs was edited directly and must be restored.
+        """
+        if changed_fields is None:
+            return self.nodes
+
+        changed = frozenset(changed_fields)
+        dirty = set(changed)
+        plan = []
+        for node in self.nodes:
+            if node.inputs & dirty or node.outputs & changed:
+                plan.append(node)
+                dirty |= node.dirty_outputs(dirty)
+        return tuple(plan)
+
+    def run(self, target, plan, sample=None):
+        """Run the nodes of a plan against a target object, timing each into a metrics Sample if given"""
+        if sample is None:
+            for node in plan:
+                getattr(target, node.method)()
+            return plan
+
+        for node in plan:
+            with sample.time(node.name):
+                getattr(target, node.method)()
+        return plan
+
+    def describe(self, plan=None):
+        """The plan as plain dicts for inspection"""
+        return [node.as_dict() for node in (self.nodes if plan is None else plan)]
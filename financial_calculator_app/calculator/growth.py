@@ -0,0 +1,68 @@
+"""Capital growth projections.
+
+A projection is a growth rate (or a per-year curve of rates) over a horizon.
+Its compounding factors are computed once and memoised, so every consumer -
+the growth table, capital gain, returns and the batch evaluator - reads the
+same cached array, and projecting many deals is a single array multiply.
+"""
+from functools import lru_cache
+
+import numpy as np
+
+GROWTH_RATE = 0.035  # Static 3.5% growth rate
+PROJECTION_YEARS = 10
+MAX_PROJECTION_YEARS = 40
+
+
+class GrowthProjection:
+    """Compounding factors for years 0..years under a rate or rate curve"""
+    __slots__ = ("years", "rates", "factors", "factor")
+
+    def __init__(self, rates, years):
+        self.years = years
+        # Rate applied during each year, read-only and shared
+        self.rates = np.array(rates, dtype=float)
+        self.rates.flags.writeable = False
+
+        if len(set(rates)) == 1:
+            # Closed form for a flat rate, built with Python's pow so each
+            # factor is exactly (1 + rate)**year
+            factors = np.array([(1 + rates[0]) ** year for year in range(years + 1)])
+        else:
+            factors = np.concatenate(([1.0], np.cumprod(1 + self.rates)))
+        factors.flags.writeable = False
+        self.factors = factors
+        # Factor at the end of the horizon
+        self.factor = float(factors[-1])
+
+    def values(self, base):
+        """Projected values for years 0..years; one row per deal for an array base"""
+        base = np.asarray(base, dtype=float)
+        return np.multiply.outer(base, self.factors)
+
+    def increases(self, base):
+        """Growth during each year 0..years-1"""
+        return self.values(base)[..., :-1] * self.rates
+
+    def value_at(self, base, year=None):
+        """Projected value at a year, the end of the horizon by default"""
+        factor = self.factor if year is None else self.factors[year]
+        return base * factor
+
+
+def get_projection(rate=GROWTH_RATE, years=PROJECTION_YEARS):
+    """Shared projection for a flat rate or a sequence of per-year rates"""
+    if isinstance(rate, (int, float)):
+        rates = (float(rate),) * years
+    else:
+        rates = tuple(float(r) for r in rate)
+        if len(rates) != years:
+            raise ValueError("Expected {0} yearly growth rates, got {1}".format(years, len(rates)))
+    return _get_projection(rates, years)
+
+
+@lru_cache(maxsize=256)
+def _get_projection(rates, years):
+    if not 1 <= years <= MAX_PROJECTION_YEARS:
+        raise ValueError("Projection horizon must be between 1 and {0} years".format(MAX_PROJECTION_YEARS))
+    return GrowthProjection(rates, years)
@@ -0,0 +1,539 @@
+"""Frappe-free deal evaluation kernel.
+
+Everything here works on plain floats so a deal can be evaluated without
+building a Financial Calculator New document. The document controller is a
+thin adapter that maps its fields onto DealInputs and InvestorResult.
+"""
+import re
+
+from financial_calculator_app.calculator import currency, growth, sdlt
+
+NON_RESIDENTIAL_SDLT_TYPES = ("Non-Resi", "Mixed-Use", "Land")
+EXEMPT_SDLT_TYPES = ("Exempt", "Chain-Break")
+
+# Bump when the calculations change so stored fingerprints and cached results go stale
+CALCULATION_VERSION = 2
+
+
+def clean_currency(value):
+    """Convert a currency string to float, treating blank values as 0.
+
+    UK and European separators are told apart from the value itself and
+    negative or parenthesised amounts keep their sign. Values that are not a
+    well-formed amount, such as "1,25,000", are read the lenient way the form
+    always has, by dropping everything but the digits and decimal point.
+    """
+    try:
+        return currency.parse_amount(value, currency.AUTO, 0)
+    except ValueError:
+        return lenient_amount(value)
+
+
+_NOT_DIGITS = re.compile(r'[^\d.]')
+
+
+def lenient_amount(value):
+    """Digits and decimal point of a value as a float, 0 when they do not make a number"""
+    digits = _NOT_DIGITS.sub('', value)
+    try:
+        amount = float(digits) if digits else 0
+    except ValueError:
+        return 0
+    return -amount if value.strip().startswith(('-', '(')) else amount
+
+
+def stored_number(value):
+    """Read back a figure the calculator stored on a document, keeping its sign"""
+    if value is None or value == "":
+        return 0.0
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return clean_currency(value)
+
+
+def to_float(value):
+    """Convert a rooms or percent field to float, treating empty values as 0"""
+    return float(value) if value else 0.0
+
+
+# Kernel input name -> how the value is parsed from a document field
+CURRENCY_INPUTS = (
+    'purchase_price',
+    'renovation',
+    'architectplanning',
+    'building_control',
+    'furniture',
+    'survey',
+    'legals',
+    'insurance',
+    'sourcing',
+    'gross_development_value',
+    'rent_per_month',
+    'project_management',
+    'lease_setup',
+)
+NUMBER_INPUTS = (
+    'rooms',
+    'first_charge_lending_ltv',
+    'mortgage_percent',
+    'operational_expenses_percent',
+    'management_percent',
+)
+
+# Kernel input name -> document field, per investor view
+UK_INPUT_FIELDS = {
+    'purchase_price': 'purchase_price',
+    'renovation': 'renovation',
+    'architectplanning': 'architectplanning',
+    'building_control': 'building_control',
+    'furniture': 'furniture',
+    'survey': 'survey',
+    'legals': 'legals',
+    'insurance': 'insurance',
+    'sourcing': 'sourcing',
+    'gross_development_value': 'gross_development_value',
+    'rent_per_month': 'rentm_rm_rate_reverse_calc',
+    'rooms': 'rooms',
+    'first_charge_lending_ltv': 'first_charge_lending_ltv',
+    'mortgage_percent': 'mortgage_percent',
+    'operational_expenses_percent': 'operational_expenses_percent',
+    'management_percent': 'management_percent',
+    'sdlt_type': 'sdlt',
+}
+
+INT_INPUT_FIELDS = {
+    'purchase_price': 'int_purchase_price',
+    'renovation': 'int_renovation',
+    'architectplanning': 'int_architectplanning',
+    'building_control': 'int_building_control',
+    'furniture': 'int_furniture',
+    'survey': 'int_survey',
+    'legals': 'int_legals',
+    'insurance': 'int_insurance',
+    'sourcing': 'int_sourcing',
+    'gross_development_value': 'int_gross_development_value',
+    'rent_per_month': 'int_rentm_rm_rate_reverse_calc',
+    'rooms': 'int_rooms',
+    'first_charge_lending_ltv': 'int_first_charge_lending_ltv',
+    'mortgage_percent': 'int_mortgage_percent',
+    'operational_expenses_percent': 'int_operational_expenses_percent',
+    'management_percent': 'int_management_percent',
+    'project_management': 'project_management',
+    'lease_setup': 'lease_setup',
+    'sdlt_type': 'int_sdlt',
+}
+
+# Scalar result name -> document field, per investor view
+UK_RESULT_FIELDS = {
+    'sdlt_amount': 'sdlt_amount',
+    'capital_in': 'capital_in',
+    'uplift': 'uplift',
+    'first_charge_lending': 'first_charge_lending',
+    'capital_released': 'capital_released',
+    'capital_left_in': 'capital_left_in',
+    'gross_rent_pa': 'gross_rent_pa',
+    'mortgage_pa': 'mortgage_pa',
+    'operational_expenses_pa': 'operational_expenses_pa',
+    'management_pa': 'management_pa',
+    'net_cash_flow_pa': 'net_cash_flow_pa',
+}
+
+INT_RESULT_FIELDS = {
+    'sdlt_amount': 'int_sdlt_amount',
+    'lending_and_brokerage_fees': 'lending_and_brokerage_fees',
+    'capital_in': 'int_capital_in',
+    'uplift': 'int_uplift',
+    'first_charge_lending': 'int_first_charge_lending',
+    'capital_released': 'int_capital_released',
+    'capital_left_in': 'int_capital_left_in',
+    'gross_rent_pa': 'int_gross_rent_pa',
+    'mortgage_pa': 'int_mortgage_pa',
+    'operational_expenses_pa': 'int_operational_expenses_pa',
+    'management_pa': 'int_management_pa',
+    'net_cash_flow_pa': 'int_net_cash_flow_pa',
+}
+
+
+class DealInputs:
+    """Parsed inputs for one investor view of a deal"""
+    __slots__ = CURRENCY_INPUTS + NUMBER_INPUTS + ('sdlt_type',)
+
+    def __init__(self, **values):
+        for name in self.__slots__:
+            setattr(self, name, values.pop(name, None if name == 'sdlt_type' else 0.0))
+        if values:
+            raise TypeError("Unknown deal inputs: {0}".format(", ".join(sorted(values))))
+
+    @classmethod
+    def from_fields(cls, source, field_map):
+        """Build inputs from a document or dict using a kernel -> field mapping"""
+        values = {}
+        for name, fieldname in field_map.items():
+            value = source.get(fieldname)
+            if name in CURRENCY_INPUTS:
+                values[name] = clean_currency(value)
+            elif name in NUMBER_INPUTS:
+                values[name] = to_float(value)
+            else:
+                values[name] = value
+        return cls(**values)
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class InvestorResult:
+    """Computed figures for one investor view of a deal"""
+    __slots__ = (
+        'sdlt_amount',
+        'lending_and_brokerage_fees',
+        'capital_in',
+        'uplift',
+        'first_charge_lending',
+        'capital_released',
+        'capital_left_in',
+        'gross_rent_pa',
+        'mortgage_pa',
+        'operational_expenses_pa',
+        'management_pa',
+        'net_cash_flow_pa',
+        'projection_years',
+        'capital_growth',
+        'capital_value_10yr',
+        'capital_gain',
+        'lifetime_cashflow',
+        'total_return',
+        'annualised_roi',
+        'lifetime_roi',
+    )
+
+    def __init__(self):
+        for name in self.__slots__:
+            setattr(self, name, 0.0)
+        # (year, value, growth rate, increase) rows, increase is None for the final year
+        self.capital_growth = ()
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class InvestorProfile:
+    """How one investor view of a deal is evaluated.
+
+    Every view runs the same calculations and differs only in the document
+    fields it reads and writes, the SDLT schedule per property type, the
+    extra costs counted into capital in and how figures are rounded.
+    sdlt_schedules maps property types to schedule kinds (None when no SDLT
+    is due) and sdlt_default applies to any other non-empty type.
+    """
+    __slots__ = (
+        'name',
+        'input_fields',
+        'result_fields',
+        'sdlt_schedules',
+        'sdlt_default',
+        'sdlt_digits',
+        'lending_fees',
+        'extra_costs',
+        'round_mortgage',
+        'release_from_investment',
+    )
+
+    def __init__(self, name, input_fields, result_fields, sdlt_schedules, sdlt_default=None, sdlt_digits=None,
+                 lending_fees=False, extra_costs=(), round_mortgage=False, release_from_investment=False):
+        self.name = name
+        self.input_fields = input_fields
+        self.result_fields = result_fields
+        self.sdlt_schedules = dict(sdlt_schedules)
+        self.sdlt_default = sdlt_default
+        self.sdlt_digits = sdlt_digits
+        # Lending and brokerage fees are counted into capital in
+        self.lending_fees = lending_fees
+        self.extra_costs = tuple(extra_costs)
+        self.round_mortgage = round_mortgage
+        # Capital released as the investment less capital left in rather than the lending itself
+        self.release_from_investment = release_from_investment
+
+    def __repr__(self):
+        return "<InvestorProfile {0}>".format(self.name)
+
+    def settings(self):
+        """Every declared setting that changes results, as plain values for cache keys.
+
+        The document field maps only say where values are read from and written to.
+        """
+        return [
+            (name, sorted(value.items()) if isinstance(value, dict) else value)
+            for name, value in ((name, getattr(self, name)) for name in self.__slots__)
+            if not name.endswith('_fields')
+        ]
+
+    def sdlt_schedule(self, sdlt_type):
+        """SDLT schedule kind for a property type, None when no SDLT is due"""
+        if not sdlt_type:
+            return None
+        return self.sdlt_schedules.get(sdlt_type, self.sdlt_default)
+
+
+UK_PROFILE = InvestorProfile(
+    'uk',
+    UK_INPUT_FIELDS,
+    UK_RESULT_FIELDS,
+    dict({"Resi": sdlt.RESIDENTIAL}, **{sdlt_type: sdlt.NON_RESIDENTIAL for sdlt_type in NON_RESIDENTIAL_SDLT_TYPES}),
+)
+
+INT_PROFILE = InvestorProfile(
+    'international',
+    INT_INPUT_FIELDS,
+    INT_RESULT_FIELDS,
+    dict({"Resi": sdlt.RESIDENTIAL_NON_RESIDENT}, **{sdlt_type: None for sdlt_type in EXEMPT_SDLT_TYPES}),
+    sdlt_default=sdlt.NON_RESIDENTIAL,
+    sdlt_digits=2,
+    lending_fees=True,
+    extra_costs=('project_management', 'lease_setup'),
+    round_mortgage=True,
+    release_from_investment=True,
+)
+
+PROFILES = {profile.name: profile for profile in (UK_PROFILE, INT_PROFILE)}
+
+
+def get_profile(profile):
+    """An InvestorProfile from a profile, its name or the international flag"""
+    if isinstance(profile, InvestorProfile):
+        return profile
+    if isinstance(profile, str):
+        try:
+            return PROFILES[profile]
+        except KeyError:
+            raise ValueError("Unknown investor profile {0}".format(profile))
+    return INT_PROFILE if profile else UK_PROFILE
+
+
+def _shared(shared, key, compute, *args):
+    """compute(*args), computed once per key across the views of a one-pass evaluation"""
+    if shared is None:
+        return compute(*args)
+    value = shared.get(key)
+    if value is None:
+        value = shared[key] = compute(*args)
+    return value
+
+
+def sdlt_amount(profile, sdlt_type, price, shared=None):
+    """SDLT due under an investor profile"""
+    if not price:
+        return 0
+    kind = profile.sdlt_schedule(sdlt_type)
+    if kind is None:
+        return 0
+    amount = _shared(shared, ('sdlt', kind, price), sdlt.sdlt, kind, price)
+    return amount if profile.sdlt_digits is None else round(amount, profile.sdlt_digits)
+
+
+def sdlt_uk(sdlt_type, price):
+    """SDLT for the UK investor view"""
+    return sdlt_amount(UK_PROFILE, sdlt_type, price)
+
+
+def sdlt_int(sdlt_type, price):
+    """SDLT for the international investor view, rounded to 2 decimal places"""
+    return sdlt_amount(INT_PROFILE, sdlt_type, price)
+
+
+def lending_and_brokerage_fees(price):
+    """Lending and brokerage fees on a 75% LTV loan against the purchase price"""
+    if not price:
+        return 0
+    loan_amount = price * 0.75
+    # Fixed fees plus 2% + 1% of the loan amount
+    fixed_fees = 600 + 500 + 350 + 1500
+    percentage_fees = loan_amount * 0.03
+    return float(round(fixed_fees + percentage_fees))
+
+
+def project_management(renovation, percentage):
+    """Project management cost as a percentage of renovation"""
+    return renovation * (percentage / 100)
+
+
+def average_rate_per_week(rooms, rent_per_month):
+    """Weekly rent per room (monthly x 12 / 52 / rooms)"""
+    return round((rent_per_month * 12) / 52 / rooms if rooms else 0, 2)
+
+
+def rent_per_month(rooms, average_rate_week):
+    """Monthly rent from the weekly rate per room"""
+    return round((average_rate_week * rooms * 52) / 12, 2)
+
+
+def gross_rent(rooms, rent_per_month):
+    """Gross rent per annum through the weekly rate per room"""
+    average_rate = (rent_per_month * 12) / 52 / rooms if rooms else 0
+    return rooms * average_rate * 52
+
+
+def acquisition_costs(inputs, result, profile=None):
+    """Capital In: every acquisition cost including SDLT and the profile's extra costs"""
+    profile = get_profile(profile)
+    total = 0
+    total += inputs.purchase_price
+    total += inputs.renovation
+    total += inputs.architectplanning
+    total += inputs.building_control
+    total += inputs.furniture
+    total += inputs.survey
+    total += inputs.legals
+    total += inputs.insurance
+    total += inputs.sourcing
+    total += result.sdlt_amount
+    for name in profile.extra_costs:
+        total += getattr(inputs, name)
+    if profile.lending_fees:
+        total += result.lending_and_brokerage_fees
+    result.capital_in = total
+
+
+def post_works_refinance(inputs, result, profile=None):
+    """Uplift, 1st charge lending and the capital left in after refinance"""
+    profile = get_profile(profile)
+    gdv = inputs.gross_development_value
+    result.uplift = gdv - inputs.purchase_price
+    result.first_charge_lending = gdv * (inputs.first_charge_lending_ltv / 100)
+
+    # Same total as capital in, summed in the order the sheet has always used
+    total_investment = inputs.purchase_price + \
+                      inputs.renovation + \
+                      inputs.architectplanning + \
+                      inputs.building_control + \
+                      inputs.furniture + \
+                      result.sdlt_amount + \
+                      inputs.survey + \
+                      inputs.legals + \
+                      inputs.insurance + \
+                      inputs.sourcing
+    for name in profile.extra_costs:
+        total_investment = total_investment + getattr(inputs, name)
+    if profile.lending_fees:
+        total_investment = total_investment + result.lending_and_brokerage_fees
+
+    result.capital_left_in = total_investment - result.first_charge_lending
+    if profile.release_from_investment:
+        result.capital_released = total_investment - result.capital_left_in
+    else:
+        result.capital_released = result.first_charge_lending
+
+
+def rental_income(inputs, result, profile=None, shared=None):
+    """Gross rent, mortgage, expenses and net cash flow per annum"""
+    profile = get_profile(profile)
+    result.gross_rent_pa = _shared(shared, ('gross_rent', inputs.rooms, inputs.rent_per_month),
+                                   gross_rent, inputs.rooms, inputs.rent_per_month)
+
+    mortgage_pa = result.first_charge_lending * (inputs.mortgage_percent / 100)
+    result.mortgage_pa = float(round(mortgage_pa)) if profile.round_mortgage else mortgage_pa
+
+    result.operational_expenses_pa = result.gross_rent_pa * (inputs.operational_expenses_percent / 100)
+    result.management_pa = result.gross_rent_pa * (inputs.management_percent / 100)
+
+    net_cash_flow = (
+        result.gross_rent_pa -
+        result.mortgage_pa -
+        result.operational_expenses_pa -
+        result.management_pa
+    )
+    result.net_cash_flow_pa = float(round(net_cash_flow))
+
+
+def capital_growth_rows(gdv, projection):
+    """(year, value, growth rate, increase) rows of the GDV, empty when there is no positive GDV"""
+    if gdv <= 0:
+        return ()
+
+    values = projection.values(gdv).tolist()
+    rates = projection.rates.tolist()
+    rows = []
+    for year, value in enumerate(values):
+        if year < projection.years:
+            rows.append((year, value, rates[year], value * rates[year]))
+        else:
+            rows.append((year, value, 0, None))
+    return tuple(rows)
+
+
+def capital_growth(inputs, result, projection, shared=None):
+    """Year by year growth of the GDV"""
+    gdv = inputs.gross_development_value
+    result.capital_growth = _shared(shared, ('capital_growth', gdv, projection), capital_growth_rows, gdv, projection)
+
+
+def capital_gain(inputs, result, projection):
+    """Capital value at the end of the horizon less mortgage lending and equity left in"""
+    result.capital_value_10yr = projection.value_at(inputs.gross_development_value)
+    result.capital_gain = result.capital_value_10yr - result.first_charge_lending - result.capital_left_in
+
+
+def returns(inputs, result, projection):
+    """Lifetime cash flow, total return and ROI percentages"""
+    retained_capital = result.capital_left_in
+    annual_cashflow = result.net_cash_flow_pa
+
+    result.lifetime_cashflow = annual_cashflow * projection.years
+    result.total_return = result.lifetime_cashflow + result.capital_gain
+
+    result.annualised_roi = round((annual_cashflow / retained_capital) * 100, 2) if retained_capital else 0
+    result.lifetime_roi = round((result.total_return / retained_capital) * 100, 2) if retained_capital else 0
+
+
+def projections(inputs, result, projection=None, shared=None):
+    """Capital growth, capital gain and returns under a growth projection"""
+    projection = projection or growth.get_projection()
+    result.projection_years = projection.years
+    capital_growth(inputs, result, projection, shared)
+    capital_gain(inputs, result, projection)
+    returns(inputs, result, projection)
+
+
+def evaluate(inputs, profile=None, projection=None, shared=None):
+    """Evaluate one investor view of a deal.
+
+    shared holds intermediate results keyed by their inputs; passing the
+    same dict for several views computes each shared step once.
+    """
+    profile = get_profile(profile)
+    result = InvestorResult()
+    result.sdlt_amount = sdlt_amount(profile, inputs.sdlt_type, inputs.purchase_price, shared)
+    if profile.lending_fees:
+        result.lending_and_brokerage_fees = lending_and_brokerage_fees(inputs.purchase_price)
+    acquisition_costs(inputs, result, profile)
+    post_works_refinance(inputs, result, profile)
+    rental_income(inputs, result, profile, shared)
+    projections(inputs, result, projection, shared)
+    return result
+
+
+def evaluate_profiles(inputs_by_profile, projection=None):
+    """Evaluate several investor views of a deal in one pass.
+
+    inputs_by_profile maps each InvestorProfile to its DealInputs. The
+    growth rows, gross rent and SDLT bands are computed once for views that
+    agree on their inputs, so each added view only pays for what differs.
+    Returns the InvestorResult of each profile.
+    """
+    projection = projection or growth.get_projection()
+    shared = {}
+    return {
+        profile: evaluate(inputs, profile, projection, shared)
+        for profile, inputs in inputs_by_profile.items()
+    }
+
+
+def evaluate_uk(inputs, projection=None):
+    """Evaluate the UK investor view of a deal"""
+    return evaluate(inputs, UK_PROFILE, projection)
+
+
+def evaluate_int(inputs, projection=None):
+    """Evaluate the international investor view of a deal"""
+    return evaluate(inputs, INT_PROFILE, projection)
@@ -0,0 +1,208 @@
+"""Sampled timing metrics of the calculation pipeline.
+
+A sampled calculation records the wall time of each stage, the child table
+rows it writes and the size of the payload it returns. Only a fraction of
+calculations are sampled, so an unsampled save pays for one random draw.
+
+Samples are folded into cumulative histograms and counters per process. A
+process publishes its totals to an optional shared store such as
+frappe.cache() at most every publish_interval seconds, one entry per
+process, and aggregate() sums every process's entry. Each entry carries the
+time it was published; entries not refreshed for stale_after seconds, left
+by workers that have exited or been recycled, are deleted by aggregate()
+instead of being summed forever. An idle process that outlives stale_after
+drops out of the totals until it next publishes. Totals can be read as a
+dict or in the Prometheus text exposition format.
+"""
+import contextlib
+import os
+import random
+import socket
+import time
+from bisect import bisect_left
+
+# Histogram bucket upper bounds: seconds for timings, bytes for payloads
+TIME_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+SIZE_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576)
+ROW_OPERATIONS = ("inserted", "updated", "deleted")
+
+_NOT_SAMPLED = contextlib.nullcontext()
+
+
+def series(name, **labels):
+    """Prometheus series name of a metric and its labels"""
+    if not labels:
+        return name
+    return "{0}{{{1}}}".format(name, ",".join(
+        '{0}="{1}"'.format(label, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+        for label, value in sorted(labels.items())))
+
+
+def timed(sample, stage):
+    """Time a stage into sample, doing nothing when the calculation is not sampled"""
+    return _NOT_SAMPLED if sample is None else sample.time(stage)
+
+
+class Sample:
+    """Measurements of one sampled calculation"""
+
+    def __init__(self, entry):
+        self.entry = entry
+        self.started = time.perf_counter()
+        self.stages = []
+        self.rows = []
+        self.payload_bytes = None
+
+    @contextlib.contextmanager
+    def time(self, stage):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages.append((stage, time.perf_counter() - started))
+
+    def rows_written(self, table, inserted=0, updated=0, deleted=0):
+        self.rows.append((table, inserted, updated, deleted))
+
+
+class MetricsRegistry:
+    """Cumulative histograms and counters of sampled calculations.
+
+    sample_rate is the fraction of calculations sampled, or a callable
+    returning it so it can follow site config. shared is a callable
+    returning an object with hset, hgetall and hdel (frappe.cache), or None.
+    """
+
+    def __init__(self, sample_rate=0.01, shared=None, namespace="financial_calculator_metrics", publish_interval=30,
+                 stale_after=3600):
+        self.sample_rate = sample_rate
+        self.shared = shared
+        self.namespace = namespace
+        self.publish_interval = publish_interval
+        self.stale_after = stale_after
+        self.process = "{0}:{1}".format(socket.gethostname(), os.getpid())
+        self.reset()
+
+    def reset(self):
+        self.histograms = {}
+        self.counters = {}
+        self._published = 0
+
+    def start(self, entry):
+        """A Sample for a calculation starting at entry, or None when it is not sampled"""
+        rate = self.sample_rate() if callable(self.sample_rate) else self.sample_rate
+        if rate and (rate >= 1 or random.random() < rate):
+            return Sample(entry)
+        return None
+
+    def record(self, sample):
+        """Fold a finished sample into the totals"""
+        entry = sample.entry
+        self.observe(series("financial_calculator_calculation_seconds", entry=entry),
+                     time.perf_counter() - sample.started)
+        self.inc(series("financial_calculator_calculations_sampled_total", entry=entry))
+        for stage, seconds in sample.stages:
+            self.observe(series("financial_calculator_stage_seconds", stage=stage), seconds)
+            self.inc(series("financial_calculator_stage_calls_total", stage=stage))
+        for table, *counts in sample.rows:
+            for operation, count in zip(ROW_OPERATIONS, counts):
+                if count:
+                    self.inc(series("financial_calculator_table_rows_total", table=table, operation=operation), count)
+        if sample.payload_bytes is not None:
+            self.observe(series("financial_calculator_payload_bytes", entry=entry), sample.payload_bytes, SIZE_BUCKETS)
+
+        if self.shared and time.monotonic() - self._published >= self.publish_interval:
+            self.publish()
+
+    def observe(self, key, value, buckets=TIME_BUCKETS):
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = {"buckets": list(buckets), "counts": [0] * len(buckets), "sum": 0, "count": 0}
+        index = bisect_left(histogram["buckets"], value)
+        if index < len(histogram["counts"]):
+            histogram["counts"][index] += 1
+        histogram["sum"] += value
+        histogram["count"] += 1
+
+    def inc(self, key, amount=1):
+        self.counters[key] = self.counters.get(key, 0) + amount
+
+    def snapshot(self):
+        """This process's totals"""
+        return {
+            "histograms": {key: dict(histogram, counts=list(histogram["counts"]))
+                           for key, histogram in self.histograms.items()},
+            "counters": dict(self.counters),
+        }
+
+    def publish(self):
+        """Store this process's totals in the shared store"""
+        shared = self.shared()
+        if shared is not None:
+            shared.hset(self.namespace, self.process, dict(self.snapshot(), published=time.time()))
+        self._published = time.monotonic()
+
+    def aggregate(self):
+        """Totals over every process that has published recently, this one included.
+
+        Entries older than stale_after are deleted from the shared store.
+        """
+        snapshots = {}
+        shared = self.shared() if self.shared else None
+        if shared is not None:
+            oldest = time.time() - self.stale_after
+            for process, snapshot in (shared.hgetall(self.namespace) or {}).items():
+                if snapshot.get("published", 0) < oldest:
+                    shared.hdel(self.namespace, process)
+                else:
+                    snapshots[process] = snapshot
+        snapshots[self.process] = self.snapshot()
+        return merge(snapshots.values())
+
+
+def merge(snapshots):
+    """Sum of several snapshots"""
+    total = {"histograms": {}, "counters": {}}
+    for snapshot in snapshots:
+        for key, histogram in snapshot["histograms"].items():
+            merged = total["histograms"].get(key)
+            if merged is None or merged["buckets"] != histogram["buckets"]:
+                # A process started with other buckets is superseded rather than mixed in
+                total["histograms"][key] = dict(histogram, counts=list(histogram["counts"]))
+                continue
+            merged["counts"] = [a + b for a, b in zip(merged["counts"], histogram["counts"])]
+            merged["sum"] += histogram["sum"]
+            merged["count"] += histogram["count"]
+        for key, value in snapshot["counters"].items():
+            total["counters"][key] = total["counters"].get(key, 0) + value
+    return total
+
+
+def prometheus_text(snapshot):
+    """A snapshot in the Prometheus text exposition format"""
+    lines = []
+    typed = set()
+
+    def declare(name, metric_type):
+        if name not in typed:
+            typed.add(name)
+            lines.append("# TYPE {0} {1}".format(name, metric_type))
+
+    for key in sorted(snapshot["histograms"]):
+        histogram = snapshot["histograms"][key]
+        name, _, labels = key.partition("{")
+        labels = labels.rstrip("}")
+        declare(name, "histogram")
+        cumulative = 0
+        for bound, count in zip(histogram["buckets"] + ["+Inf"], histogram["counts"] + [None]):
+            cumulative = histogram["count"] if count is None else cumulative + count
+            lines.append('{0}_bucket{{{1}le="{2}"}} {3}'.format(
+                name, labels + "," if labels else "", bound, cumulative))
+        suffix = "{" + labels + "}" if labels else ""
+        lines.append("{0}_sum{1} {2!r}".format(name, suffix, float(histogram["sum"])))
+        lines.append("{0}_count{1} {2}".format(name, suffix, histogram["count"]))
+
+    for key in sorted(snapshot["counters"]):
+        declare(key.partition("{")[0], "counter")
+        lines.append("{0} {1}".format(key, snapshot["counters"][key]))
+    return "\n".join(lines) + "\n"
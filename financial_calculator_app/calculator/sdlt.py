@@ -0,0 +1,113 @@
+"""Table-driven SDLT rate schedules.
+
+Each schedule is plain data with an effective date. Cumulative tax at the
+start of every band is precomputed once, so pricing a deal is a binary search
+over the band starts plus one multiply-add, for a single price or a NumPy
+array of prices. A rate change is an edit to SCHEDULES below.
+"""
+import datetime
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+from functools import lru_cache
+
+import numpy as np
+
+RESIDENTIAL = "residential"
+RESIDENTIAL_NON_RESIDENT = "residential_non_resident"
+NON_RESIDENTIAL = "non_residential"
+
+NON_RESIDENT_SURCHARGE = 0.02
+
+# start: band applies to prices above this amount
+# full_price: charge the rate on the whole price while it is in this band
+# (the non-residential sheet has always worked this way for 150k - 250k)
+SdltBand = namedtuple("SdltBand", ["start", "rate", "full_price"], defaults=[False])
+
+
+class SdltSchedule:
+    """One dated set of SDLT bands with precomputed cumulative totals"""
+    __slots__ = ("kind", "effective_from", "threshold", "bands", "starts", "rates", "bases", "full_price")
+
+    def __init__(self, kind, effective_from, threshold, bands):
+        self.kind = kind
+        self.effective_from = effective_from
+        # No SDLT is due at or below the threshold
+        self.threshold = threshold
+        self.bands = tuple(SdltBand(*band) for band in bands)
+        self.starts = tuple(band.start for band in self.bands)
+        self.rates = tuple(band.rate for band in self.bands)
+        self.full_price = tuple(band.full_price for band in self.bands)
+
+        bases = [0.0]
+        for previous, band in zip(self.bands, self.bands[1:]):
+            bases.append(round(bases[-1] + (band.start - previous.start) * previous.rate, 2))
+        self.bases = tuple(bases)
+
+    def with_surcharge(self, kind, surcharge):
+        """Copy of this schedule with a flat surcharge added to every band rate"""
+        return SdltSchedule(kind, self.effective_from, self.threshold, [
+            (band.start, round(band.rate + surcharge, 6), band.full_price) for band in self.bands
+        ])
+
+    def amount(self, price):
+        """SDLT due on a single price"""
+        if price <= self.threshold:
+            return 0
+        i = max(bisect_left(self.starts, price) - 1, 0)
+        if self.full_price[i]:
+            return price * self.rates[i]
+        return self.bases[i] + (price - self.starts[i]) * self.rates[i]
+
+    def amounts(self, prices):
+        """SDLT due on every price in an array"""
+        prices = np.asarray(prices, dtype=float)
+        i = np.maximum(np.searchsorted(self.starts, prices, side="left") - 1, 0)
+        rates = np.asarray(self.rates)[i]
+        banded = np.asarray(self.bases)[i] + (prices - np.asarray(self.starts, dtype=float)[i]) * rates
+        amounts = np.where(np.asarray(self.full_price)[i], prices * rates, banded)
+        return np.where(prices <= self.threshold, 0.0, amounts)
+
+
+_residential = [
+    SdltSchedule(RESIDENTIAL, datetime.date(2025, 4, 1), 40000, [
+        (0, 0.05),
+        (125000, 0.07),
+        (250000, 0.10),
+        (925000, 0.15),
+        (1500000, 0.17),
+    ]),
+]
+
+SCHEDULES = {
+    RESIDENTIAL: _residential,
+    RESIDENTIAL_NON_RESIDENT: [
+        schedule.with_surcharge(RESIDENTIAL_NON_RESIDENT, NON_RESIDENT_SURCHARGE) for schedule in _residential
+    ],
+    NON_RESIDENTIAL: [
+        SdltSchedule(NON_RESIDENTIAL, datetime.date(2016, 3, 17), 150000, [
+            (150000, 0.02, True),
+            (250000, 0.05),
+        ]),
+    ],
+}
+
+
+def get_schedule(kind, on_date=None):
+    """The schedule of a kind in force on a date (today by default)"""
+    return _get_schedule(kind, on_date or datetime.date.today())
+
+
+@lru_cache(maxsize=128)
+def _get_schedule(kind, on_date):
+    schedules = sorted(SCHEDULES[kind], key=lambda schedule: schedule.effective_from)
+    i = bisect_right([schedule.effective_from for schedule in schedules], on_date) - 1
+    # Dates before the first schedule fall back to the earliest one we have
+    return schedules[max(i, 0)]
+
+
+def sdlt(kind, price, on_date=None):
+    """SDLT on a price or an array of prices under the schedule of a kind"""
+    schedule = get_schedule(kind, on_date)
+    if isinstance(price, np.ndarray):
+        return schedule.amounts(price)
+    return schedule.amount(price)
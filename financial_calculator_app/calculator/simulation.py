@@ -0,0 +1,157 @@
+"""Monte Carlo simulation of a deal's projection.
+
+The deterministic projection assumes a flat growth rate, flat rent, no voids
+and a fixed mortgage rate. A simulation draws yearly paths for all four and
+reports percentile bands of capital gain and lifetime profit, both in
+pounds. Paths are simulated a chunk at a time as NumPy arrays and folded into
+quantile sketches, so memory stays flat however many paths are drawn.
+
+Simulations run inside the web request that asks for them, so the number of
+paths is capped to keep a run to a fraction of a second per investor view.
+"""
+from collections import namedtuple
+
+import numpy as np
+
+from financial_calculator_app.calculator import growth, kernel
+
+PERCENTILES = (5, 50, 95)
+SIMULATION_METRICS = ('capital_gain', 'lifetime_profit')
+CHUNK_SIZE = 20000
+MAX_PATHS = 100000
+
+# Rates are fractions per year. Voids are drawn from a beta distribution with
+# the given mean; the mortgage rate is a random walk from the deal's rate.
+SimulationAssumptions = namedtuple("SimulationAssumptions", [
+    "growth_mean",
+    "growth_volatility",
+    "rent_inflation_mean",
+    "rent_inflation_volatility",
+    "void_mean",
+    "void_concentration",
+    "mortgage_rate_volatility",
+], defaults=[growth.GROWTH_RATE, 0.05, 0.0, 0.02, 0.04, 20.0, 0.005])
+
+
+class QuantileSketch:
+    """Mergeable, fixed-size approximation of a distribution's quantiles.
+
+    Each batch of values is reduced to `resolution` quantiles at the centres
+    of equal-weight slices, weighted by the batch size. Summaries are
+    compressed back to a single one when too many accumulate, so memory does
+    not grow with the number of values.
+    """
+    __slots__ = ("resolution", "max_summaries", "summaries", "count", "total")
+
+    def __init__(self, resolution=1001, max_summaries=16):
+        self.resolution = resolution
+        self.max_summaries = max_summaries
+        self.summaries = []
+        self.count = 0
+        self.total = 0.0
+
+    def add(self, values):
+        values = np.asarray(values, dtype=float).ravel()
+        if not len(values):
+            return
+        self.count += len(values)
+        self.total += float(values.sum())
+        if len(values) > self.resolution:
+            points = np.quantile(values, self._centres())
+        else:
+            points = np.sort(values)
+        self._append(points, np.full(len(points), len(values) / len(points)))
+
+    def merge(self, other):
+        self.count += other.count
+        self.total += other.total
+        for points, weights in other.summaries:
+            self._append(points, weights)
+
+    def _centres(self):
+        return (np.arange(self.resolution) + 0.5) / self.resolution
+
+    def _append(self, points, weights):
+        self.summaries.append((points, weights))
+        if len(self.summaries) > self.max_summaries:
+            self._compress()
+
+    def _weighted(self):
+        points = np.concatenate([points for points, weights in self.summaries])
+        weights = np.concatenate([weights for points, weights in self.summaries])
+        order = np.argsort(points, kind="stable")
+        points, weights = points[order], weights[order]
+        # Rank of each point's centre, as a fraction of the total weight
+        ranks = (np.cumsum(weights) - weights / 2) / weights.sum()
+        return points, ranks
+
+    def _compress(self):
+        points, ranks = self._weighted()
+        total = sum(weights.sum() for points_, weights in self.summaries)
+        summary = np.interp(self._centres(), ranks, points)
+        self.summaries = [(summary, np.full(self.resolution, total / self.resolution))]
+
+    def quantile(self, q):
+        """Value at quantile q (0..1)"""
+        if not self.summaries:
+            return 0.0
+        points, ranks = self._weighted()
+        return float(np.interp(q, ranks, points))
+
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+
+def simulate_paths(inputs, international, paths, assumptions, years, rng):
+    """Capital gain and lifetime profit, cash flow plus capital gain, for `paths` simulated paths"""
+    base = kernel.evaluate(inputs, international)
+    shape = (paths, years)
+
+    growth_rates = rng.normal(assumptions.growth_mean, assumptions.growth_volatility, shape)
+    capital_value = inputs.gross_development_value * np.prod(1 + growth_rates, axis=1)
+    capital_gain = capital_value - base.first_charge_lending - base.capital_left_in
+
+    # Rent in year t has compounded t years of inflation; year 0 is today's rent
+    inflation = rng.normal(assumptions.rent_inflation_mean, assumptions.rent_inflation_volatility, shape)
+    inflation[:, 0] = 0
+    rent = base.gross_rent_pa * np.cumprod(1 + inflation, axis=1)
+
+    if assumptions.void_mean > 0:
+        a = assumptions.void_mean * assumptions.void_concentration
+        b = (1 - assumptions.void_mean) * assumptions.void_concentration
+        rent *= 1 - rng.beta(a, b, shape)
+
+    mortgage_rate = inputs.mortgage_percent / 100 + np.cumsum(
+        rng.normal(0, assumptions.mortgage_rate_volatility, shape), axis=1)
+    mortgage_rate[:, 0] = inputs.mortgage_percent / 100
+    np.maximum(mortgage_rate, 0, out=mortgage_rate)
+
+    costs = (inputs.operational_expenses_percent + inputs.management_percent) / 100
+    cash_flow = rent * (1 - costs) - base.first_charge_lending * mortgage_rate
+    lifetime_profit = cash_flow.sum(axis=1) + capital_gain
+    return {'capital_gain': capital_gain, 'lifetime_profit': lifetime_profit}
+
+
+def simulate(inputs, international=False, paths=10000, assumptions=None, years=growth.PROJECTION_YEARS,
+             seed=None, chunk_size=CHUNK_SIZE):
+    """P5/P50/P95 and mean of capital gain and lifetime profit over simulated paths"""
+    paths = int(paths)
+    if not 1 <= paths <= MAX_PATHS:
+        raise ValueError("Paths must be between 1 and {0}".format(MAX_PATHS))
+    assumptions = assumptions or SimulationAssumptions()
+
+    rng = np.random.default_rng(seed)
+    sketches = {metric: QuantileSketch() for metric in SIMULATION_METRICS}
+    remaining = paths
+    while remaining > 0:
+        size = min(chunk_size, remaining)
+        results = simulate_paths(inputs, international, size, assumptions, years, rng)
+        for metric, sketch in sketches.items():
+            sketch.add(results[metric])
+        remaining -= size
+
+    summary = {"paths": paths, "years": years}
+    for metric, sketch in sketches.items():
+        summary[metric] = {"p{0}".format(p): sketch.quantile(p / 100) for p in PERCENTILES}
+        summary[metric]["mean"] = sketch.mean()
+    return summary
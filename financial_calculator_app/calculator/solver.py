@@ -0,0 +1,205 @@
+"""Goal seek: the purchase price or rent that gives a target return.
+
+Every target is first turned into a target for a quantity that is piecewise
+linear in the variable - capital left in for the purchase price (linear
+between SDLT band edges), net cash flow for the rent (linear everywhere).
+The band holding the answer is found by bisecting over the band edges and
+the answer inside it is a closed-form interpolation. A short bracketed
+bisection against the kernel then absorbs the rounding the pipeline applies
+(whole-pound fees and cash flow, ROI to two decimals), so an answer costs a
+few dozen kernel evaluations at most.
+"""
+import math
+
+from financial_calculator_app.calculator import growth, kernel, sdlt
+
+SOLVE_VARIABLES = ('purchase_price', 'rent_per_month')
+SOLVE_METRICS = ('annualised_roi', 'lifetime_roi', 'capital_left_in', 'net_cash_flow_pa')
+
+# Metrics that must stay at or below the target; the rest at or above it
+CEILING_METRICS = ('capital_left_in',)
+
+# Document field names accepted in place of kernel input names
+VARIABLE_ALIASES = {'rentm_rm_rate_reverse_calc': 'rent_per_month'}
+
+TOLERANCE = 0.001
+MAX_EVALUATIONS = 200
+
+
+class GoalSeek:
+    """Solve one variable of a deal for a target metric"""
+
+    def __init__(self, inputs, variable, metric, target, international=False, projection=None):
+        variable = VARIABLE_ALIASES.get(variable, variable)
+        if variable not in SOLVE_VARIABLES:
+            raise ValueError("Cannot solve for {0}".format(variable))
+        if metric not in SOLVE_METRICS:
+            raise ValueError("Cannot target {0}".format(metric))
+        if variable == 'purchase_price' and metric == 'net_cash_flow_pa':
+            raise ValueError("Net cash flow does not depend on the purchase price")
+        if variable == 'rent_per_month' and metric == 'capital_left_in':
+            raise ValueError("Capital left in does not depend on the rent")
+
+        self.inputs = inputs
+        self.variable = variable
+        self.metric = metric
+        self.target = float(target)
+        self.profile = kernel.get_profile(international)
+        self.projection = projection or growth.get_projection()
+        self.evaluations = 0
+
+    def evaluate(self, value):
+        """Kernel result with the variable set to value, counted against MAX_EVALUATIONS"""
+        self.evaluations += 1
+        if self.evaluations > MAX_EVALUATIONS:
+            raise ValueError("Goal seek did not converge")
+        return self.result(value)
+
+    def result(self, value):
+        """Kernel result with the variable set to value, outside the search"""
+        values = self.inputs.as_dict()
+        values[self.variable] = value
+        inputs = kernel.DealInputs(**values)
+        return kernel.evaluate(inputs, self.profile, self.projection)
+
+    def feasible(self, result):
+        achieved = getattr(result, self.metric)
+        if self.metric in CEILING_METRICS:
+            return achieved <= self.target
+        return achieved >= self.target
+
+    def driver(self, result):
+        """The piecewise linear quantity the target is translated into"""
+        if self.variable == 'purchase_price':
+            return result.capital_left_in
+        return result.net_cash_flow_pa
+
+    def driver_target(self, result):
+        """Target for the driver equivalent to the metric target at the current deal"""
+        target = self.target
+        if self.metric in ('capital_left_in', 'net_cash_flow_pa'):
+            return target
+
+        if self.variable == 'purchase_price':
+            # Net cash flow is independent of the price, so each ROI fixes capital left in
+            if self.metric == 'annualised_roi':
+                return result.net_cash_flow_pa * 100 / target if target else None
+            # lifetime ROI = (cash flow + capital value - lending - capital left in) / capital left in
+            gross = result.lifetime_cashflow + result.capital_value_10yr - result.first_charge_lending
+            return gross / (1 + target / 100) if target != -100 else None
+
+        # Capital left in is independent of the rent
+        if self.metric == 'annualised_roi':
+            return target * result.capital_left_in / 100
+        return (target * result.capital_left_in / 100 - result.capital_gain) / self.projection.years
+
+    def breakpoints(self):
+        """Values of the variable between which the driver is linear"""
+        current = getattr(self.inputs, self.variable)
+        if self.variable == 'rent_per_month':
+            upper = max(current, 1000.0)
+            return [0.0, upper]
+
+        kinds = set(self.profile.sdlt_schedules.values()) | {self.profile.sdlt_default}
+        edges = {0.0}
+        for kind in sorted(kinds - {None}):
+            schedule = sdlt.get_schedule(kind)
+            edges.add(float(schedule.threshold))
+            edges.update(float(start) for start in schedule.starts)
+        upper = max(current, self.inputs.gross_development_value, max(edges)) * 2
+        return sorted(edge for edge in edges if edge < upper) + [upper]
+
+    def solve(self):
+        """The highest purchase price or lowest rent that meets the target, None if none does"""
+        base = self.evaluate(getattr(self.inputs, self.variable))
+        target = self.driver_target(base)
+        if target is None:
+            return None
+
+        # Extend the range until the variable is high enough for the driver to pass the target;
+        # above the top SDLT band the driver stays linear in the price
+        points = self.breakpoints()
+        while self.driver(self.evaluate(points[-1])) < target and points[-1] < 1e9:
+            points[-1] *= 4
+
+        # Band holding the driver target; the driver rises with the variable
+        lo, hi = 0, len(points) - 1
+        d_lo, d_hi = self.driver(self.evaluate(points[lo])), self.driver(self.evaluate(points[hi]))
+        if not d_lo <= target <= d_hi:
+            return None
+        while hi - lo > 1:
+            mid = (lo + hi) // 2
+            d_mid = self.driver(self.evaluate(points[mid]))
+            if d_mid <= target:
+                lo, d_lo = mid, d_mid
+            else:
+                hi, d_hi = mid, d_mid
+
+        # Closed form inside the band
+        x_lo, x_hi = points[lo], points[hi]
+        guess = x_lo if d_hi == d_lo else x_lo + (target - d_lo) * (x_hi - x_lo) / (d_hi - d_lo)
+        return self.polish(guess, target, x_lo, x_hi)
+
+    def polish(self, guess, target, x_lo, x_hi):
+        """Bisect to the feasible edge near a guess.
+
+        When the guess is off and the feasible range is too narrow for the
+        widening steps to land in, the driver target is bracketed inside the
+        band x_lo..x_hi and the edge is looked for from there.
+        """
+        edge = self.find_edge(guess)
+        if edge is None:
+            edge = self.find_edge(self.crossing(target, x_lo, x_hi))
+        if edge is None:
+            return None
+
+        inside, outside = edge
+        while abs(outside - inside) > TOLERANCE:
+            mid = (inside + outside) / 2
+            if self.feasible(self.evaluate(mid)):
+                inside = mid
+            else:
+                outside = mid
+        # Round to the penny without crossing back over the edge
+        rounded = math.floor(inside * 100) if inside < outside else math.ceil(inside * 100)
+        return rounded / 100
+
+    def find_edge(self, guess):
+        """(feasible, infeasible) values either side of guess, None when widening finds no change"""
+        step = 1.0
+        while step <= 1e9:
+            below, above = max(guess - step, 0.0), guess + step
+            feasible_below = self.feasible(self.evaluate(below))
+            if feasible_below != self.feasible(self.evaluate(above)):
+                return (below, above) if feasible_below else (above, below)
+            step *= 4
+        return None
+
+    def crossing(self, target, lo, hi):
+        """Value between lo and hi where the driver passes its target, to the pound"""
+        while hi - lo > 1:
+            mid = (lo + hi) / 2
+            if self.driver(self.evaluate(mid)) <= target:
+                lo = mid
+            else:
+                hi = mid
+        return lo
+
+
+def goal_seek(inputs, variable, metric, target, international=False, projection=None):
+    """Solve a deal for a target and report the value, the metric it gives and the kernel evaluations used.
+
+    The evaluation reporting the achieved metric is not part of the search,
+    so it neither counts towards nor can exceed MAX_EVALUATIONS.
+    """
+    seek = GoalSeek(inputs, variable, metric, target, international, projection)
+    value = seek.solve()
+    achieved = getattr(seek.result(value), seek.metric) if value is not None else None
+    return {
+        "variable": seek.variable,
+        "metric": metric,
+        "target": seek.target,
+        "value": value,
+        "achieved": achieved,
+        "evaluations": seek.evaluations,
+    }
@@ -0,0 +1,314 @@
+"""Streaming import of deals from a CSV or XLSX sheet.
+
+Sourcing sheets can hold thousands of candidate properties. Rather than
+creating and validating one document at a time, the importer reads the
+sheet a row at a time and works a chunk at a time. It maps the columns to
+the details tab fields, validates each row, evaluates the chunk through the
+NumPy batch kernel and writes it with one multi-row INSERT for the forecasts
+and one per result table. Memory is bounded by the chunk size whatever the
+size of the sheet, and every rejected row is reported with its line number.
+"""
+import csv
+import hashlib
+import re
+
+import frappe
+from frappe import _
+from frappe.utils import cint, now
+
+from financial_calculator_app.calculator import currency, growth
+from financial_calculator_app.financial_calculator_app.doctype.financial_calculator_new.bulk_recalculate import (
+    evaluate_chunk,
+    insert_tables,
+)
+from financial_calculator_app.financial_calculator_app.doctype.financial_calculator_new.financial_calculator_new import (
+    CASH_FLOW_FIELDS,
+    INPUT_FIELDS,
+    INT_DETAIL_FIELDS,
+    UK_DETAIL_FIELDS,
+)
+
+DOCTYPE = "Financial Calculator New"
+CHUNK_SIZE = 500
+STATUS_KEY = "financial_calculator_bulk_import"
+# Rejected rows beyond this are counted but not listed
+MAX_ERRORS = 1000
+
+# Columns a sheet can fill: the details tab and each investor tab's lending
+# assumptions. Derived fields (weekly rate, project management fee) are
+# always recalculated, so they are not importable.
+IMPORT_FIELDS = ('forecast_type', 'forecast_name', 'opportunity', 'project') + tuple(sorted(
+    (set(UK_DETAIL_FIELDS) | set(INT_DETAIL_FIELDS)) - {'main_average_ratewk', 'main_project_management'}
+)) + tuple(CASH_FLOW_FIELDS.values()) + tuple(
+    INPUT_FIELDS[international][name]
+    for international in (False, True)
+    for name in ('first_charge_lending_ltv', 'mortgage_percent', 'operational_expenses_percent', 'management_percent')
+)
+# Data fields that hold text; every other Data field on the details tab holds an amount
+TEXT_FIELDS = ('forecast_name',)
+
+_HEADER = re.compile(r'[^a-z0-9%]+')
+
+
+@frappe.whitelist()
+def enqueue_bulk_import(file_url, chunk_size=CHUNK_SIZE, locale=None):
+    """Queue an import of the sheet attached at file_url"""
+    frappe.has_permission(DOCTYPE, "create", throw=True)
+    if locale and locale != currency.AUTO and locale not in currency.LOCALES:
+        frappe.throw(_("Unknown number locale {0}").format(locale))
+    path = get_import_file(file_url).get_full_path()
+
+    key = job_key(file_url)
+    frappe.enqueue(
+        import_forecasts,
+        queue="long",
+        timeout=4 * 60 * 60,
+        job_id="{0}::{1}".format(STATUS_KEY, key),
+        deduplicate=True,
+        path=path,
+        chunk_size=cint(chunk_size) or CHUNK_SIZE,
+        key=key,
+        locale=locale or None,
+    )
+    return key
+
+
+@frappe.whitelist()
+def get_bulk_import_status(file_url):
+    """Progress and rejected rows of the last import of file_url"""
+    frappe.has_permission(DOCTYPE, "create", throw=True)
+    get_import_file(file_url)
+    return frappe.cache().hget(STATUS_KEY, job_key(file_url))
+
+
+def get_import_file(file_url):
+    """The File at file_url, when the user may read it.
+
+    Rejected rows echo the sheet's cells back, so importing a file, or
+    reading its import status, needs read permission on the file itself.
+    """
+    name = frappe.db.get_value("File", {"file_url": file_url})
+    if not name:
+        frappe.throw(_("File {0} not found").format(file_url), frappe.DoesNotExistError)
+    file = frappe.get_doc("File", name)
+    file.check_permission("read")
+    return file
+
+
+def job_key(file_url):
+    return hashlib.sha1(file_url.encode()).hexdigest()
+
+
+def import_forecasts(path, chunk_size=CHUNK_SIZE, key=None, locale=None):
+    """Import every valid row of a sheet, committing a chunk at a time.
+
+    locale names the sheet's decimal and group separators, en_GB by default;
+    currency.AUTO infers them from each value.
+    """
+    state = {"status": "Running", "processed": 0, "imported": 0, "failed": 0, "errors": [], "ignored_columns": []}
+    rows = read_rows(path)
+    columns, state["ignored_columns"] = map_columns(next(rows, None) or [])
+    if not columns:
+        frappe.throw(_("None of the columns match a Financial Calculator New field"))
+
+    meta = frappe.get_meta(DOCTYPE)
+    projection = growth.get_projection()
+    chunk = []
+    # Line 1 is the header
+    for line, row in enumerate(rows, 2):
+        if not any(cell not in (None, "") for cell in row):
+            continue
+        chunk.append((line, row))
+        if len(chunk) >= chunk_size:
+            import_chunk(chunk, columns, meta, projection, state, key, locale)
+            chunk = []
+    if chunk:
+        import_chunk(chunk, columns, meta, projection, state, key, locale)
+
+    state["status"] = "Completed"
+    if key:
+        frappe.cache().hset(STATUS_KEY, key, state)
+    return state
+
+
+def import_chunk(chunk, columns, meta, projection, state, key=None, locale=None):
+    """Validate, evaluate and insert one chunk of sheet rows"""
+    deals = []
+    for line, values, error in parse_chunk(chunk, columns, meta, locale):
+        if error:
+            record_error(state, line, error)
+        else:
+            deals.append((line, values))
+
+    rejected = check_links(deals)
+    for line, error in rejected.items():
+        record_error(state, line, error)
+    deals = [(line, values) for line, values in deals if line not in rejected]
+
+    insert_deals([values for line, values in deals], projection)
+    frappe.db.commit()
+
+    state["processed"] += len(chunk)
+    state["imported"] += len(deals)
+    if key:
+        frappe.cache().hset(STATUS_KEY, key, state)
+        frappe.publish_progress(
+            state["imported"] * 100 / (state["processed"] or 1),
+            title="Importing forecasts",
+            description="{0} rows read, {1} imported".format(state["processed"], state["imported"]),
+        )
+
+
+def record_error(state, line, error):
+    state["failed"] += 1
+    if len(state["errors"]) < MAX_ERRORS:
+        state["errors"].append({"row": line, "error": error})
+
+
+def read_rows(path):
+    """Rows of the first sheet of an XLSX file, or of a CSV file, one at a time"""
+    if path.lower().endswith(".xlsx"):
+        from openpyxl import load_workbook
+
+        # Read-only workbooks stream rows instead of loading the whole sheet
+        workbook = load_workbook(path, read_only=True, data_only=True)
+        try:
+            for row in workbook.worksheets[0].iter_rows(values_only=True):
+                yield list(row)
+        finally:
+            workbook.close()
+    else:
+        with open(path, newline="", encoding="utf-8-sig") as f:
+            yield from csv.reader(f)
+
+
+def normalise_header(header):
+    return _HEADER.sub("_", str(header or "").strip().lower()).strip("_")
+
+
+def map_columns(header):
+    """Sheet column index -> fieldname, and the headers that match no field.
+
+    A header matches a field by fieldname, by fieldname without the main_
+    prefix or by label.
+    """
+    meta = frappe.get_meta(DOCTYPE)
+    names = {}
+    labels = {}
+    for fieldname in IMPORT_FIELDS:
+        names[fieldname] = fieldname
+        if fieldname.startswith("main_"):
+            names.setdefault(fieldname[len("main_"):], fieldname)
+        label = normalise_header(meta.get_field(fieldname).label)
+        labels.setdefault(label, []).append(fieldname)
+    for label, fieldnames in labels.items():
+        # The international tab repeats the UK labels; a shared label means the UK field
+        uk_fieldnames = [fieldname for fieldname in fieldnames if not fieldname.startswith("int_")]
+        if len(uk_fieldnames) == 1:
+            names.setdefault(label, uk_fieldnames[0])
+
+    columns = {}
+    ignored = []
+    for index, title in enumerate(header):
+        fieldname = names.get(normalise_header(title))
+        if fieldname and fieldname not in columns.values():
+            columns[index] = fieldname
+        elif title not in (None, ""):
+            ignored.append(str(title))
+    return columns, ignored
+
+
+def parse_chunk(chunk, columns, meta, locale=None):
+    """(line, values, error) for each row of a chunk, with amounts parsed a column at a time"""
+    amounts = {
+        index: currency.parse_amounts(
+            [row[index] if index < len(row) else None for line, row in chunk],
+            locale or currency.DEFAULT_LOCALE,
+        )
+        for index, fieldname in columns.items() if not is_text_field(meta.get_field(fieldname))
+    }
+    return [
+        (line,) + parse_row(row, columns, meta, {index: column[i] for index, column in amounts.items()})
+        for i, (line, row) in enumerate(chunk)
+    ]
+
+
+def is_text_field(df):
+    return df.fieldtype in ('Select', 'Link') or df.fieldname in TEXT_FIELDS
+
+
+def parse_row(row, columns, meta, amounts=None):
+    """Field values of one sheet row, or the reason it is rejected.
+
+    amounts holds the row's amounts already parsed by column in the sheet's
+    locale; without it the row is parsed as a chunk of one in the default locale.
+    """
+    if amounts is None:
+        return tuple(parse_chunk([(None, row)], columns, meta)[0][1:])
+
+    values = {}
+    for index, fieldname in columns.items():
+        value = row[index] if index < len(row) else None
+        if isinstance(value, str):
+            value = value.strip()
+        if value in (None, ""):
+            continue
+
+        df = meta.get_field(fieldname)
+        if is_text_field(df):
+            value = str(value)
+            if df.fieldtype == 'Select' and value not in (df.options or "").split("\n"):
+                return None, _("{0} must be one of {1}").format(
+                    _(df.label), ", ".join(option for option in df.options.split("\n") if option))
+        else:
+            number = amounts[index]
+            if number != number:
+                return None, _("{0} is not a number: {1}").format(_(df.label), value)
+            value = cint(number) if df.fieldtype == 'Int' else number
+        values[fieldname] = value
+
+    for fieldname in IMPORT_FIELDS:
+        df = meta.get_field(fieldname)
+        if df.reqd and values.get(fieldname) in (None, "") and not df.default:
+            return None, _("{0} is required").format(_(df.label))
+    return values, None
+
+
+def check_links(deals):
+    """Line -> error for rows whose opportunity or project does not exist, one query per link field"""
+    errors = {}
+    for fieldname, doctype in (("opportunity", "Opportunity"), ("project", "Project")):
+        wanted = {values[fieldname] for line, values in deals if values.get(fieldname)}
+        if not wanted:
+            continue
+        found = set(frappe.get_all(doctype, filters={"name": ("in", list(wanted))}, pluck="name"))
+        for line, values in deals:
+            if values.get(fieldname) and values[fieldname] not in found:
+                errors.setdefault(line, _("{0} {1} not found").format(_(doctype), values[fieldname]))
+    return errors
+
+
+def insert_deals(deals, projection=None):
+    """Evaluate and insert new forecasts with one multi-row INSERT per table"""
+    if not deals:
+        return
+    timestamp = now()
+    docs = []
+    for values in deals:
+        doc = frappe.new_doc(DOCTYPE)
+        doc.update(values)
+        doc.owner = doc.modified_by = frappe.session.user
+        doc.creation = doc.modified = timestamp
+        # Names follow the doctype's own naming rule
+        doc.set_new_name()
+        docs.append(doc)
+
+    updates, tables = evaluate_chunk([frappe._dict(doc.as_dict()) for doc in docs], projection)
+
+    rows = []
+    for doc in docs:
+        doc.update(updates.get(doc.name) or {})
+        rows.append(doc.get_valid_dict(convert_dates_to_str=True))
+    fields = tuple(rows[0])
+    frappe.db.bulk_insert(DOCTYPE, fields, [tuple(row.get(fieldname) for fieldname in fields) for row in rows])
+    insert_tables(tables, timestamp)
@@ -0,0 +1,318 @@
+"""Background recalculation of saved forecasts.
+
+When an assumption changes (growth rate, lending fees, SDLT bands) every
+stored Financial Calculator New is stale. This job walks the doctype in name
+order, a chunk at a time: it reads the inputs with one query, evaluates the
+chunk through the NumPy batch kernel and writes the results back with one
+UPDATE for the parent rows and one multi-row INSERT per child table, instead
+of loading and saving each document. A checkpoint is kept in the cache after
+every committed chunk so an interrupted run resumes where it stopped.
+Result tables are compared with the stored rows first and only rewritten
+for forecasts whose figures moved.
+"""
+import hashlib
+import json
+
+import frappe
+import numpy as np
+from frappe.utils import cint, cstr, flt, now
+
+from financial_calculator_app.calculator import batch, cashflow, growth, kernel
+from financial_calculator_app.financial_calculator_app.doctype.financial_calculator_new.financial_calculator_new import (
+    CALCULATION_INPUTS,
+    CASH_FLOW_RESULT_FIELDS,
+    INPUT_FIELDS,
+    INT_DETAIL_FIELDS,
+    PROFILES,
+    RESULT_FIELDS,
+    SUMMARY_FIELDS,
+    TABLE_COLUMNS,
+    TEXT_COLUMNS,
+    UK_DETAIL_FIELDS,
+    calculation_fingerprint,
+    cash_flow_values,
+    cell_changed,
+    get_cash_flow_assumptions,
+    get_lazy_projection_tables,
+    prepare_deal,
+    result_table_rows,
+)
+
+DOCTYPE = "Financial Calculator New"
+CHUNK_SIZE = 1000
+CHECKPOINT_KEY = "financial_calculator_bulk_recalculate"
+
+# Every field a recalculation reads
+SOURCE_FIELDS = tuple(sorted(
+    set(CALCULATION_INPUTS) |
+    set(UK_DETAIL_FIELDS) | set(INT_DETAIL_FIELDS) |
+    set(INPUT_FIELDS[False].values()) | set(INPUT_FIELDS[True].values())
+))
+
+# Every parent field a recalculation can write
+WRITE_FIELDS = tuple(sorted(
+    {'main_project_management', 'main_average_ratewk', 'calculation_fingerprint'} |
+    set(UK_DETAIL_FIELDS.values()) | set(INT_DETAIL_FIELDS.values()) |
+    set(RESULT_FIELDS[False].values()) | set(RESULT_FIELDS[True].values()) |
+    set(CASH_FLOW_RESULT_FIELDS[False].values()) | set(CASH_FLOW_RESULT_FIELDS[True].values()) |
+    set(SUMMARY_FIELDS[False].values()) | set(SUMMARY_FIELDS[True].values())
+))
+
+
+@frappe.whitelist()
+def enqueue_bulk_recalculation(filters=None, chunk_size=CHUNK_SIZE, resume=0):
+    """Queue a recalculation of every forecast matching filters"""
+    frappe.only_for("System Manager")
+    filters = frappe.parse_json(filters) if filters else None
+
+    job_id = "{0}::{1}".format(CHECKPOINT_KEY, job_key(filters))
+    frappe.enqueue(
+        bulk_recalculate,
+        queue="long",
+        timeout=4 * 60 * 60,
+        job_id=job_id,
+        deduplicate=True,
+        filters=filters,
+        chunk_size=cint(chunk_size) or CHUNK_SIZE,
+        resume=cint(resume),
+    )
+    return job_id
+
+
+@frappe.whitelist()
+def get_bulk_recalculation_status(filters=None):
+    """Checkpoint of the last run for filters"""
+    frappe.only_for("System Manager")
+    filters = frappe.parse_json(filters) if filters else None
+    return frappe.cache().hget(CHECKPOINT_KEY, job_key(filters))
+
+
+def job_key(filters):
+    return hashlib.sha1(json.dumps(filters, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def bulk_recalculate(filters=None, chunk_size=CHUNK_SIZE, resume=False):
+    """Recalculate forecasts chunk by chunk, resuming from the last checkpoint when asked"""
+    key = job_key(filters)
+    state = frappe.cache().hget(CHECKPOINT_KEY, key) if resume else None
+    if not state or state.get("status") == "Completed":
+        state = {
+            "status": "Running",
+            "last_name": None,
+            "processed": 0,
+            "total": frappe.db.count(DOCTYPE, filters),
+        }
+
+    projection = growth.get_projection()
+    while True:
+        chunk_filters = as_filter_list(filters)
+        if state["last_name"]:
+            chunk_filters.append(["name", ">", state["last_name"]])
+
+        rows = frappe.get_all(
+            DOCTYPE,
+            filters=chunk_filters,
+            fields=("name",) + SOURCE_FIELDS,
+            order_by="name asc",
+            limit_page_length=chunk_size,
+        )
+        if not rows:
+            break
+
+        updates, tables = evaluate_chunk(rows, projection)
+        write_chunk(updates, tables)
+        frappe.db.commit()
+
+        state["last_name"] = rows[-1].name
+        state["processed"] += len(rows)
+        frappe.cache().hset(CHECKPOINT_KEY, key, state)
+        frappe.publish_progress(
+            state["processed"] * 100 / (state["total"] or 1),
+            title="Recalculating forecasts",
+            description="{0} of {1}".format(state["processed"], state["total"]),
+        )
+
+    state["status"] = "Completed"
+    frappe.cache().hset(CHECKPOINT_KEY, key, state)
+    return state
+
+
+def as_filter_list(filters):
+    """Filters as a list so the resume condition on name can be appended"""
+    if not filters:
+        return []
+    if isinstance(filters, dict):
+        return [
+            [fieldname] + list(value) if isinstance(value, (list, tuple)) else [fieldname, "=", value]
+            for fieldname, value in filters.items()
+        ]
+    return [list(condition) for condition in filters]
+
+
+def evaluate_chunk(rows, projection=None):
+    """Recalculate a chunk of forecasts read from the database.
+
+    Returns the changed parent fields keyed by name, and the child rows of
+    every result table keyed by name and table field, which are left empty
+    when the projection tables are not stored.
+    """
+    projection = projection or growth.get_projection()
+    docs = [frappe._dict(row) for row in rows]
+    for doc in docs:
+        prepare_deal(doc)
+
+    tables = {doc.name: {} for doc in docs}
+    # One column per assumption, so every deal keeps its own mortgage and rent terms
+    assumptions = cashflow.CashFlowAssumptions(*(
+        list(values) for values in zip(*(get_cash_flow_assumptions(doc) for doc in docs))
+    ))
+    # Growth rows are shared between the investor profiles and deals with the same GDV
+    shared = {}
+    # Stored projection rows are deleted and, when tables are generated on view, not rewritten
+    lazy = get_lazy_projection_tables()
+    for international, profile in PROFILES.items():
+        inputs = [kernel.DealInputs.from_fields(doc, profile.input_fields) for doc in docs]
+        columns = {name: [getattr(deal, name) for deal in inputs] for name in kernel.DealInputs.__slots__}
+        results = batch.evaluate_batch(columns, profile, projection)
+        metrics = cashflow.evaluate_batch(dict(columns, **{
+            name: results[name] for name in ('capital_left_in', 'first_charge_lending', 'gross_rent_pa')
+        }), assumptions, projection)
+
+        for i, doc in enumerate(docs):
+            result = kernel.InvestorResult()
+            for name in batch.BATCH_RESULTS:
+                setattr(result, name, float(results[name][i]))
+            for name, fieldname in profile.result_fields.items():
+                doc[fieldname] = getattr(result, name)
+            for name, fieldname in SUMMARY_FIELDS[international].items():
+                doc[fieldname] = flt(getattr(result, name), 2)
+            if not lazy:
+                result.projection_years = projection.years
+                kernel.capital_growth(inputs[i], result, projection, shared)
+                tables[doc.name].update(result_table_rows(doc, result, international))
+
+            values = cash_flow_values({
+                name: float(metrics[name][i]) if np.isfinite(metrics[name][i]) else None
+                for name in cashflow.CASH_FLOW_RESULTS
+            })
+            for name, fieldname in CASH_FLOW_RESULT_FIELDS[international].items():
+                doc[fieldname] = values[name]
+
+    updates = {}
+    for row, doc in zip(rows, docs):
+        doc.calculation_fingerprint = calculation_fingerprint(doc)
+        changed = {
+            fieldname: doc.get(fieldname) for fieldname in WRITE_FIELDS
+            if field_changed(row.get(fieldname), doc.get(fieldname))
+        }
+        if changed:
+            updates[doc.name] = changed
+    return updates, tables
+
+
+def field_changed(current, value):
+    """Whether a stored parent field differs from its recalculated value.
+
+    Results are kept in Data fields and come back from the database as text
+    such as "11500.0", so numbers are compared as numbers and the rest as text.
+    """
+    if isinstance(value, (int, float)) and current not in (None, ""):
+        return flt(current) != value
+    return cstr(current) != cstr(value)
+
+
+def write_chunk(updates, tables):
+    """Write a recalculated chunk with set-based statements.
+
+    Result tables are only deleted and inserted again for forecasts whose
+    stored rows differ from the recalculated ones.
+    """
+    timestamp = now()
+    bulk_update(updates, timestamp)
+
+    if not tables:
+        return
+    meta = frappe.get_meta(DOCTYPE)
+    changed = {}
+    for table, columns in TABLE_COLUMNS.items():
+        child_doctype = meta.get_field(table).options
+        stored = stored_table_rows(child_doctype, table, columns, list(tables))
+        parents = [
+            parent for parent, parent_tables in tables.items()
+            if table_changed(stored.get(parent, []), parent_tables.get(table) or [], columns)
+        ]
+        if not parents:
+            continue
+        frappe.db.sql(
+            "delete from `tab{0}` where parenttype=%s and parentfield=%s and parent in %s".format(child_doctype),
+            (DOCTYPE, table, tuple(parents)),
+        )
+        for parent in parents:
+            changed.setdefault(parent, {})[table] = tables[parent].get(table) or []
+    insert_tables(changed, timestamp)
+
+
+def stored_table_rows(child_doctype, table, columns, names):
+    """Stored rows of one result table for many forecasts, keyed by parent in idx order"""
+    rows = frappe.get_all(
+        child_doctype,
+        filters={"parenttype": DOCTYPE, "parentfield": table, "parent": ("in", names)},
+        fields=["parent"] + list(columns),
+        order_by="parent asc, idx asc",
+        limit_page_length=0,
+    )
+    stored = {}
+    for row in rows:
+        stored.setdefault(row.parent, []).append(row)
+    return stored
+
+
+def table_changed(stored, rows, columns):
+    """Whether a forecast's stored table rows differ from its recalculated ones"""
+    if len(stored) != len(rows):
+        return True
+    return any(
+        cell_changed(current, column, row[column])
+        for current, row in zip(stored, rows) for column in columns
+    )
+
+
+def insert_tables(tables, timestamp):
+    """Insert the result table rows of many forecasts with one multi-row INSERT per table"""
+    meta = frappe.get_meta(DOCTYPE)
+    for table, columns in TABLE_COLUMNS.items():
+        child_doctype = meta.get_field(table).options
+        fields = ("name", "parent", "parenttype", "parentfield", "idx", "docstatus",
+                  "owner", "modified_by", "creation", "modified") + columns
+        values = []
+        for parent, parent_tables in tables.items():
+            for idx, row in enumerate(parent_tables.get(table) or [], 1):
+                values.append((frappe.generate_hash(length=10), parent, DOCTYPE, table, idx, 0,
+                               frappe.session.user, frappe.session.user, timestamp, timestamp) +
+                              tuple(row[column] if column in TEXT_COLUMNS else flt(row[column]) for column in columns))
+        if values:
+            frappe.db.bulk_insert(child_doctype, fields, values)
+
+
+def bulk_update(updates, timestamp):
+    """Update many forecasts in one statement with a CASE per changed column"""
+    if not updates:
+        return
+    names = list(updates)
+    fieldnames = sorted({fieldname for changed in updates.values() for fieldname in changed})
+
+    assignments = []
+    values = []
+    for fieldname in fieldnames:
+        cases = []
+        for name in names:
+            if fieldname in updates[name]:
+                cases.append("when %s then %s")
+                values.extend((name, updates[name][fieldname]))
+        assignments.append("`{0}` = case `name` {1} else `{0}` end".format(fieldname, " ".join(cases)))
+
+    frappe.db.sql(
+        "update `tab{0}` set {1}, `modified` = %s, `modified_by` = %s where `name` in %s".format(
+            DOCTYPE, ", ".join(assignments)),
+        values + [timestamp, frappe.session.user, tuple(names)],
+    )
@@ -0,0 +1,296 @@
+"""Columnar export of forecasts and their projections.
+
+Analytics extracts read the forecast table and the capital growth and
+returns tables with keyset-paginated queries, a batch of forecasts at a
+time, and write each batch as columns to CSV, Parquet or an Arrow IPC file.
+Memory is bounded by the batch size however large the book is. The result
+fields the calculator stores as text are written as numbers, and an extract
+can be limited to forecasts modified after a given time so nightly runs only
+pick up what changed.
+
+Where the projection tables are not stored on save, their rows are
+generated from each forecast's stored inputs as the batch is exported.
+
+Parquet and Arrow need pyarrow, which is imported only when one of those
+formats is asked for.
+"""
+import csv
+
+import frappe
+from frappe import _
+from frappe.utils import cint, get_datetime, now_datetime
+
+from financial_calculator_app.calculator import kernel
+from financial_calculator_app.financial_calculator_app.doctype.financial_calculator_new.financial_calculator_new import (
+    CALCULATION_INPUTS,
+    CASH_FLOW_RESULT_FIELDS,
+    SUMMARY_FIELDS,
+    TABLES,
+    get_lazy_projection_tables,
+    projection_tables,
+)
+
+DOCTYPE = "Financial Calculator New"
+BATCH_SIZE = 5000
+STATUS_KEY = "financial_calculator_columnar_export"
+FILE_EXTENSIONS = {"csv": "csv", "parquet": "parquet", "arrow": "arrow"}
+INVESTORS = {False: "UK", True: "International"}
+
+# Forecast columns and their types; result fields are stored as text but exported as numbers
+FORECAST_COLUMNS = (
+    ("name", "string"),
+    ("modified", "timestamp"),
+    ("forecast_type", "string"),
+    ("forecast_name", "string"),
+    ("opportunity", "string"),
+    ("project", "string"),
+    ("main_sdlt", "string"),
+    ("mortgage_type", "string"),
+) + tuple(
+    (fieldname, "float")
+    for field_map in (kernel.UK_RESULT_FIELDS, CASH_FLOW_RESULT_FIELDS[False], SUMMARY_FIELDS[False],
+                      kernel.INT_RESULT_FIELDS, CASH_FLOW_RESULT_FIELDS[True], SUMMARY_FIELDS[True])
+    for fieldname in field_map.values()
+)
+
+# Projection dataset -> (index of its table in TABLES, columns read from the child table)
+PROJECTIONS = {
+    "capital_growth": (0, (("year", "int"), ("value", "float"), ("growth_rate", "float"), ("increase", "float"))),
+    "returns": (2, (("metric", "string"), ("value", "float"), ("percentage", "float"))),
+}
+DATASETS = ("forecasts",) + tuple(PROJECTIONS)
+
+
+@frappe.whitelist()
+def enqueue_export(dataset="forecasts", file_format="parquet", modified_since=None):
+    """Queue an extract of a dataset into a private file, returning the file name"""
+    frappe.only_for("System Manager")
+    validate_export(dataset, file_format)
+
+    file_name = "{0}-{1}.{2}".format(dataset, now_datetime().strftime("%Y%m%d%H%M%S"), FILE_EXTENSIONS[file_format])
+    frappe.enqueue(
+        export_to_file,
+        queue="long",
+        timeout=60 * 60,
+        job_id="{0}::{1}".format(STATUS_KEY, file_name),
+        deduplicate=True,
+        file_name=file_name,
+        dataset=dataset,
+        file_format=file_format,
+        modified_since=modified_since,
+    )
+    return file_name
+
+
+@frappe.whitelist()
+def get_export_status(file_name):
+    """Rows written and the modified watermark of an extract"""
+    frappe.only_for("System Manager")
+    return frappe.cache().hget(STATUS_KEY, file_name)
+
+
+def validate_export(dataset, file_format):
+    if dataset not in DATASETS:
+        frappe.throw(_("Unknown dataset {0}").format(dataset))
+    if file_format not in FILE_EXTENSIONS:
+        frappe.throw(_("Unknown export format {0}").format(file_format))
+
+
+def export_to_file(file_name, dataset, file_format, modified_since=None):
+    """Write an extract to the site's private files and attach it as a File"""
+    frappe.cache().hset(STATUS_KEY, file_name, {"status": "Running"})
+    state = export(frappe.get_site_path("private", "files", file_name), dataset, file_format, modified_since)
+    frappe.get_doc({
+        "doctype": "File",
+        "file_name": file_name,
+        "file_url": "/private/files/" + file_name,
+        "is_private": 1,
+    }).insert(ignore_permissions=True)
+
+    state["status"] = "Completed"
+    frappe.cache().hset(STATUS_KEY, file_name, state)
+    return state
+
+
+def export(path, dataset="forecasts", file_format="csv", modified_since=None, batch_size=BATCH_SIZE):
+    """Stream a dataset to path a batch at a time.
+
+    Returns the rows written and the latest modified time exported, the
+    watermark to pass as modified_since on the next incremental run.
+    """
+    validate_export(dataset, file_format)
+    columns = FORECAST_COLUMNS if dataset == "forecasts" else projection_columns(dataset)
+    # Projections only need the forecast names
+    fields = [column for column, column_type in FORECAST_COLUMNS] if dataset == "forecasts" else ["name", "modified"]
+
+    rows_written = forecasts = 0
+    last_modified = None
+    writer = get_writer(path, columns, file_format)
+    try:
+        for rows in forecast_batches(fields, modified_since, batch_size):
+            if dataset == "forecasts":
+                batch = forecast_columns(rows)
+            else:
+                batch = projection_batch(dataset, [row.name for row in rows])
+            writer.write(batch)
+
+            rows_written += len(batch[columns[0][0]])
+            forecasts += len(rows)
+            latest = max(row.modified for row in rows)
+            last_modified = latest if last_modified is None else max(last_modified, latest)
+    finally:
+        writer.close()
+    return {
+        "rows": rows_written,
+        "forecasts": forecasts,
+        "last_modified": str(last_modified) if last_modified else None,
+    }
+
+
+def forecast_batches(fields, modified_since=None, batch_size=BATCH_SIZE):
+    """Forecast rows in name order, one batch per query"""
+    conditions = ["`docstatus` < 2"]
+    values = {"limit": cint(batch_size) or BATCH_SIZE}
+    if modified_since:
+        conditions.append("`modified` > %(modified_since)s")
+        values["modified_since"] = get_datetime(modified_since)
+
+    last_name = None
+    while True:
+        batch_conditions = conditions + (["`name` > %(last_name)s"] if last_name else [])
+        rows = frappe.db.sql(
+            "select {0} from `tab{1}` where {2} order by `name` limit %(limit)s".format(
+                ", ".join("`{0}`".format(field) for field in fields), DOCTYPE, " and ".join(batch_conditions)),
+            dict(values, last_name=last_name),
+            as_dict=True,
+        )
+        if not rows:
+            return
+        yield rows
+        last_name = rows[-1].name
+
+
+def as_number(value):
+    """A stored figure as a float, None when blank"""
+    if value is None or value == "":
+        return None
+    if isinstance(value, str):
+        # Figures typed in by hand may carry thousands separators
+        value = value.replace(",", "")
+    return kernel.stored_number(value)
+
+
+def forecast_columns(rows):
+    """A batch of forecast rows as columns"""
+    batch = {}
+    for column, column_type in FORECAST_COLUMNS:
+        values = [row.get(column) for row in rows]
+        batch[column] = [as_number(value) for value in values] if column_type == "float" else values
+    return batch
+
+
+def projection_columns(dataset):
+    return (("forecast", "string"), ("investor", "string"), ("idx", "int")) + PROJECTIONS[dataset][1]
+
+
+def projection_batch(dataset, names):
+    """Rows of a projection table, UK and International, for a batch of forecasts as columns"""
+    columns = projection_columns(dataset)
+    batch = {column: [] for column, column_type in columns}
+    if not names:
+        return batch
+
+    table_index, table_columns = PROJECTIONS[dataset]
+    generated = generated_projections(names) if get_lazy_projection_tables() else None
+    meta = frappe.get_meta(DOCTYPE)
+    for international, investor in INVESTORS.items():
+        table = TABLES[international][table_index]
+        if generated is not None:
+            rows = [
+                (name, idx) + tuple(row[column] for column, column_type in table_columns)
+                for name, tables in generated for idx, row in enumerate(tables[table], 1)
+            ]
+        else:
+            rows = frappe.db.sql(
+                "select `parent`, `idx`, {0} from `tab{1}` where `parenttype` = %s and `parentfield` = %s "
+                "and `parent` in %s order by `parent`, `idx`".format(
+                    ", ".join("`{0}`".format(column) for column, column_type in table_columns),
+                    meta.get_field(table).options),
+                (DOCTYPE, table, tuple(names)),
+            )
+        for row in rows:
+            batch["forecast"].append(row[0])
+            batch["investor"].append(investor)
+            batch["idx"].append(row[1])
+            for (column, column_type), value in zip(table_columns, row[2:]):
+                batch[column].append(as_number(value) if column_type == "float" else value)
+    return batch
+
+
+def generated_projections(names):
+    """(name, projection tables) of a batch of forecasts whose tables are not stored, in name order"""
+    docs = frappe.get_all(
+        DOCTYPE,
+        filters={"name": ("in", names)},
+        fields=("name",) + CALCULATION_INPUTS,
+        order_by="name asc",
+        limit_page_length=0,
+    )
+    return [(doc.name, projection_tables(doc)) for doc in docs]
+
+
+def get_writer(path, columns, file_format):
+    if file_format == "csv":
+        return CSVWriter(path, columns)
+    return ArrowWriter(path, columns, file_format)
+
+
+class CSVWriter:
+    """Writes column batches as CSV rows"""
+
+    def __init__(self, path, columns):
+        self.columns = [column for column, column_type in columns]
+        self.file = open(path, "w", newline="", encoding="utf-8")
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(self.columns)
+
+    def write(self, batch):
+        self.writer.writerows(zip(*(batch[column] for column in self.columns)))
+
+    def close(self):
+        self.file.close()
+
+
+class ArrowWriter:
+    """Writes column batches as Parquet row groups or Arrow IPC record batches"""
+
+    def __init__(self, path, columns, file_format):
+        try:
+            import pyarrow
+        except ImportError:
+            frappe.throw(_("Install pyarrow to export {0} files").format(file_format))
+        types = {
+            "string": pyarrow.string(),
+            "float": pyarrow.float64(),
+            "int": pyarrow.int64(),
+            "timestamp": pyarrow.timestamp("us"),
+        }
+        self.pyarrow = pyarrow
+        self.schema = pyarrow.schema([(column, types[column_type]) for column, column_type in columns])
+        if file_format == "parquet":
+            import pyarrow.parquet
+
+            self.writer = pyarrow.parquet.ParquetWriter(path, self.schema)
+        else:
+            # The IPC file format can be memory-mapped and read without copying
+            self.writer = pyarrow.ipc.new_file(path, self.schema)
+
+    def write(self, batch):
+        record_batch = self.pyarrow.record_batch(
+            [self.pyarrow.array(batch[field.name], type=field.type) for field in self.schema],
+            schema=self.schema,
+        )
+        self.writer.write_table(self.pyarrow.Table.from_batches([record_batch]))
+
+    def close(self):
+        self.writer.close()
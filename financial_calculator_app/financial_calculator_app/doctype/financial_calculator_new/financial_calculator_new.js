@@ -1,47 +1,9 @@
-frappe.ui.form.on('Financial Calculator New', {
+const form_handlers = {
     opportunity: function(frm) {
-        if (frm.doc.opportunity) {
-            // Fetch Opportunity details
-            frappe.call({
-                method: 'frappe.client.get',
-                args: {
-                    doctype: 'Opportunity',
-                    name: frm.doc.opportunity
-                },
-                callback: function(response) {
-                    if (response.message) {
-                        const opp = response.message;
-                        // Set Forecast Name = "Opportunity Name - Address"
-                        frm.set_value('forecast_name', `${opp.name} - ${opp.custom_address || ''}`);
-                    }
-                }
-            });
-        } else {
-            // Clear if no Opportunity selected
-            frm.set_value('forecast_name', '');
-        }
+        set_forecast_name(frm, 'Opportunity', frm.doc.opportunity);
     },
     project: function(frm) {
-        if (frm.doc.project) {
-            // Fetch Opportunity details
-            frappe.call({
-                method: 'frappe.client.get',
-                args: {
-                    doctype: 'Project',
-                    name: frm.doc.project
-                },
-                callback: function(response) {
-                    if (response.message) {
-                        const project = response.message;
-                        // Set Forecast Name = "Opportunity Name - Address"
-                        frm.set_value('forecast_name', `${project.name} - ${project.custom_address || ''}`);
-                    }
-                }
-            });
-        } else {
-            // Clear if no Opportunity selected
-            frm.set_value('forecast_name', '');
-        }
+        set_forecast_name(frm, 'Project', frm.doc.project);
     },
     refresh: function(frm) {
         // Add single calculate button if not already present frm.is_new()
@@ -51,84 +13,166 @@ frappe.ui.form.on('Financial Calculator New', {
             });
             frm.calculator_setup = true;
         // }
-    },
 
-    // Field change handlers (keep your existing ones)
-    sdlt: function(frm) {
-        if (frm.doc.purchase_price) {
-            frm.call('calculate_sdlt').then(() => {
-                frm.refresh_field('sdlt_amount');
-            });
-        }
-    },
-    purchase_price: function(frm) {
-        if (frm.doc.sdlt) {
-            frm.call('calculate_sdlt').then(() => {
-                frm.refresh_field('sdlt_amount');
-            });
-        }
-    },
-    main_renovation: function(frm) {
-        if (frm.doc.main_renovation) {
-            frm.call('calculate_project_management').then(() => {
-                frm.refresh_field('main_project_management');
-            });
+        if (frm.doc.__onload && frm.doc.__onload.lazy_projection_tables) {
+            setup_projection_tabs(frm);
         }
-    },
-    main_project_management_percentage: function(frm) {
-        if (frm.doc.main_project_management_percentage) {
-            frm.call('calculate_project_management').then(() => {
-                frm.refresh_field('main_project_management');
-            });
-        }
-    },
-    main_rooms: function(frm) {
-        if (frm.doc.main_rooms && frm.doc.main_rentm_rm_rate_reverse_calc) {
-            frm.call('calculate_main_average_ratewk').then(() => {
-                frm.refresh_field('main_average_ratewk');
-            });
+    }
+};
+
+// Fields that trigger a recalculation when edited. Bursts of edits are
+// merged into a single server call that returns only the fields that changed.
+const RECALCULATE_FIELDS = [
+    'main_purchase_price', 'main_gross_development_value', 'main_renovation', 'main_rooms',
+    'main_rentm_rm_rate_reverse_calc', 'main_average_ratewk', 'main_sdlt',
+    'main_architectplanning', 'main_building_control', 'main_furniture', 'main_survey',
+    'main_legals', 'main_insurance', 'main_sourcing', 'main_lease_setup',
+    'main_project_management_percentage',
+    'sdlt', 'purchase_price', 'first_charge_lending_ltv', 'mortgage_percent',
+    'operational_expenses_percent', 'management_percent',
+    'int_sdlt', 'int_purchase_price', 'int_first_charge_lending_ltv', 'int_mortgage_percent',
+    'int_operational_expenses_percent', 'int_management_percent',
+    'mortgage_type', 'mortgage_term_years', 'fixed_rate_years', 'reversion_rate',
+    'rent_escalation_percent', 'void_percent', 'discount_rate_percent'
+];
+const RECALCULATE_DELAY = 300;
+
+// Projection tables of each investor tab. Sites that do not store them on
+// save generate them on the server when the tab is opened.
+const PROJECTION_TABS = {
+    uk_investors_tab: ['capital_growth_table', 'capital_gain_table', 'returns_table'],
+    international_investors_tab: ['capital_growth_int_table', 'capital_gain_int_table', 'returns_int_table']
+};
+
+RECALCULATE_FIELDS.forEach(function(field) {
+    form_handlers[field] = function(frm) {
+        queue_recalculate(frm, field);
+    };
+});
+
+frappe.ui.form.on('Financial Calculator New', form_handlers);
+
+function set_forecast_name(frm, doctype, name) {
+    if (!name) {
+        // Clear if no Opportunity or Project selected
+        frm.set_value('forecast_name', '');
+        return;
+    }
+    // Only the fields the name is built from, cached on the server
+    frappe.call({
+        method: 'financial_calculator_app.financial_calculator_app.doctype.financial_calculator_new.link_details.get_link_details',
+        args: {
+            doctype: doctype,
+            name: name,
+            fields: ['name', 'custom_address']
+        },
+        callback: function(response) {
+            if (response.message) {
+                const link = response.message;
+                // Set Forecast Name = "Opportunity Name - Address"
+                frm.set_value('forecast_name', `${link.name} - ${link.custom_address || ''}`);
+            }
         }
+    });
+}
 
-        if (frm.doc.main_rooms && frm.doc.main_average_ratewk) {
-            frm.call('calculate_rent').then(() => {
-                frm.refresh_field('main_rentm_rm_rate_reverse_calc');
-            });
+function queue_recalculate(frm, field) {
+    frm.pending_changes = frm.pending_changes || {};
+    frm.pending_changes[field] = frm.doc[field];
+
+    clearTimeout(frm.recalculate_timer);
+    frm.recalculate_timer = setTimeout(function() {
+        recalculate(frm);
+    }, RECALCULATE_DELAY);
+}
+
+function recalculate(frm, full) {
+    clearTimeout(frm.recalculate_timer);
+    const changes = frm.pending_changes || {};
+    frm.pending_changes = {};
+
+    return frappe.call({
+        method: 'financial_calculator_app.financial_calculator_app.doctype.financial_calculator_new.financial_calculator_new.recalculate',
+        args: {
+            values: scalar_values(frm),
+            changes: changes,
+            full: full ? 1 : 0
         }
-    },
-    main_rentm_rm_rate_reverse_calc: function(frm) {
-        if (frm.doc.main_rentm_rm_rate_reverse_calc) {
-            frm.set_value('main_lease_setup', frm.doc.main_rentm_rm_rate_reverse_calc);
+    }).then(function(r) {
+        apply_recalculated(frm, r.message || {});
+        if (frm.projection_tabs_loaded) {
+            // Generated tables are stale now; reload the open tab, the others when next opened
+            frm.projection_tabs_loaded = {};
+            const tab = frm.get_active_tab && frm.get_active_tab();
+            if (tab && PROJECTION_TABS[tab.df.fieldname]) {
+                load_projection_tables(frm, tab.df.fieldname);
+            }
         }
-        
-        if (frm.doc.main_rooms && frm.doc.main_rentm_rm_rate_reverse_calc) {
-            frm.call('calculate_main_average_ratewk').then(() => {
-                frm.refresh_field('main_average_ratewk');
-            });
+    });
+}
+
+function scalar_values(frm) {
+    // Send scalar fields only; child tables are always rebuilt on the server
+    const values = {};
+    Object.keys(frm.doc).forEach(function(field) {
+        if (!Array.isArray(frm.doc[field]) && !field.startsWith('__')) {
+            values[field] = frm.doc[field];
         }
-    },
-    main_average_ratewk: function(frm) {
-        if (frm.doc.main_rooms && frm.doc.main_average_ratewk) {
-            frm.call('calculate_rent').then(() => {
-                // frm.refresh_field('main_rentm_rm_rate_reverse_calc');
-                frm.refresh_fields(['main_rentm_rm_rate_reverse_calc', 'main_lease_setup']);
-            });
+    });
+    return values;
+}
+
+function setup_projection_tabs(frm) {
+    frm.projection_tabs_loaded = {};
+    if (frm.projection_tabs_bound) {
+        return;
+    }
+    frm.projection_tabs_bound = true;
+    frm.$wrapper.on('shown.bs.tab', function(e) {
+        const tab = $(e.target).attr('data-fieldname');
+        if (PROJECTION_TABS[tab] && !frm.projection_tabs_loaded[tab]) {
+            load_projection_tables(frm, tab);
         }
-    },
-    int_sdlt: function(frm) {
-        if (frm.doc.int_purchase_price) {
-            frm.call('calculate_sdlt_amount').then(() => {
-                frm.refresh_field('int_sdlt_amount');
+    });
+}
+
+function load_projection_tables(frm, tab) {
+    frm.projection_tabs_loaded[tab] = true;
+    return frappe.call({
+        method: 'financial_calculator_app.financial_calculator_app.doctype.financial_calculator_new.financial_calculator_new.get_projection_tables',
+        args: {values: scalar_values(frm)}
+    }).then(function(r) {
+        const tables = r.message || {};
+        // Shown only; the tables are cleared again on save
+        PROJECTION_TABS[tab].forEach(function(field) {
+            frm.doc[field] = [];
+            (tables[field] || []).forEach(function(row) {
+                frm.add_child(field, row);
             });
-        }
-    },
-    int_purchase_price: function(frm) {
-        if (frm.doc.int_purchase_price) {
-            frm.call('calculate_all').then(() => {
-                frm.refresh_fields(['int_sdlt_amount', 'lending_and_brokerage_fees']);
+        });
+        frm.refresh_fields(PROJECTION_TABS[tab]);
+    });
+}
+
+function apply_recalculated(frm, delta) {
+    // Assign directly so the returned values do not retrigger the handlers above
+    const fields = Object.keys(delta);
+    fields.forEach(function(field) {
+        if (Array.isArray(delta[field])) {
+            frm.clear_table(field);
+            delta[field].forEach(function(row) {
+                frm.add_child(field, row);
             });
+        } else {
+            frm.doc[field] = delta[field];
         }
+    });
+
+    if (fields.length) {
+        frm.refresh_fields(fields);
+        frm.dirty();
     }
-});
+}
 
 function calculate_all(frm) {
     // First validate all required fields in details tab
@@ -149,11 +193,8 @@ function calculate_all(frm) {
         return;
     }
     
-    // Call server method that will:
-    // 1. Copy values from details to UK investor
-    // 2. Perform all calculations
-    frm.call('run_calculations').then(() => {
-        frm.refresh();
+    // Copy values from details to both investor tabs and perform all calculations
+    recalculate(frm, true).then(() => {
         frappe.show_alert({message: __('All calculations completed'), indicator:'green'});
     });
 }
\ No newline at end of file
@@ -1,520 +1,419 @@
 from __future__ import unicode_literals
+import hashlib
+import json
+from contextlib import contextmanager
+
 import frappe
 from frappe.model.document import Document
-import re
+from frappe.utils import cint, flt
+
+from financial_calculator_app.calculator import cashflow, kernel, metrics, sdlt, sensitivity, simulation, solver
+from financial_calculator_app.calculator.cache import ResultCache
+from financial_calculator_app.calculator.graph import CalculationGraph, CalculationNode
 
 class FinancialCalculatorNew(Document):
     def validate(self):
-        if not hasattr(self, '_is_calculating'):
-            self.copy_details_to_uk_investor()
-            self.copy_details_to_int_investor()
-
-            self.calculate_sdlt()
-            self.calculate_acquisition_costs()
-            self.calculate_post_works_refinance()
-            self.calculate_rental_income()
-            self.calculate_capital_growth()
-            self.calculate_capital_gain()
-            self.calculate_returns()
-            self.calculate_sdlt_amount()
-            self.calculate_lending_and_brokerage_fees()
-            self.calculate_project_management()
-            self.calculate_acquisition_costs_int()
-            self.calculate_post_works_refinance_int()
-            self.calculate_rental_income_int()
-            self.calculate_capital_growth_int()
-            self.calculate_capital_gain_int()
-            self.calculate_returns_int()
-            self.calculate_main_average_ratewk()
-
-    
+        if hasattr(self, '_is_calculating'):
+            return
+        with sample_calculation(self, "validate"):
+            if get_lazy_projection_tables():
+                # Projection tables are generated when viewed and never stored
+                self.clear_projection_tables()
+            if self.flags.force_calculation:
+                self.calculate()
+            elif self.calculation_fingerprint != self.get_calculation_fingerprint():
+                changed = self.get_changed_calculation_fields()
+                # A stale fingerprint with no field changed since the last save (a calculation
+                # version bump, or a document saved before fingerprints) needs every step
+                self.calculate(changed if changed and self.calculation_fingerprint else None)
+
+    def onload(self):
+        self.set_onload("lazy_projection_tables", get_lazy_projection_tables())
+
+    def before_print(self, settings=None):
+        """Generate the projection tables for printing when they are not stored"""
+        if get_lazy_projection_tables():
+            self.set_projection_tables()
+
     def copy_details_to_uk_investor(self):
         """Copy values from details tab to UK investor tab"""
-        # Map detail tab fields to UK investor tab fields
-        field_mapping = {
-            'main_asking_price': 'asking_price',
-            'main_purchase_price': 'purchase_price',
-            'main_renovation': 'renovation',
-            # Add all other fields that should be copied
-            'main_architectplanning': 'architectplanning',
-            'main_building_control': 'building_control',
-            'main_furniture': 'furniture',
-            'main_survey': 'survey',
-            'main_legals': 'legals',
-            'main_insurance': 'insurance',
-            'main_sourcing': 'sourcing',
-            'main_rooms': 'rooms',
-            'main_rentm_rm_rate_reverse_calc': 'rentm_rm_rate_reverse_calc',
-            'main_average_ratewk': 'average_ratewk',
-            'main_gross_development_value': 'gross_development_value',
-            'main_sdlt': 'sdlt'
-        }
-        
-        for detail_field, uk_field in field_mapping.items():
-            # Only copy if the UK field is empty and detail field has value
-            if getattr(self, detail_field, None) is not None:
-                setattr(self, uk_field, getattr(self, detail_field))
+        copy_details(self, UK_DETAIL_FIELDS)
 
     def copy_details_to_int_investor(self):
-        """Copy values from details tab to UK investor tab"""
-        # Map detail tab fields to UK investor tab fields
-        field_mapping = {
-            'main_asking_price': 'int_asking_price',
-            'main_purchase_price': 'int_purchase_price',
-            'main_renovation': 'int_renovation',
-            # Add all other fields that should be copied
-            'main_architectplanning': 'int_architectplanning',
-            'main_building_control': 'int_building_control',
-            'main_furniture': 'int_furniture',
-            'main_survey': 'int_survey',
-            'main_legals': 'int_legals',
-            'main_insurance': 'int_insurance',
-            'main_sourcing': 'int_sourcing',
-            'main_rooms': 'int_rooms',
-            'main_rentm_rm_rate_reverse_calc': 'int_rentm_rm_rate_reverse_calc',
-            'main_lease_setup': 'lease_setup',
-            'main_project_management_percentage': 'int_project_management_percentage',
-            'main_project_management': 'project_management',
-            'main_average_ratewk': 'int_average_ratewk',
-            'main_gross_development_value': 'int_gross_development_value',
-            'main_sdlt': 'int_sdlt'
-        }
-        
-        for detail_field, int_field in field_mapping.items():
-            # Only copy if the UK field is empty and detail field has value
-            if getattr(self, detail_field, None) is not None:
-                setattr(self, int_field, getattr(self, detail_field))
+        """Copy values from details tab to international investor tab"""
+        copy_details(self, INT_DETAIL_FIELDS)
 
     def clean_currency(self, value):
         """Convert currency string to float by removing all non-numeric characters"""
-        if value is None or value == "":
-            return 0
-        if isinstance(value, str):
-            # Remove all non-numeric characters except decimal point
-            value = re.sub(r'[^\d.]', '', value)
-            try:
-                return float(value) if value else 0
-            except ValueError:
-                return 0
-        return float(value)
-    
-    def calculate_acquisition_costs(self):
-        """Calculate all acquisition cost related fields"""
-        fields_to_sum = [
-            'purchase_price',
-            'renovation',
-            'architectplanning',
-            'building_control',
-            'furniture',
-            'survey',
-            'legals',
-            'insurance',
-            'sourcing',
-            'sdlt_amount'  # Include SDLT in total costs
-        ]
-        
-        total = 0
-        for field in fields_to_sum:
-            value = getattr(self, field, None)
-            total += self.clean_currency(value)
-        
-        self.capital_in = total
-    
+        return kernel.clean_currency(value)
+
+    def calculate(self, changed_fields=None):
+        """Recalculate the fields affected by changed_fields, everything when None"""
+        plan = CALCULATION_GRAPH.plan(changed_fields)
+        full = len(plan) == len(CALCULATION_GRAPH.nodes)
+        tables = not get_lazy_projection_tables()
+        if not tables:
+            plan = tuple(node for node in plan if not node.outputs <= PROJECTION_TABLES)
+        if full:
+            self.evaluate_deal(tables)
+        else:
+            CALCULATION_GRAPH.run(self, plan, self.flags.metrics_sample)
+        self.calculation_fingerprint = self.get_calculation_fingerprint()
+        return plan
+
+    def get_calculation_fingerprint(self):
+        """Stable hash of every field the calculations read"""
+        return calculation_fingerprint(self)
+
+    def get_changed_calculation_fields(self):
+        """Calculation fields changed since the last save, None for a new document"""
+        doc_before_save = self.get_doc_before_save()
+        if not doc_before_save:
+            return None
+
+        changed = set()
+        for fieldname in CALCULATION_GRAPH.fields:
+            value = self.get(fieldname)
+            # Child tables are only ever written by the calculator
+            if isinstance(value, list):
+                continue
+            if value != doc_before_save.get(fieldname):
+                changed.add(fieldname)
+        return changed
+
+    @frappe.whitelist()
+    def get_calculation_plan(self, changed_fields=None):
+        """Steps that would run for the given changed fields, in order"""
+        if isinstance(changed_fields, str):
+            changed_fields = frappe.parse_json(changed_fields)
+        return CALCULATION_GRAPH.describe(CALCULATION_GRAPH.plan(changed_fields))
+
+    def evaluate_deal(self, tables=True):
+        """Run every step in one pass through the kernel, leaving out the projection tables unless tables"""
+        sample = self.flags.metrics_sample
+        with metrics.timed(sample, "prepare_deal"):
+            prepare_deal(self)
+
+        # Every investor profile is evaluated together so they share intermediate results
+        with metrics.timed(sample, "evaluate"):
+            inputs = {profile: self.get_deal_inputs(profile.input_fields) for profile in PROFILES.values()}
+            results = RESULT_CACHE.evaluate_profiles(inputs)
+
+        for international, profile in PROFILES.items():
+            suffix = "_int" if international else ""
+            result = results[profile]
+            self.set_investor_result(result, profile.result_fields)
+            self.set_summary_result(result, international)
+            if tables:
+                with metrics.timed(sample, "result_tables" + suffix):
+                    self.set_capital_growth_table(result, international)
+                    self.set_capital_gain_table(result, international)
+                    self.set_returns_table(result, international)
+            with metrics.timed(sample, "calculate_cash_flow" + suffix):
+                self.set_cash_flow_result(inputs[profile], result, international)
+
+    def get_deal_inputs(self, field_map):
+        """Build kernel inputs for one investor tab"""
+        return kernel.DealInputs.from_fields(self, field_map)
+
+    def get_investor_state(self, international=False):
+        """Kernel inputs and the results currently stored on one investor tab"""
+        inputs = self.get_deal_inputs(INPUT_FIELDS[international])
+        result = kernel.InvestorResult()
+        for name, fieldname in RESULT_FIELDS[international].items():
+            setattr(result, name, kernel.stored_number(self.get(fieldname)))
+        return inputs, result
+
+    def set_investor_result(self, result, field_map, fields=None):
+        """Write kernel results back to the investor tab fields"""
+        for name, fieldname in field_map.items():
+            if fields is None or name in fields:
+                setattr(self, fieldname, getattr(result, name))
+
+    def set_summary_result(self, result, international=False):
+        """Write the headline results to their numeric, indexed columns"""
+        for name, fieldname in SUMMARY_FIELDS[international].items():
+            setattr(self, fieldname, flt(getattr(result, name), 2))
+
+    def run_investor_stage(self, stage, fields, international=False):
+        """Run one kernel stage against the stored state of an investor tab"""
+        inputs, result = self.get_investor_state(international)
+        stage(inputs, result, PROFILES[international])
+        self.set_investor_result(result, RESULT_FIELDS[international], fields)
+
+    def run_projection_stage(self, international=False):
+        """Kernel results with the growth projections filled in for one investor tab"""
+        inputs, result = self.get_investor_state(international)
+        kernel.projections(inputs, result)
+        return result
+
+    def set_cash_flow_result(self, inputs, result, international=False):
+        """IRR, NPV and equity multiple of the monthly cash flows for one investor tab"""
+        cash_flow_metrics = cashflow.evaluate(inputs, result, get_cash_flow_assumptions(self))
+        for name, value in cash_flow_values(cash_flow_metrics).items():
+            setattr(self, CASH_FLOW_RESULT_FIELDS[international][name], value)
+
+    def sync_table(self, table, rows):
+        """Reconcile a child table with rows in place.
+
+        Existing rows keep their names and only cells whose values differ are
+        set, so a save updates rows instead of deleting and reinserting them.
+        Rows are only added or removed when the row count changes.
+        """
+        existing = self.get(table) or []
+        inserted = updated = 0
+        for idx, values in enumerate(rows):
+            if idx >= len(existing):
+                self.append(table, values)
+                inserted += 1
+                continue
+            row = existing[idx]
+            changed = False
+            for column, value in values.items():
+                if cell_changed(row, column, value):
+                    row.set(column, value)
+                    changed = True
+            updated += changed
+        deleted = max(len(existing) - len(rows), 0)
+        del existing[len(rows):]
+
+        if self.flags.metrics_sample:
+            self.flags.metrics_sample.rows_written(table, inserted, updated, deleted)
+
+    def set_projection_tables(self):
+        """Fill the projection tables from the stored inputs without saving them"""
+        for table, rows in projection_tables(self).items():
+            self.sync_table(table, rows)
+
+    def clear_projection_tables(self):
+        for table in PROJECTION_TABLES:
+            if self.get(table):
+                self.sync_table(table, [])
+
+    def set_capital_growth_table(self, result, international=False):
+        """Populate the capital growth child table"""
+        table = TABLES[international][0]
+
+        if not self.get(INPUT_FIELDS[international]['gross_development_value']):
+            self.sync_table(table, [])
+            frappe.msgprint("Please enter an Gross Development value to see capital growth projections")
+            return
+        if not result.capital_growth:
+            self.sync_table(table, [])
+            frappe.msgprint("Please enter a valid positive Gross Development value")
+            return
+
+        self.sync_table(table, capital_growth_rows(result))
+
+    def set_capital_gain_table(self, result, international=False):
+        """Populate the capital gain child table"""
+        table = TABLES[international][1]
+
+        if not self.get(INPUT_FIELDS[international]['gross_development_value']):
+            self.sync_table(table, [])
+            frappe.msgprint("Please enter an gross development value to see capital gain projections")
+            return
+
+        self.sync_table(table, capital_gain_rows(result))
+
+    def set_returns_table(self, result, international=False):
+        """Populate the returns child table"""
+        table = TABLES[international][2]
+
+        if not self.get(INPUT_FIELDS[international]['gross_development_value']):
+            self.sync_table(table, [])
+            frappe.msgprint("Please complete all calculations first")
+            return
+
+        self.sync_table(table, returns_rows(result, international))
+
     @frappe.whitelist()
     def calculate_sdlt(self):
         """Calculate SDLT based on property type and purchase price"""
-        if not self.sdlt or not self.purchase_price:
-            self.sdlt_amount = 0
-            return
-            
-        purchase_price = self.clean_currency(self.purchase_price)
-        
-        if self.sdlt == "Resi":
-            self.sdlt_amount = self.calculate_residential_sdlt(purchase_price)
-        elif self.sdlt in ["Non-Resi", "Mixed-Use", "Land"]:
-            self.sdlt_amount = self.calculate_non_residential_sdlt(purchase_price)
-        else:  # Exempt or Chain-Break
-            self.sdlt_amount = 0
-    
+        self.sdlt_amount = kernel.sdlt_uk(self.sdlt, self.clean_currency(self.purchase_price))
+
     def calculate_residential_sdlt(self, price):
         """Calculate residential SDLT"""
-        if price <= 40000:
-            return 0
-        elif 40001 <= price <= 125000:
-            return price * 0.05
-        elif 125001 <= price <= 250000:
-            return (price - 125000) * 0.07 + 6250
-        elif 250001 <= price <= 925000:
-            return (price - 250000) * 0.10 + 6250 + 8750
-        elif 925001 <= price <= 1500000:
-            return (price - 925000) * 0.15 + 6250 + 8750 + 67500
-        else:  # Above 1.5M
-            return (price - 1500000) * 0.17 + 6250 + 8750 + 67500 + 86250
-    
+        return sdlt.sdlt(sdlt.RESIDENTIAL, price)
+
     def calculate_non_residential_sdlt(self, price):
         """Calculate non-residential SDLT"""
-        if price <= 150000:
-            return 0
-        elif 150001 <= price <= 250000:
-            return price * 0.02
-        else:  # Above 250k
-            return (price - 250000) * 0.05 + 2000
-    
+        return sdlt.sdlt(sdlt.NON_RESIDENTIAL, price)
+
     @frappe.whitelist()
     def run_calculations(self):
         """Method called by the calculate button"""
         self._is_calculating = True
-        self.copy_details_to_uk_investor()
-        self.copy_details_to_int_investor()
+        with sample_calculation(self, "run_calculations") as sample:
+            self.calculate()
 
-        self.calculate_sdlt()
-        self.calculate_acquisition_costs()
-        self.calculate_post_works_refinance()
-        self.calculate_rental_income()
-        self.calculate_capital_growth()
-        self.calculate_capital_gain()
-        self.calculate_returns()
+            doc_dict = self.as_dict()
+            if sample:
+                sample.payload_bytes = payload_size(doc_dict)
+        return doc_dict
 
-        self.calculate_sdlt_amount()
-        self.calculate_lending_and_brokerage_fees()
-        self.calculate_acquisition_costs_int()
-        self.calculate_post_works_refinance_int()
-        self.calculate_rental_income_int()
-        self.calculate_capital_growth_int()
-        self.calculate_capital_gain_int()
-        self.calculate_returns_int()
+    @frappe.whitelist()
+    def get_sensitivity_grid(self, axes):
+        """Net cash flow, capital left in and ROI over a grid of up to three varied inputs.
 
-        self.calculate_project_management()
-        self.calculate_main_average_ratewk()
+        axes is a list of {"field", "values"} or {"field", "start", "stop",
+        "steps"}; field is a deal input such as purchase_price,
+        rentm_rm_rate_reverse_calc, mortgage_percent or growth_rate.
+        """
+        try:
+            axes = [sensitivity.make_axis(spec) for spec in frappe.parse_json(axes)]
+        except (TypeError, ValueError) as e:
+            frappe.throw(str(e))
 
-        doc_dict = self.as_dict()
-        return doc_dict
+        # Work on a copy so the grid reflects the details tab without touching the form
+        doc = frappe._dict(self.as_dict())
+        prepare_deal(doc)
+
+        grid = {"axes": [{"field": name, "values": values.tolist()} for name, values in axes]}
+        for international, key in ((False, "uk"), (True, "international")):
+            inputs = kernel.DealInputs.from_fields(doc, INPUT_FIELDS[international])
+            try:
+                grid_metrics = sensitivity.sensitivity_grid(inputs, axes, international)
+            except ValueError as e:
+                frappe.throw(str(e))
+            grid[key] = {metric: values.tolist() for metric, values in grid_metrics.items()}
+        return grid
+
+    @frappe.whitelist()
+    def run_simulation(self, paths=10000, seed=None, assumptions=None):
+        """P5/P50/P95 of capital gain and lifetime profit under stochastic growth, rent, voids and rates.
+
+        assumptions overrides any of the SimulationAssumptions defaults.
+        """
+        try:
+            assumptions = simulation.SimulationAssumptions(**(frappe.parse_json(assumptions) or {}))
+        except TypeError as e:
+            frappe.throw(str(e))
+
+        doc = frappe._dict(self.as_dict())
+        prepare_deal(doc)
+
+        bands = {}
+        for international, key in ((False, "uk"), (True, "international")):
+            inputs = kernel.DealInputs.from_fields(doc, INPUT_FIELDS[international])
+            try:
+                bands[key] = simulation.simulate(
+                    inputs, international, paths=cint(paths), assumptions=assumptions,
+                    seed=cint(seed) if seed not in (None, "") else None,
+                )
+            except ValueError as e:
+                frappe.throw(str(e))
+        return bands
+
+    @frappe.whitelist()
+    def goal_seek(self, variable, metric, target, international=0):
+        """Highest purchase_price or lowest rentm_rm_rate_reverse_calc that meets a target.
+
+        metric is annualised_roi (Nett Yield on the international tab),
+        lifetime_roi, capital_left_in or net_cash_flow_pa.
+        """
+        doc = frappe._dict(self.as_dict())
+        prepare_deal(doc)
+
+        international = bool(cint(international))
+        inputs = kernel.DealInputs.from_fields(doc, INPUT_FIELDS[international])
+        try:
+            return solver.goal_seek(inputs, variable, metric, flt(target), international)
+        except ValueError as e:
+            frappe.throw(str(e))
+
+    def recalculate(self, changes=None, full=False):
+        """Apply edited field values, rerun the dirty steps and return only the results that changed"""
+        changes = {
+            fieldname: value for fieldname, value in (changes or {}).items()
+            if fieldname in CALCULATION_GRAPH.fields
+        }
+        with sample_calculation(self, "recalculate") as sample:
+            delta = self._recalculate(changes, full)
+            if sample:
+                sample.payload_bytes = payload_size(delta)
+        return delta
+
+    def _recalculate(self, changes, full):
+        for fieldname, value in changes.items():
+            self.set(fieldname, value)
+        before = self.get_calculated_values()
+
+        changed_fields = set(changes)
+        if 'main_average_ratewk' in changed_fields:
+            # Typing a weekly rate drives the monthly rent the other way round
+            self.calculate_rent()
+            changed_fields |= {'main_rentm_rm_rate_reverse_calc', 'main_lease_setup'}
+        elif 'main_rentm_rm_rate_reverse_calc' in changed_fields:
+            self.main_lease_setup = self.main_rentm_rm_rate_reverse_calc
+            changed_fields.add('main_lease_setup')
+
+        plan = self.calculate(None if full else changed_fields)
+        rebuilt_tables = {fieldname for node in plan for fieldname in node.outputs if fieldname in TABLE_COLUMNS}
+
+        return {
+            fieldname: value for fieldname, value in self.get_calculated_values().items()
+            if value != before[fieldname] or fieldname in rebuilt_tables
+        }
+
+    def get_calculated_values(self):
+        """Every calculation field, with child tables as lists of plain row values"""
+        values = {}
+        for fieldname in CALCULATION_GRAPH.fields:
+            value = self.get(fieldname)
+            if fieldname in TABLE_COLUMNS:
+                value = [{column: row.get(column) for column in TABLE_COLUMNS[fieldname]} for row in value or []]
+            values[fieldname] = value
+        return values
+
+    def calculate_acquisition_costs(self):
+        """Calculate all acquisition cost related fields"""
+        self.run_investor_stage(kernel.acquisition_costs, ('capital_in',))
 
     def calculate_post_works_refinance(self):
         """Calculate post works refinance section"""
-        # Gross Development Value comes from Asking Price
-        # self.gross_development_value = self.clean_currency(self.asking_price or 0)
-        gdv = self.clean_currency(self.gross_development_value or 0)
-        
-        # Uplift is difference between Asking Price and Purchase Price
-        self.uplift = gdv - self.clean_currency(self.purchase_price or 0)
-        
-        # 1st Charge Lending (75% of Gross Development Value)
-        # self.first_charge_lending = self.gross_development_value * 0.75
-        self.first_charge_lending = float(self.gross_development_value) * (float(self.first_charge_lending_ltv) / 100)
-
-        # self.first_charge_lending_ltv = 75
-        
-        # Calculate total investment (same as capital_in)
-        total_investment = self.clean_currency(self.purchase_price or 0) + \
-                          self.clean_currency(self.renovation or 0) + \
-                          self.clean_currency(self.architectplanning or 0) + \
-                          self.clean_currency(self.building_control or 0) + \
-                          self.clean_currency(self.furniture or 0) + \
-                          self.clean_currency(self.sdlt_amount or 0) + \
-                          self.clean_currency(self.survey or 0) + \
-                          self.clean_currency(self.legals or 0) + \
-                          self.clean_currency(self.insurance or 0) + \
-                          self.clean_currency(self.sourcing or 0)
-        
-        # Capital Left In is total investment minus capital released
-        self.capital_left_in = total_investment - self.first_charge_lending
-        
-        # Capital Released equals 1st Charge Lending
-        self.capital_released = self.first_charge_lending
-        
+        self.run_investor_stage(kernel.post_works_refinance, POST_WORKS_REFINANCE_RESULTS)
+
     @frappe.whitelist()
     def calculate_rental_income(self):
         """Calculate all rental income related fields"""
-        try:
-            # Convert input fields to proper numeric values
-            rooms = float(self.rooms) if self.rooms else 0
-            rent_per_month = self.clean_currency(self.rentm_rm_rate_reverse_calc or 0)
-            
-            # Calculate weekly rent per room (monthly × 12 ÷ 52 ÷ rooms)
-            # self.average_ratewk = round((rent_per_month * 12) / 52 / rooms if rooms else 0,2)
-
-            average_ratefield = (rent_per_month * 12) / 52 / rooms if rooms else 0
-            
-            # Calculate annual gross rent (rooms × weekly rate × 52 weeks)
-            self.gross_rent_pa = rooms * average_ratefield * 52
-            
-            # Calculate mortgage payments (6% of first_charge_lending)
-            mortgage_rate = float(self.mortgage_percent) / 100
-            self.mortgage_pa = self.clean_currency(self.first_charge_lending or 0) * mortgage_rate
-            
-            # Operational expenses (0% of gross rent)
-            self.operational_expenses_pa = float(self.gross_rent_pa) * (float(self.operational_expenses_percent) / 100)
-            
-            # Management fees (0% of gross rent)
-            self.management_pa = float(self.gross_rent_pa) * (float(self.management_percent) / 100)
-
-            # Calculate net cash flow - no rounding
-            net_cash_flow = (
-                self.gross_rent_pa - 
-                self.mortgage_pa - 
-                self.operational_expenses_pa - 
-                self.management_pa
-            )
-            self.net_cash_flow_pa = float(f"{round(net_cash_flow):.0f}")
-            
-        except Exception as e:
-            frappe.log_error(f"Error in rental income calculation: {str(e)}")
-            # Set defaults if calculation fails
-            self.average_ratewk = 0.00
-            self.gross_rent_pa = 0.00
-            self.mortgage_pa = 0.00
-            self.operational_expenses_pa = 0.00
-            self.management_pa = 0.00
-            self.net_cash_flow_pa = 0.00
+        self.run_investor_stage(kernel.rental_income, RENTAL_INCOME_RESULTS)
 
     def calculate_capital_growth(self):
-        """Calculate capital growth with static 3.5% growth rate and populate child table"""
-        try:
-            # Clear existing table
-            self.capital_growth_table = []
-            
-            if not self.gross_development_value:
-                frappe.msgprint("Please enter an Gross Development value to see capital growth projections")
-                return
-            
-            current_value = self.clean_currency(self.gross_development_value)
-            if current_value <= 0:
-                frappe.msgprint("Please enter a valid positive Gross Development value")
-                return
-            
-            growth_rate = 0.035  # Static 3.5% growth rate
-            
-            # Populate child table with growth data
-            for year in range(0, 11):
-                increase = current_value * growth_rate
-                display_value = round(current_value)
-                current_value += increase
-                # display_value = current_value
-                display_increase = round(increase) if year < 10 else None
-                # if year == 0:
-                #     increase = 0
-                #     display_value = current_value
-                #     display_increase = 0
-                # else:
-                #     increase = current_value * growth_rate
-                #     current_value += increase
-                #     display_value = current_value
-                #     display_increase = increase
-                
-                self.append("capital_growth_table", {
-                    "year": year,
-                    "value": "{:,.0f}".format(display_value),
-                    "growth_rate": growth_rate * 100 if year < 10 else 0,
-                    "increase": "{:,.0f}".format(display_increase) if display_increase is not None else None
-                })
-        
-        except Exception as e:
-            frappe.log_error(f"Error in calculate_capital_growth: {str(e)}")
-            frappe.msgprint(f"Error generating capital growth table: {str(e)}")
+        """Calculate capital growth and populate child table"""
+        self.set_capital_growth_table(self.run_projection_stage())
 
     def calculate_capital_gain(self):
         """Calculate capital gain and populate child table"""
-        try:
-            # Clear existing table
-            self.capital_gain_table = []
-            
-            if not self.gross_development_value:
-                frappe.msgprint("Please enter an gross development value to see capital gain projections")
-                return
-            
-            current_value = self.clean_currency(self.gross_development_value)
-            growth_rate = 0.035  # 3.5% growth rate
-            
-            # Calculate 10-year projection added
-            capital_value_10yr = current_value * (1 + growth_rate)**10
-            mortgage_lending = self.first_charge_lending
-            equity_investment = self.capital_left_in
-            capital_gain = capital_value_10yr - mortgage_lending - equity_investment
-
-            formatted_capital_value_10yr = "{:,.0f}".format(round(capital_value_10yr))
-            formatted_mortgage_lending = "{:,.0f}".format(round(mortgage_lending))
-            formatted_equity_investment = "{:,.0f}".format(round(equity_investment))
-            formatted_capital_gain = "{:,.0f}".format(round(capital_gain))
-            
-            # Populate child table
-            self.append("capital_gain_table", {
-                "description": "Capital Value @ Year 10",
-                "amount": formatted_capital_value_10yr
-            })
-            
-            self.append("capital_gain_table", {
-                "description": "Mortgage Lending",
-                "amount": formatted_mortgage_lending
-            })
-            
-            self.append("capital_gain_table", {
-                "description": "Equity Investment Capital",
-                "amount": formatted_equity_investment
-            })
-            
-            self.append("capital_gain_table", {
-                "description": "Capital Gain @ Year 10",
-                "amount": formatted_capital_gain
-            })
-        
-        except Exception as e:
-            frappe.log_error(f"Error in calculate_capital_gain: {str(e)}")
-            frappe.msgprint(f"Error generating capital gain table: {str(e)}")
+        self.set_capital_gain_table(self.run_projection_stage())
 
     def calculate_returns(self):
         """Calculate investment returns metrics and populate child table"""
-        try:
-            # Clear existing table
-            self.returns_table = []
-            
-            # Ensure we have all required values
-            if None in [self.capital_left_in, self.net_cash_flow_pa, self.first_charge_lending, self.gross_development_value]:
-                frappe.msgprint("Please complete all calculations first")
-                return
-                
-            # Convert to floats for calculation
-            retained_capital = float(self.capital_left_in or 0)
-            annual_cashflow = float(self.net_cash_flow_pa or 0)
-            
-            # Calculate capital gain
-            growth_rate = 0.035  # 3.5% growth
-            current_value = self.clean_currency(self.gross_development_value or 0)
-            capital_value_10yr = current_value * (1 + growth_rate)**10
-            capital_gain = capital_value_10yr - float(self.first_charge_lending or 0) - retained_capital
-            
-            # Calculate returns metrics
-            lifetime_cashflow = annual_cashflow * 10  # 10 years projection
-            total_return = lifetime_cashflow + capital_gain
-            
-            # ROI Calculations
-            # annualized_roi = (annual_cashflow / retained_capital) * 100 if retained_capital else 0
-            # lifetime_roi = (total_return / retained_capital) * 100 if retained_capital else 0
-            annualized_roi = round((annual_cashflow / retained_capital) * 100, 2) if retained_capital else 0
-            lifetime_roi = round((total_return / retained_capital) * 100, 2) if retained_capital else 0
-
-            formatted_retained_capital = "{:,.0f}".format(round(retained_capital))
-            formatted_annual_cashflow = "{:,.0f}".format(round(annual_cashflow))
-            formatted_lifetime_cashflow = "{:,.0f}".format(round(lifetime_cashflow))
-            formatted_capital_gain = "{:,.0f}".format(round(capital_gain))
-            formatted_total_return = "{:,.0f}".format(round(total_return))
-            
-            # Populate child table1
-            self.append("returns_table", {
-                "metric": "Retained Capital",
-                "value": formatted_retained_capital,
-                "percentage": 0
-            })
-            
-            self.append("returns_table", {
-                "metric": "Net Cash Flow PA",
-                "value": formatted_annual_cashflow,
-                "percentage": 0
-            })
-            
-            self.append("returns_table", {
-                "metric": "Total Net Lifetime Cash Flow",
-                "value": formatted_lifetime_cashflow,
-                "percentage": 0
-            })
-            
-            self.append("returns_table", {
-                "metric": "Capital Gain @ Year 10",
-                "value": formatted_capital_gain,
-                "percentage": 0
-            })
-            
-            self.append("returns_table", {
-                "metric": "Total Lifetime Return on Capital",
-                "value": formatted_total_return,
-                "percentage": 0
-            })
-            
-            self.append("returns_table", {
-                "metric": "Annualised ROI",
-                "value": 0,
-                "percentage": annualized_roi
-            })
-            
-            self.append("returns_table", {
-                "metric": "Lifetime Return",
-                "value": 0,
-                "percentage": lifetime_roi
-            })
-        
-        except Exception as e:
-            frappe.log_error(f"Error in calculate_returns: {str(e)}")
-            frappe.msgprint(f"Error calculating returns: {str(e)}")
-
-    # international investor working start vb
-    # @frappe.whitelist()
-    # def run_calculations_int(self):
-    #     """Method called by the calculate button"""
-    #     self._is_calculating = True
-    #     # self.calculate_sdlt_amount()
-    #     self.calculate_sdlt_amount()
-    #     self.calculate_lending_and_brokerage_fees()
-    #     self.calculate_project_management()
-    #     self.calculate_acquisition_costs_int()
-    #     self.calculate_post_works_refinance_int()
-    #     self.calculate_rental_income_int()
-    #     self.calculate_capital_growth_int()
-    #     self.calculate_capital_gain_int()
-    #     self.calculate_returns_int()
-
-    #     doc_dict = self.as_dict()
-    #     return doc_dict
+        self.set_returns_table(self.run_projection_stage())
 
-    def calculate_acquisition_costs_int(self):
-        """Calculate all acquisition cost related fields"""
-        fields_to_sum = [
-            'int_purchase_price',
-            'int_renovation',
-            'int_architectplanning',
-            'int_building_control',
-            'int_furniture',
-            'int_survey',
-            'int_legals',
-            'int_insurance',
-            'int_sourcing',
-            'int_sdlt_amount',
-            'project_management',
-            'lease_setup',
-            'lending_and_brokerage_fees'
-        ]
-        
-        total = 0
-        for field in fields_to_sum:
-            value = getattr(self, field, None)
-            total += self.clean_currency(value)
-        
-        self.int_capital_in = total
+    def calculate_summary(self):
+        """Copy the headline results to the summary columns"""
+        self.set_summary_result(self.run_projection_stage())
 
     @frappe.whitelist()
+    def calculate_cash_flow(self):
+        """Calculate IRR, NPV and equity multiple from the monthly cash flows"""
+        self.set_cash_flow_result(*self.get_investor_state())
+
     def calculate_project_management(self):
-        if self.main_renovation and self.main_project_management_percentage:
-            self.main_project_management = float(self.main_renovation) * (float(self.main_project_management_percentage) / 100)
-            # self.project_management = self.clean_currency(self.int_renovation) * 0.10
+        set_project_management(self)
 
     @frappe.whitelist()
     def calculate_main_average_ratewk(self):
-        if self.main_rooms and self.main_rentm_rm_rate_reverse_calc:
-            rooms = float(self.main_rooms) if self.main_rooms else 0
-            rent_per_month = self.clean_currency(self.main_rentm_rm_rate_reverse_calc or 0)
-            
-            # Calculate weekly rent per room (monthly × 12 ÷ 52 ÷ rooms)formula
-            self.main_average_ratewk = round((rent_per_month * 12) / 52 / rooms if rooms else 0,2)
-            
+        set_main_average_ratewk(self)
 
     @frappe.whitelist()
     def calculate_rent(self):
         if self.main_rooms and self.main_average_ratewk:
-            rooms = float(self.main_rooms) if self.main_rooms else 0
-            avg_rate_week = self.clean_currency(self.main_average_ratewk or 0)
-
-            self.main_rentm_rm_rate_reverse_calc = round((avg_rate_week * rooms * 52) / 12,2)
-            self.main_lease_setup = round((avg_rate_week * rooms * 52) / 12,2)
+            rent = kernel.rent_per_month(float(self.main_rooms), self.clean_currency(self.main_average_ratewk))
 
+            self.main_rentm_rm_rate_reverse_calc = rent
+            self.main_lease_setup = rent
 
     @frappe.whitelist()
     def calculate_all(self):
@@ -523,324 +422,523 @@ class FinancialCalculatorNew(Document):
 
     @frappe.whitelist()
     def calculate_lending_and_brokerage_fees(self):
-        try:
-            if not hasattr(self, 'int_purchase_price') or not self.int_purchase_price:
-                self.lending_and_brokerage_fees = 0
-                return
-            
-            # purchase_price = flt(self.int_purchase_price)
-            price_lending = self.clean_currency(self.int_purchase_price)
-            ltv_ratio = 0.75  # 75% LTV ratio
-            
-            # Calculate loan amount (B21 * G22)
-            loan_amount = price_lending * ltv_ratio
-            
-            # Fixed fees
-            fixed_fees = 600 + 500 + 350 + 1500  # Sum of all fixed components
-            
-            # Percentage-based fees (2% + 1% = 3% total of loan amount)
-            percentage_fees = loan_amount * 0.03
-            
-            # Total lending fees
-            total_fees = fixed_fees + percentage_fees
-
-            self.lending_and_brokerage_fees = float(f"{round(total_fees):.0f}") #round(total_fees, 2)
-
-        except Exception as e:
-            frappe.log_error(f"Failed to calculate lending fees: {str(e)}")
-            self.lending_and_brokerage_fees = 0
+        self.lending_and_brokerage_fees = kernel.lending_and_brokerage_fees(self.clean_currency(self.int_purchase_price))
 
     @frappe.whitelist()
     def calculate_sdlt_amount(self):
         """Calculate SDLT amount based on property type and purchase price"""
-        if not self.int_purchase_price or not self.int_sdlt:
-            self.int_sdlt_amount = 0
-            return
-        
-        price = self.clean_currency(self.int_purchase_price)
-        
-        if self.int_sdlt in ["Exempt", "Chain-Break"]:
-            self.int_sdlt_amount = 0
-        
-        elif self.int_sdlt == "Resi":
-            # Residential property SDLT calculation
-            if price <= 40000:
-                self.int_sdlt_amount = 0
-            elif price <= 125000:
-                self.int_sdlt_amount = price * 0.07
-            elif price <= 250000:
-                self.int_sdlt_amount = 8750 + (price - 125000) * 0.09
-            elif price <= 925000:
-                self.int_sdlt_amount = 8750 + 11250 + (price - 250000) * 0.12
-            elif price <= 1500000:
-                self.int_sdlt_amount = 8750 + 11250 + 81000 + (price - 925000) * 0.17
-            else:
-                self.int_sdlt_amount = 8750 + 11250 + 81000 + 97750 + (price - 1500000) * 0.19
-        
-        else:  # Non-Resi, Mixed-Use, Land
-            if price <= 150000:
-                self.int_sdlt_amount = 0
-            elif price <= 250000:
-                self.int_sdlt_amount = price * 0.02
-            else:
-                self.int_sdlt_amount = 2000 + (price - 250000) * 0.05
-        
-        # Round to 2 decimal places
-        self.int_sdlt_amount = round(self.int_sdlt_amount, 2)
+        self.int_sdlt_amount = kernel.sdlt_int(self.int_sdlt, self.clean_currency(self.int_purchase_price))
+
+    def calculate_acquisition_costs_int(self):
+        """Calculate all acquisition cost related fields"""
+        self.run_investor_stage(kernel.acquisition_costs, ('capital_in',), international=True)
 
     def calculate_post_works_refinance_int(self):
         """Calculate post works refinance section"""
-        # Gross Development Value comes from Asking Price
-        gdv = self.clean_currency(self.int_gross_development_value or 0)
-        # gdv = self.clean_currency(self.int_purchase_price or 0)
-        
-        # Uplift is difference between Asking Price and Purchase Price
-        # self.int_uplift = self.int_gross_development_value - self.clean_currency(self.int_purchase_price or 0)
-        self.int_uplift = gdv - self.clean_currency(self.int_purchase_price or 0)
-        
-        # 1st Charge Lending (75% of Gross Development Value)
-        # self.int_first_charge_lending = self.int_gross_development_value * 0.75
-        self.int_first_charge_lending = float(self.int_gross_development_value) * (float(self.int_first_charge_lending_ltv) / 100)
-
-        # self.int_first_charge_lending_ltv = 75
-        
-        # Calculate total investment (same as capital_in)
-        total_investment = self.clean_currency(self.int_purchase_price or 0) + \
-                          self.clean_currency(self.int_renovation or 0) + \
-                          self.clean_currency(self.int_architectplanning or 0) + \
-                          self.clean_currency(self.int_building_control or 0) + \
-                          self.clean_currency(self.int_furniture or 0) + \
-                          self.clean_currency(self.int_sdlt_amount or 0) + \
-                          self.clean_currency(self.int_survey or 0) + \
-                          self.clean_currency(self.int_legals or 0) + \
-                          self.clean_currency(self.int_insurance or 0) + \
-                          self.clean_currency(self.int_sourcing or 0) + \
-                          self.clean_currency(self.project_management or 0) + \
-                          self.clean_currency(self.lease_setup or 0) + \
-                          self.clean_currency(self.lending_and_brokerage_fees or 0)
-
-        
-        # Capital Left In is total investment minus capital released
-        self.int_capital_left_in = total_investment - self.int_first_charge_lending
-        
-        # Capital Released equals 1st Charge Lending
-        self.int_capital_released = total_investment - self.int_capital_left_in
+        self.run_investor_stage(kernel.post_works_refinance, POST_WORKS_REFINANCE_RESULTS, international=True)
 
     @frappe.whitelist()
     def calculate_rental_income_int(self):
         """Calculate all rental income related fields"""
-        try:
-            rooms = float(self.int_rooms) if self.int_rooms else 0
-            rent_per_month = self.clean_currency(self.int_rentm_rm_rate_reverse_calc or 0)
-            
-            # self.int_average_ratewk = round((rent_per_month * 12) / 52 / rooms if rooms else 0,2)
-
-            average_ratefield = (rent_per_month * 12) / 52 / rooms if rooms else 0
-            
-            self.int_gross_rent_pa = rooms * average_ratefield * 52
-
-            mortgage_rate = float(self.int_mortgage_percent) / 100
-            # self.int_mortgage_pa = self.clean_currency(self.int_first_charge_lending or 0) * mortgage_rate
-            self.int_mortgage_pa = float(f"{round(self.clean_currency(self.int_first_charge_lending or 0) * mortgage_rate):.0f}")
-            
-            self.int_operational_expenses_pa = float(self.int_gross_rent_pa) * (float(self.int_operational_expenses_percent) / 100)
-            
-            self.int_management_pa = float(self.int_gross_rent_pa) * (float(self.int_management_percent) / 100)
-
-            net_cash_flow = (
-                self.int_gross_rent_pa - 
-                self.int_mortgage_pa - 
-                self.int_operational_expenses_pa - 
-                self.int_management_pa
-            )
-            
-            
-            self.int_net_cash_flow_pa = float(f"{round(net_cash_flow):.0f}")
-            
-        except Exception as e:
-            frappe.log_error(f"Error in rental income calculation: {str(e)}")
-            # Set defaults if calculation fails
-            self.int_average_ratewk = 0.00
-            self.int_gross_rent_pa = 0.00
-            self.int_mortgage_pa = 0.00
-            self.int_operational_expenses_pa = 0.00
-            self.int_management_pa = 0.00
-            self.int_net_cash_flow_pa = 0.00
+        self.run_investor_stage(kernel.rental_income, RENTAL_INCOME_RESULTS, international=True)
 
     def calculate_capital_growth_int(self):
-        """Calculate capital growth with static 3.5% growth rate and populate child table"""
-        try:
-            # Clear existing table
-            self.capital_growth_int_table = []
-            
-            if not self.int_gross_development_value:
-                frappe.msgprint("Please enter an Gross development value to see capital growth projections")
-                return
-            
-            current_value = self.clean_currency(self.int_gross_development_value)
-            if current_value <= 0:
-                frappe.msgprint("Please enter a valid positive Gross development value")
-                return
-            
-            growth_rate = 0.035  # Static 3.5% growth rate
-            
-            # Populate child table with growth data
-            for year in range(0, 11):
-                increase = current_value * growth_rate
-                display_value = round(current_value)
-                current_value += increase
-                # display_value = current_value
-                display_increase = round(increase) if year < 10 else None
-                # if year == 0:
-                #     increase = 0
-                #     display_value = current_value
-                #     display_increase = 0
-                # else:
-                #     increase = current_value * growth_rate
-                #     current_value += increase
-                #     display_value = current_value
-                #     display_increase = increase
-                
-                self.append("capital_growth_int_table", {
-                    "year": year,
-                    "value": "{:,.0f}".format(display_value),
-                    "growth_rate": growth_rate * 100 if year < 10 else 0,
-                    "increase": "{:,.0f}".format(display_increase) if display_increase is not None else None
-                })
-        
-        except Exception as e:
-            frappe.log_error(f"Error in calculate_capital_growth: {str(e)}")
-            frappe.msgprint(f"Error generating capital growth table: {str(e)}")
+        """Calculate capital growth and populate child table"""
+        self.set_capital_growth_table(self.run_projection_stage(international=True), international=True)
 
     def calculate_capital_gain_int(self):
         """Calculate capital gain and populate child table"""
-        try:
-            # Clear existing table
-            self.capital_gain_int_table = []
-            
-            if not self.int_gross_development_value:
-                frappe.msgprint("Please enter an gross development value to see capital gain projections")
-                return
-            
-            current_value = self.clean_currency(self.int_gross_development_value)
-            growth_rate = 0.035  # 3.5% growth rate
-            
-            # Calculate 10-year projection
-            capital_value_10yr = current_value * (1 + growth_rate)**10
-            mortgage_lending = self.int_first_charge_lending
-            equity_investment = self.int_capital_left_in
-            capital_gain = capital_value_10yr - mortgage_lending - equity_investment
-
-            formatted_capital_value_10yr = "{:,.0f}".format(round(capital_value_10yr))
-            formatted_mortgage_lending = "{:,.0f}".format(round(mortgage_lending))
-            formatted_equity_investment = "{:,.0f}".format(round(equity_investment))
-            formatted_capital_gain = "{:,.0f}".format(round(capital_gain))
-            
-            # Populate child table
-            self.append("capital_gain_int_table", {
-                "description": "Capital Value @ Year 10",
-                "amount": formatted_capital_value_10yr
-            })
-            
-            self.append("capital_gain_int_table", {
-                "description": "Mortgage Lending",
-                "amount": formatted_mortgage_lending
-            })
-            
-            self.append("capital_gain_int_table", {
-                "description": "Equity Investment Capital",
-                "amount": formatted_equity_investment
-            })
-            
-            self.append("capital_gain_int_table", {
-                "description": "Capital Gain @ Year 10",
-                "amount": formatted_capital_gain
-            })
-        
-        except Exception as e:
-            frappe.log_error(f"Error in calculate_capital_gain: {str(e)}")
-            frappe.msgprint(f"Error generating capital gain table: {str(e)}")
+        self.set_capital_gain_table(self.run_projection_stage(international=True), international=True)
 
     def calculate_returns_int(self):
         """Calculate investment returns metrics and populate child table"""
+        self.set_returns_table(self.run_projection_stage(international=True), international=True)
+
+    def calculate_summary_int(self):
+        """Copy the headline results to the summary columns"""
+        self.set_summary_result(self.run_projection_stage(international=True), international=True)
+
+    def calculate_cash_flow_int(self):
+        """Calculate IRR, NPV and equity multiple from the monthly cash flows"""
+        self.set_cash_flow_result(*self.get_investor_state(international=True), international=True)
+
+
+# Detail tab field -> investor tab field
+UK_DETAIL_FIELDS = {
+    'main_asking_price': 'asking_price',
+    'main_purchase_price': 'purchase_price',
+    'main_renovation': 'renovation',
+    'main_architectplanning': 'architectplanning',
+    'main_building_control': 'building_control',
+    'main_furniture': 'furniture',
+    'main_survey': 'survey',
+    'main_legals': 'legals',
+    'main_insurance': 'insurance',
+    'main_sourcing': 'sourcing',
+    'main_rooms': 'rooms',
+    'main_rentm_rm_rate_reverse_calc': 'rentm_rm_rate_reverse_calc',
+    'main_average_ratewk': 'average_ratewk',
+    'main_gross_development_value': 'gross_development_value',
+    'main_sdlt': 'sdlt'
+}
+
+INT_DETAIL_FIELDS = {
+    'main_asking_price': 'int_asking_price',
+    'main_purchase_price': 'int_purchase_price',
+    'main_renovation': 'int_renovation',
+    'main_architectplanning': 'int_architectplanning',
+    'main_building_control': 'int_building_control',
+    'main_furniture': 'int_furniture',
+    'main_survey': 'int_survey',
+    'main_legals': 'int_legals',
+    'main_insurance': 'int_insurance',
+    'main_sourcing': 'int_sourcing',
+    'main_rooms': 'int_rooms',
+    'main_rentm_rm_rate_reverse_calc': 'int_rentm_rm_rate_reverse_calc',
+    'main_lease_setup': 'lease_setup',
+    'main_project_management_percentage': 'int_project_management_percentage',
+    'main_project_management': 'project_management',
+    'main_average_ratewk': 'int_average_ratewk',
+    'main_gross_development_value': 'int_gross_development_value',
+    'main_sdlt': 'int_sdlt'
+}
+
+# Investor profile of each investor tab, keyed by international
+PROFILES = {False: kernel.UK_PROFILE, True: kernel.INT_PROFILE}
+INPUT_FIELDS = {international: profile.input_fields for international, profile in PROFILES.items()}
+RESULT_FIELDS = {international: profile.result_fields for international, profile in PROFILES.items()}
+TABLES = {
+    False: ("capital_growth_table", "capital_gain_table", "returns_table"),
+    True: ("capital_growth_int_table", "capital_gain_int_table", "returns_int_table"),
+}
+YIELD_LABELS = {False: "Annualised ROI", True: "Nett Yield"}
+
+# CashFlowAssumptions field -> details tab field, shared by both investor tabs
+CASH_FLOW_FIELDS = {
+    'mortgage_type': 'mortgage_type',
+    'term_years': 'mortgage_term_years',
+    'fixed_years': 'fixed_rate_years',
+    'reversion_rate': 'reversion_rate',
+    'rent_escalation': 'rent_escalation_percent',
+    'void_rate': 'void_percent',
+    'discount_rate': 'discount_rate_percent',
+}
+CASH_FLOW_RESULT_FIELDS = {
+    False: {'irr': 'irr', 'npv': 'npv', 'equity_multiple': 'equity_multiple'},
+    True: {'irr': 'int_irr', 'npv': 'int_npv', 'equity_multiple': 'int_equity_multiple'},
+}
+# Kernel result -> numeric, indexed copy for sorting and filtering lists. The
+# result fields themselves are Data fields and the ROIs only exist in the returns table.
+SUMMARY_FIELDS = {
+    international: {
+        name: "summary_{0}{1}".format(prefix, name)
+        for name in ('annualised_roi', 'lifetime_roi', 'capital_gain', 'net_cash_flow_pa', 'capital_in', 'capital_left_in')
+    }
+    for international, prefix in ((False, ""), (True, "int_"))
+}
+
+
+def get_shared_result_cache():
+    """frappe.cache when the shared result tier is enabled in site config"""
+    if frappe.conf.get("financial_calculator_shared_result_cache"):
+        return frappe.cache()
+
+
+# Identical deals (Proposed and Actual copies, duplicates, repeated Calculate
+# clicks) are evaluated once per process, or once per site with the shared tier
+RESULT_CACHE = ResultCache(maxsize=2048, ttl=3600, shared=get_shared_result_cache)
+
+METRICS_SAMPLE_RATE = 0.01
+
+
+def get_lazy_projection_tables():
+    """Whether saves leave out the projection tables, which are then generated when viewed, from site config"""
+    return bool(frappe.conf.get("financial_calculator_lazy_projection_tables"))
+
+
+def get_metrics_sample_rate():
+    """Fraction of calculations timed, from site config; 0 turns sampling off"""
+    rate = frappe.conf.get("financial_calculator_metrics_sample_rate")
+    return METRICS_SAMPLE_RATE if rate is None else flt(rate)
+
+
+# Stage timings of sampled calculations, pooled across processes in frappe.cache
+METRICS = metrics.MetricsRegistry(sample_rate=get_metrics_sample_rate, shared=frappe.cache)
+
+
+@contextmanager
+def sample_calculation(doc, entry):
+    """Sample the calculation run by an entry point into METRICS, yielding the Sample or None.
+
+    A calculation that is already being sampled keeps its sample.
+    """
+    if doc.flags.metrics_sample is not None:
+        yield None
+        return
+    sample = doc.flags.metrics_sample = METRICS.start(entry)
+    try:
+        yield sample
+    finally:
+        doc.flags.metrics_sample = None
+        if sample is not None:
+            METRICS.record(sample)
+
+
+def payload_size(value):
+    """Bytes of a response as it is sent to the browser"""
+    return len(frappe.as_json(value, indent=None).encode())
+
+
+TABLE_COLUMNS = {
+    "capital_growth_table": ("year", "value", "growth_rate", "increase"),
+    "capital_gain_table": ("description", "amount"),
+    "returns_table": ("metric", "value", "percentage"),
+    "capital_growth_int_table": ("year", "value", "growth_rate", "increase"),
+    "capital_gain_int_table": ("description", "amount"),
+    "returns_int_table": ("metric", "value", "percentage"),
+}
+
+# Data columns of the result tables; every other column is numeric
+TEXT_COLUMNS = frozenset(("description", "metric"))
+
+# Child tables holding year by year projections rather than scalar results
+PROJECTION_TABLES = frozenset(TABLE_COLUMNS)
+
+POST_WORKS_REFINANCE_RESULTS = (
+    'uplift',
+    'first_charge_lending',
+    'capital_released',
+    'capital_left_in',
+)
+RENTAL_INCOME_RESULTS = (
+    'gross_rent_pa',
+    'mortgage_pa',
+    'operational_expenses_pa',
+    'management_pa',
+    'net_cash_flow_pa',
+)
+COST_INPUTS = (
+    'purchase_price',
+    'renovation',
+    'architectplanning',
+    'building_control',
+    'furniture',
+    'survey',
+    'legals',
+    'insurance',
+    'sourcing',
+)
+
+
+def _investor_nodes(international):
+    """Calculation nodes for one investor tab"""
+    inputs, results = INPUT_FIELDS[international], RESULT_FIELDS[international]
+    growth_table, gain_table, returns_table = TABLES[international]
+    suffix = "_int" if international else ""
+
+    def fields(field_map, *names):
+        return [field_map[name] for name in names if name in field_map]
+
+    costs = fields(inputs, *COST_INPUTS) + fields(inputs, 'project_management', 'lease_setup') + \
+        fields(results, 'sdlt_amount', 'lending_and_brokerage_fees')
+
+    return [
+        CalculationNode(
+            "calculate_sdlt_amount" if international else "calculate_sdlt",
+            fields(inputs, 'sdlt_type', 'purchase_price'),
+            fields(results, 'sdlt_amount'),
+        ),
+        CalculationNode(
+            "calculate_acquisition_costs" + suffix,
+            costs,
+            fields(results, 'capital_in'),
+        ),
+        CalculationNode(
+            "calculate_post_works_refinance" + suffix,
+            costs + fields(inputs, 'gross_development_value', 'first_charge_lending_ltv'),
+            fields(results, *POST_WORKS_REFINANCE_RESULTS),
+        ),
+        CalculationNode(
+            "calculate_rental_income" + suffix,
+            fields(inputs, 'rooms', 'rent_per_month', 'mortgage_percent',
+                   'operational_expenses_percent', 'management_percent') +
+            fields(results, 'first_charge_lending'),
+            fields(results, *RENTAL_INCOME_RESULTS),
+        ),
+        CalculationNode(
+            "calculate_capital_growth" + suffix,
+            fields(inputs, 'gross_development_value'),
+            [growth_table],
+        ),
+        CalculationNode(
+            "calculate_capital_gain" + suffix,
+            fields(inputs, 'gross_development_value') + fields(results, 'first_charge_lending', 'capital_left_in'),
+            [gain_table],
+        ),
+        CalculationNode(
+            "calculate_returns" + suffix,
+            fields(inputs, 'gross_development_value') +
+            fields(results, 'first_charge_lending', 'capital_left_in', 'net_cash_flow_pa'),
+            [returns_table],
+        ),
+        CalculationNode(
+            "calculate_summary" + suffix,
+            fields(inputs, 'gross_development_value') +
+            fields(results, 'capital_in', 'first_charge_lending', 'capital_left_in', 'net_cash_flow_pa'),
+            list(SUMMARY_FIELDS[international].values()),
+        ),
+        CalculationNode(
+            "calculate_cash_flow" + suffix,
+            list(CASH_FLOW_FIELDS.values()) +
+            fields(inputs, 'gross_development_value', 'mortgage_percent',
+                   'operational_expenses_percent', 'management_percent') +
+            fields(results, 'capital_left_in', 'first_charge_lending', 'gross_rent_pa'),
+            list(CASH_FLOW_RESULT_FIELDS[international].values()),
+        ),
+    ]
+
+
+CALCULATION_GRAPH = CalculationGraph([
+    CalculationNode(
+        "calculate_project_management",
+        ['main_renovation', 'main_project_management_percentage'],
+        ['main_project_management'],
+    ),
+    CalculationNode(
+        "calculate_main_average_ratewk",
+        ['main_rooms', 'main_rentm_rm_rate_reverse_calc'],
+        ['main_average_ratewk'],
+    ),
+    CalculationNode("copy_details_to_uk_investor", mapping=UK_DETAIL_FIELDS),
+    CalculationNode("copy_details_to_int_investor", mapping=INT_DETAIL_FIELDS),
+    CalculationNode(
+        "calculate_lending_and_brokerage_fees",
+        ['int_purchase_price'],
+        ['lending_and_brokerage_fees'],
+    ),
+] + _investor_nodes(False) + _investor_nodes(True))
+
+
+# Scalar fields read by any calculation step, hashed into calculation_fingerprint
+CALCULATION_INPUTS = tuple(sorted({
+    fieldname for node in CALCULATION_GRAPH.nodes for fieldname in node.inputs
+    if fieldname not in TABLE_COLUMNS
+}))
+
+
+def set_project_management(doc):
+    """Project management fee from the renovation budget on the details tab"""
+    if doc.main_renovation and doc.main_project_management_percentage:
+        doc.main_project_management = kernel.project_management(
+            kernel.clean_currency(doc.main_renovation),
+            float(doc.main_project_management_percentage)
+        )
+
+
+def set_main_average_ratewk(doc):
+    """Average weekly room rate from the monthly rent on the details tab"""
+    if doc.main_rooms and doc.main_rentm_rm_rate_reverse_calc:
+        doc.main_average_ratewk = kernel.average_rate_per_week(
+            float(doc.main_rooms),
+            kernel.clean_currency(doc.main_rentm_rm_rate_reverse_calc)
+        )
+
+
+def copy_details(doc, field_map):
+    for detail_field, investor_field in field_map.items():
+        # Only copy if the detail field has value
+        if getattr(doc, detail_field, None) is not None:
+            setattr(doc, investor_field, getattr(doc, detail_field))
+
+
+def prepare_deal(doc):
+    """Derive the details tab figures and copy them to both investor tabs.
+
+    Works on a document or a frappe._dict of its fields.
+    """
+    set_project_management(doc)
+    set_main_average_ratewk(doc)
+    copy_details(doc, UK_DETAIL_FIELDS)
+    copy_details(doc, INT_DETAIL_FIELDS)
+
+
+def calculation_fingerprint(doc):
+    """Stable hash of every field the calculations read"""
+    values = [kernel.CALCULATION_VERSION]
+    for fieldname in CALCULATION_INPUTS:
+        value = doc.get(fieldname)
+        if value is None:
+            value = ""
+        # Numbers hash alike whether they arrive as 6, 6.0 or "6.0" read back from a Data field
         try:
-            # Clear existing table
-            self.returns_int_table = []
-            
-            # Ensure we have all required values
-            if None in [self.int_capital_left_in, self.int_net_cash_flow_pa, self.int_first_charge_lending, self.int_gross_development_value]:
-                frappe.msgprint("Please complete all calculations first")
-                return
-                
-            # Convert to floats for calculation
-            retained_capital = float(self.int_capital_left_in or 0)
-            annual_cashflow = float(self.int_net_cash_flow_pa or 0)
-            
-            # Calculate capital gain
-            growth_rate = 0.035  # 3.5% growth
-            current_value = self.clean_currency(self.int_gross_development_value or 0)
-            capital_value_10yr = current_value * (1 + growth_rate)**10
-            capital_gain = capital_value_10yr - float(self.int_first_charge_lending or 0) - retained_capital
-            
-            # Calculate returns metrics
-            lifetime_cashflow = annual_cashflow * 10  # 10 years projection
-            total_return = lifetime_cashflow + capital_gain
-            
-            # ROI Calculations
-            # annualized_roi = (annual_cashflow / retained_capital) * 100 if retained_capital else 0
-            # lifetime_roi = (total_return / retained_capital) * 100 if retained_capital else 0
-            annualized_roi = round((annual_cashflow / retained_capital) * 100, 2) if retained_capital else 0
-            lifetime_roi = round((total_return / retained_capital) * 100, 2) if retained_capital else 0
-
-            formatted_retained_capital = "{:,.0f}".format(round(retained_capital))
-            formatted_annual_cashflow = "{:,.0f}".format(round(annual_cashflow))
-            formatted_lifetime_cashflow = "{:,.0f}".format(round(lifetime_cashflow))
-            formatted_capital_gain = "{:,.0f}".format(round(capital_gain))
-            formatted_total_return = "{:,.0f}".format(round(total_return))
-            
-            # Populate child table
-            self.append("returns_int_table", {
-                "metric": "Retained Capital",
-                "value": formatted_retained_capital,
-                "percentage": 0
-            })
-            
-            self.append("returns_int_table", {
-                "metric": "Net Cash Flow PA",
-                "value": formatted_annual_cashflow,
-                "percentage": 0
-            })
-            
-            self.append("returns_int_table", {
-                "metric": "Total Net Lifetime Cash Flow",
-                "value": formatted_lifetime_cashflow,
-                "percentage": 0
-            })
-            
-            self.append("returns_int_table", {
-                "metric": "Capital Gain @ Year 10",
-                "value": formatted_capital_gain,
-                "percentage": 0
-            })
-            
-            self.append("returns_int_table", {
-                "metric": "Total Lifetime Return on Capital",
-                "value": formatted_total_return,
-                "percentage": 0
-            })
-            
-            self.append("returns_int_table", {
-                "metric": "Nett Yield",
-                "value": 0,
-                "percentage": annualized_roi
-            })
-            
-            self.append("returns_int_table", {
-                "metric": "Lifetime Return",
-                "value": 0,
-                "percentage": lifetime_roi
-            })
-        
-        except Exception as e:
-            frappe.log_error(f"Error in calculate_returns: {str(e)}")
-            frappe.msgprint(f"Error calculating returns: {str(e)}")
+            value = float(value)
+        except (TypeError, ValueError):
+            pass
+        values.append(value)
+    return hashlib.sha1(json.dumps(values).encode()).hexdigest()
+
+
+def get_cash_flow_assumptions(doc):
+    """Cash flow assumptions from the details tab; blanks take the defaults"""
+    defaults = cashflow.CashFlowAssumptions()
+    discount_rate = doc.get('discount_rate_percent')
+    return cashflow.CashFlowAssumptions(
+        mortgage_type=doc.get('mortgage_type') or defaults.mortgage_type,
+        term_years=cint(doc.get('mortgage_term_years')) or defaults.term_years,
+        fixed_years=cint(doc.get('fixed_rate_years')),
+        # A zero reversion rate is read as blank: keep the mortgage rate
+        reversion_rate=flt(doc.get('reversion_rate')) / 100 or None,
+        rent_escalation=flt(doc.get('rent_escalation_percent')) / 100,
+        void_rate=flt(doc.get('void_percent')) / 100,
+        discount_rate=defaults.discount_rate if discount_rate in (None, "") else flt(discount_rate) / 100,
+    )
+
+
+def cash_flow_values(cash_flow_metrics):
+    """Cash flow metrics as stored: IRR as a percentage, NPV to the pound"""
+    irr, npv, multiple = (cash_flow_metrics[name] for name in cashflow.CASH_FLOW_RESULTS)
+    return {
+        'irr': flt(irr * 100, 2) if irr is not None else None,
+        'npv': flt(npv, 0) if npv is not None else None,
+        'equity_multiple': flt(multiple, 2) if multiple is not None else None,
+    }
+
+
+def capital_growth_rows(result):
+    return [{
+        "year": year,
+        "value": flt(value, 2),
+        "growth_rate": growth_rate * 100,
+        "increase": flt(increase, 2) if increase is not None else None
+    } for year, value, growth_rate, increase in result.capital_growth]
+
+
+def capital_gain_rows(result):
+    horizon = "@ Year {0}".format(result.projection_years)
+    return [{
+        "description": description,
+        "amount": flt(amount, 2)
+    } for description, amount in (
+        ("Capital Value " + horizon, result.capital_value_10yr),
+        ("Mortgage Lending", result.first_charge_lending),
+        ("Equity Investment Capital", result.capital_left_in),
+        ("Capital Gain " + horizon, result.capital_gain),
+    )]
+
+
+def returns_rows(result, international=False):
+    horizon = "@ Year {0}".format(result.projection_years)
+    rows = [{
+        "metric": metric,
+        "value": flt(value, 2),
+        "percentage": 0
+    } for metric, value in (
+        ("Retained Capital", result.capital_left_in),
+        ("Net Cash Flow PA", result.net_cash_flow_pa),
+        ("Total Net Lifetime Cash Flow", result.lifetime_cashflow),
+        ("Capital Gain " + horizon, result.capital_gain),
+        ("Total Lifetime Return on Capital", result.total_return),
+    )]
+    rows.extend({
+        "metric": metric,
+        "value": 0,
+        "percentage": percentage
+    } for metric, percentage in (
+        (YIELD_LABELS[international], result.annualised_roi),
+        ("Lifetime Return", result.lifetime_roi),
+    ))
+    return rows
+
+
+def result_table_rows(doc, result, international=False):
+    """Rows of the three result tables of one investor tab, as a save would write them"""
+    growth_table, gain_table, returns_table = TABLES[international]
+    if not doc.get(INPUT_FIELDS[international]['gross_development_value']):
+        return {growth_table: [], gain_table: [], returns_table: []}
+    return {
+        growth_table: capital_growth_rows(result),
+        gain_table: capital_gain_rows(result),
+        returns_table: returns_rows(result, international),
+    }
+
+
+def projection_tables(doc):
+    """Rows of every projection table generated from a forecast's stored inputs, through the result cache"""
+    inputs = {profile: kernel.DealInputs.from_fields(doc, profile.input_fields) for profile in PROFILES.values()}
+    results = RESULT_CACHE.evaluate_profiles(inputs)
+    tables = {}
+    for international, profile in PROFILES.items():
+        tables.update(result_table_rows(doc, results[profile], international))
+    return tables
+
+
+def cell_changed(row, column, value):
+    """Whether a child row cell differs from a new value as it would be stored"""
+    current = row.get(column)
+    if column in TEXT_COLUMNS:
+        return current != value
+    # Numeric cells come back from the database as decimals and may be blank,
+    # so compare them the way Frappe stores them
+    return flt(current) != flt(value)
+
+
+# Filter and grouping columns of the Portfolio Summary report, each paired
+# with creation for its date range
+PORTFOLIO_INDEXES = (
+    ('forecast_type', 'creation'),
+    ('opportunity', 'creation'),
+    ('project', 'creation'),
+    ('main_sdlt', 'creation'),
+)
+
+
+def on_doctype_update():
+    """Indexes for the Portfolio Summary report"""
+    for fields in PORTFOLIO_INDEXES:
+        frappe.db.add_index("Financial Calculator New", list(fields))
+
+
+@frappe.whitelist()
+def recalculate(values, changes=None, full=0):
+    """Recalculate a forecast from the form's field values and return only what changed.
+
+    values holds the form's scalar fields, changes the fields edited since the
+    last call. Nothing is saved; the response is the delta the form applies.
+    """
+    frappe.has_permission("Financial Calculator New", "read", throw=True)
+
+    values = frappe.parse_json(values) or {}
+    values["doctype"] = "Financial Calculator New"
+
+    doc = frappe.get_doc(values)
+    return doc.recalculate(frappe.parse_json(changes), full=cint(full))
+
+
+@frappe.whitelist()
+def get_projection_tables(values):
+    """Projection table rows of a forecast from the form's field values, for a tab being opened.
+
+    Used when the tables are not stored on save; nothing is saved.
+    """
+    frappe.has_permission("Financial Calculator New", "read", throw=True)
+
+    values = frappe.parse_json(values) or {}
+    values["doctype"] = "Financial Calculator New"
+    return projection_tables(frappe.get_doc(values))
+
+
+@frappe.whitelist()
+def get_calculation_metrics(format="json"):
+    """Stage timings, table row writes and payload sizes of sampled calculations, over every process.
+
+    format is json for the totals as a dict or prometheus for the text
+    exposition format.
+    """
+    frappe.only_for("System Manager")
+    snapshot = METRICS.aggregate()
+    if format != "prometheus":
+        return snapshot
+
+    frappe.response["type"] = "txt"
+    frappe.response["doctype"] = "financial_calculator_metrics"
+    frappe.response["result"] = metrics.prometheus_text(snapshot)
@@ -0,0 +1,114 @@
+"""Cached field lookups on the Opportunity and Project a forecast links to.
+
+The form only needs a few fields of the linked record to build the forecast
+name, so rather than fetching the whole document with its child tables it
+asks for those fields here. Values are cached for the rest of the request in
+frappe.local and for LINK_DETAILS_TTL seconds in frappe.cache(), one hash per
+record with an entry per user so a user is only served what they were
+allowed to read. doc_events on the linked doctypes drop a record's hash when
+it is saved, renamed or deleted.
+"""
+import time
+
+import frappe
+from frappe import _
+
+CACHE_KEY = "financial_calculator_link_details"
+LINK_DETAILS_TTL = 300
+MAX_BATCH = 500
+
+# Linked doctype -> fields that may be looked up
+LINK_FIELDS = {
+    "Opportunity": ("name", "custom_address"),
+    "Project": ("name", "custom_address"),
+}
+
+
+@frappe.whitelist()
+def get_link_details(doctype, name, fields=None):
+    """Requested fields of one linked record, None when it does not exist or cannot be read"""
+    return get_link_details_batch(doctype, [name], fields).get(name)
+
+
+@frappe.whitelist()
+def get_link_details_batch(doctype, names, fields=None):
+    """Requested fields of many linked records keyed by name, for list views.
+
+    Records that do not exist or cannot be read are left out.
+    """
+    available = get_available_fields(doctype)
+    fields = frappe.parse_json(fields) if fields else available
+    unknown = set(fields) - set(LINK_FIELDS[doctype])
+    if unknown:
+        frappe.throw(_("Cannot look up {0} of {1}").format(", ".join(sorted(unknown)), doctype))
+    names = [name for name in dict.fromkeys(frappe.parse_json(names) or []) if name]
+    if len(names) > MAX_BATCH:
+        frappe.throw(_("At most {0} records can be looked up at once").format(MAX_BATCH))
+
+    details = load_link_details(doctype, names, available)
+    # Fields missing from this site's schema read as None
+    return {name: {field: values.get(field) for field in fields} for name, values in details.items()}
+
+
+def get_available_fields(doctype):
+    """Lookup fields of a linked doctype that exist on this site"""
+    if doctype not in LINK_FIELDS:
+        frappe.throw(_("Cannot look up {0}").format(doctype))
+    meta = frappe.get_meta(doctype)
+    return tuple(field for field in LINK_FIELDS[doctype] if field == "name" or meta.has_field(field))
+
+
+def load_link_details(doctype, names, fields):
+    """Values of every lookup field for names, from the request cache, the shared cache or one query"""
+    local = request_cache()
+    shared = frappe.cache()
+    user = frappe.session.user
+    now = time.time()
+
+    details = {}
+    missing = []
+    for name in names:
+        values = local.get((doctype, name))
+        if values is None:
+            entry = shared.hget(cache_key(doctype, name), user)
+            if entry and entry["expires"] > now:
+                values = local[(doctype, name)] = entry["values"]
+        if values is None:
+            missing.append(name)
+        else:
+            details[name] = values
+
+    if missing:
+        # get_list applies the user's permissions, so unreadable records are not returned or cached
+        for row in frappe.get_list(doctype, filters={"name": ("in", missing)}, fields=list(fields),
+                                   limit_page_length=0):
+            values = details[row.name] = local[(doctype, row.name)] = dict(row)
+            key = cache_key(doctype, row.name)
+            shared.hset(key, user, {"expires": now + LINK_DETAILS_TTL, "values": values})
+            shared.expire(shared.make_key(key), LINK_DETAILS_TTL)
+    return details
+
+
+def request_cache():
+    """Lookups made during the current request"""
+    if getattr(frappe.local, "financial_calculator_link_details", None) is None:
+        frappe.local.financial_calculator_link_details = {}
+    return frappe.local.financial_calculator_link_details
+
+
+def cache_key(doctype, name):
+    return "{0}|{1}|{2}".format(CACHE_KEY, doctype, name)
+
+
+def clear_link_details(doc, method=None, *args):
+    """doc_events handler dropping the cached lookups of a saved, renamed or deleted record.
+
+    after_rename passes the old name, which is dropped as well.
+    """
+    names = {doc.name}
+    if method == "after_rename" and args:
+        names.add(args[0])
+    local = request_cache()
+    for name in names:
+        frappe.cache().delete_value(cache_key(doc.doctype, name))
+        local.pop((doc.doctype, name), None)
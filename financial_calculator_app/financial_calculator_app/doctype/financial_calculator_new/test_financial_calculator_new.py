@@ -1,9 +1,715 @@
 # Copyright (c) 2025, Zikpro and Contributors
 # See license.txt
 
-# import frappe
+import csv
+import os
+import tempfile
+import time
+from unittest.mock import patch
+
+import frappe
 from frappe.tests.utils import FrappeTestCase
 
+import numpy as np
+
+from financial_calculator_app.calculator import (
+	batch,
+	cashflow,
+	currency,
+	growth,
+	kernel,
+	metrics,
+	sdlt,
+	sensitivity,
+	simulation,
+	solver,
+)
+from financial_calculator_app.calculator.cache import ResultCache, result_key
+from financial_calculator_app.financial_calculator_app.doctype.financial_calculator_new.bulk_import import (
+	get_import_file,
+	map_columns,
+	parse_chunk,
+	parse_row,
+)
+from financial_calculator_app.financial_calculator_app.doctype.financial_calculator_new.bulk_recalculate import (
+	evaluate_chunk,
+	table_changed,
+)
+from financial_calculator_app.financial_calculator_app.doctype.financial_calculator_new.columnar_export import (
+	FORECAST_COLUMNS,
+	CSVWriter,
+	forecast_columns,
+)
+from financial_calculator_app.financial_calculator_app.doctype.financial_calculator_new import link_details
+from financial_calculator_app.financial_calculator_app.doctype.financial_calculator_new.link_details import (
+	get_link_details,
+	get_link_details_batch,
+)
+from financial_calculator_app.financial_calculator_app.doctype.financial_calculator_new.financial_calculator_new import (
+	CALCULATION_GRAPH,
+	METRICS,
+	TABLE_COLUMNS,
+	TEXT_COLUMNS,
+	projection_tables,
+)
+from financial_calculator_app.financial_calculator_app.report.portfolio_summary import portfolio_summary
+from financial_calculator_app.financial_calculator_app.report.portfolio_summary.portfolio_summary import (
+	get_aggregates,
+	get_conditions,
+)
+
+
+def make_deal_inputs(**overrides):
+	values = dict(
+		purchase_price=200000,
+		renovation=20000,
+		architectplanning=700,
+		building_control=700,
+		furniture=3000,
+		survey=600,
+		legals=2500,
+		insurance=550,
+		gross_development_value=260000,
+		rooms=5,
+		rent_per_month=3000,
+		first_charge_lending_ltv=75,
+		mortgage_percent=6,
+		sdlt_type="Resi",
+	)
+	values.update(overrides)
+	return kernel.DealInputs(**values)
+
 
 class TestFinancialCalculatorNew(FrappeTestCase):
-	pass
+	def test_evaluate_uk(self):
+		result = kernel.evaluate_uk(make_deal_inputs())
+
+		self.assertEqual(result.sdlt_amount, 11500)
+		self.assertEqual(result.capital_in, 239550)
+		self.assertEqual(result.first_charge_lending, 195000)
+		self.assertEqual(result.capital_left_in, 44550)
+		self.assertEqual(result.net_cash_flow_pa, 24300)
+		self.assertEqual(len(result.capital_growth), 11)
+		self.assertEqual(round(result.capital_gain), 127206)
+		self.assertEqual(result.annualised_roi, 54.55)
+		self.assertEqual(result.lifetime_roi, 830.99)
+
+	def test_evaluate_int(self):
+		result = kernel.evaluate_int(make_deal_inputs(mortgage_percent=7.5))
+
+		self.assertEqual(result.sdlt_amount, 15500)
+		self.assertEqual(result.lending_and_brokerage_fees, 7450)
+		self.assertEqual(result.capital_in, 251000)
+		self.assertEqual(result.capital_left_in, 56000)
+		self.assertEqual(result.mortgage_pa, 14625)
+		self.assertEqual(result.net_cash_flow_pa, 21375)
+		self.assertEqual(result.annualised_roi, 38.17)
+
+	def test_investor_profiles(self):
+		# A company buyer: UK fields, non-resident residential SDLT and the lending fees
+		company = kernel.InvestorProfile(
+			"company",
+			kernel.UK_INPUT_FIELDS,
+			kernel.UK_RESULT_FIELDS,
+			{"Resi": sdlt.RESIDENTIAL_NON_RESIDENT},
+			lending_fees=True,
+		)
+		inputs = make_deal_inputs()
+		profiles = (kernel.UK_PROFILE, kernel.INT_PROFILE, company)
+		results = kernel.evaluate_profiles({profile: inputs for profile in profiles})
+
+		for profile in profiles:
+			self.assertEqual(results[profile].as_dict(), kernel.evaluate(inputs, profile).as_dict())
+		self.assertEqual(results[company].sdlt_amount, 15500)
+		self.assertEqual(results[company].capital_in, 239550 - 11500 + 15500 + 7450)
+		# Growth rows are built once for every profile
+		self.assertIs(results[company].capital_growth, results[kernel.UK_PROFILE].capital_growth)
+
+		self.assertIs(kernel.get_profile(True), kernel.INT_PROFILE)
+		self.assertIs(kernel.get_profile("uk"), kernel.UK_PROFILE)
+		self.assertRaises(ValueError, kernel.get_profile, "unknown")
+
+		columns = {name: [value] for name, value in inputs.as_dict().items()}
+		self.assertEqual(batch.evaluate_batch(columns, company)["capital_in"][0], results[company].capital_in)
+
+	def test_sdlt_schedules(self):
+		cases = (
+			(sdlt.RESIDENTIAL, 40000, 0),
+			(sdlt.RESIDENTIAL, 125000, 6250),
+			(sdlt.RESIDENTIAL, 300000, 20000),
+			(sdlt.RESIDENTIAL, 2000000, 253750),
+			(sdlt.RESIDENTIAL_NON_RESIDENT, 300000, 26000),
+			(sdlt.NON_RESIDENTIAL, 150000, 0),
+			(sdlt.NON_RESIDENTIAL, 200000, 4000),
+			(sdlt.NON_RESIDENTIAL, 300000, 4500),
+		)
+		for kind, price, expected in cases:
+			self.assertAlmostEqual(sdlt.sdlt(kind, price), expected, places=6)
+
+		prices = np.array([price for _, price, _ in cases], dtype=float)
+		for kind in sdlt.SCHEDULES:
+			amounts = sdlt.sdlt(kind, prices)
+			for price, amount in zip(prices, amounts):
+				self.assertEqual(amount, sdlt.sdlt(kind, price))
+
+	def test_growth_projection(self):
+		projection = growth.get_projection()
+		self.assertIs(projection, growth.get_projection(0.035, 10))
+		self.assertFalse(projection.factors.flags.writeable)
+		self.assertEqual(projection.factor, 1.035**10)
+
+		curve = growth.get_projection([0.02, 0.03, 0.04], 3)
+		self.assertAlmostEqual(curve.value_at(100000), 100000 * 1.02 * 1.03 * 1.04)
+		self.assertEqual(curve.values([100000, 200000]).shape, (2, 4))
+
+		result = kernel.evaluate_uk(make_deal_inputs(), growth.get_projection(0.05, 25))
+		self.assertEqual(len(result.capital_growth), 26)
+		self.assertEqual(result.lifetime_cashflow, result.net_cash_flow_pa * 25)
+
+		with self.assertRaises(ValueError):
+			growth.get_projection(0.035, 41)
+
+	def test_calculation_plan(self):
+		def plan(*changed):
+			return [node.name for node in CALCULATION_GRAPH.plan(set(changed))]
+
+		self.assertEqual(len(plan()), 0)
+		self.assertEqual(len(CALCULATION_GRAPH.plan(None)), len(CALCULATION_GRAPH.nodes))
+		self.assertEqual(plan("mortgage_percent"), [
+			"calculate_rental_income", "calculate_returns", "calculate_summary", "calculate_cash_flow"])
+
+		rooms_plan = plan("main_rooms")
+		self.assertIn("calculate_rental_income_int", rooms_plan)
+		self.assertNotIn("calculate_sdlt", rooms_plan)
+		self.assertLess(rooms_plan.index("calculate_main_average_ratewk"), rooms_plan.index("copy_details_to_uk_investor"))
+
+		# A directly edited result is recomputed along with everything downstream
+		sdlt_plan = plan("sdlt_amount")
+		self.assertEqual(sdlt_plan[0], "calculate_sdlt")
+		self.assertIn("calculate_returns", sdlt_plan)
+
+	def test_recalculate_returns_delta(self):
+		doc = frappe.get_doc(dict(
+			doctype="Financial Calculator New",
+			main_purchase_price="200000",
+			main_renovation="20000",
+			main_gross_development_value="260000",
+			main_rooms=5,
+			main_rentm_rm_rate_reverse_calc="3000",
+			main_sdlt="Resi",
+			first_charge_lending_ltv=75,
+			mortgage_percent=6,
+		))
+		doc.recalculate(full=True)
+
+		delta = doc.recalculate({"mortgage_percent": 5})
+		self.assertEqual(set(delta), {
+			"mortgage_pa", "net_cash_flow_pa", "returns_table", "irr", "npv", "equity_multiple",
+			"summary_net_cash_flow_pa", "summary_annualised_roi", "summary_lifetime_roi",
+		})
+		self.assertEqual(delta["mortgage_pa"], 9750)
+		self.assertEqual(delta["summary_net_cash_flow_pa"], kernel.stored_number(doc.net_cash_flow_pa))
+
+		# Fields outside the calculation are ignored
+		self.assertEqual(doc.recalculate({"forecast_name": "Test"}), {})
+
+	def test_calculation_metrics(self):
+		doc = frappe.get_doc(dict(
+			doctype="Financial Calculator New",
+			main_purchase_price="200000",
+			main_gross_development_value="260000",
+			main_rooms=5,
+			main_rentm_rm_rate_reverse_calc="3000",
+			main_sdlt="Resi",
+			first_charge_lending_ltv=75,
+			mortgage_percent=6,
+		))
+		sample_rate = METRICS.sample_rate
+		METRICS.sample_rate = 1
+		METRICS.reset()
+		try:
+			doc.run_calculations()
+			doc.recalculate({"mortgage_percent": 5})
+		finally:
+			METRICS.sample_rate = sample_rate
+		snapshot = METRICS.snapshot()
+
+		histograms, counters = snapshot["histograms"], snapshot["counters"]
+		self.assertEqual(histograms['financial_calculator_stage_seconds{stage="calculate_cash_flow_int"}']["count"], 1)
+		self.assertEqual(histograms['financial_calculator_stage_seconds{stage="calculate_returns"}']["count"], 1)
+		self.assertGreater(histograms['financial_calculator_payload_bytes{entry="run_calculations"}']["sum"], 1000)
+		self.assertEqual(
+			counters['financial_calculator_table_rows_total{operation="inserted",table="capital_growth_table"}'], 11)
+		self.assertGreater(counters['financial_calculator_table_rows_total{operation="updated",table="returns_table"}'], 0)
+
+		# Entries of processes that stopped publishing are pruned rather than summed
+		namespace = "financial_calculator_metrics_test"
+		frappe.cache().delete_key(namespace)
+		frappe.cache().hset(namespace, "exited:1", dict(snapshot, published=time.time() - 7200))
+		frappe.cache().hset(namespace, "running:2", dict(snapshot, published=time.time()))
+		registry = metrics.MetricsRegistry(shared=frappe.cache, namespace=namespace)
+		self.assertEqual(registry.aggregate()["counters"], snapshot["counters"])
+		self.assertEqual(len(frappe.cache().hgetall(namespace)), 1)
+		frappe.cache().delete_key(namespace)
+
+		text = metrics.prometheus_text(metrics.merge([snapshot, snapshot]))
+		self.assertIn("# TYPE financial_calculator_stage_seconds histogram", text)
+		self.assertIn('financial_calculator_calculations_sampled_total{entry="recalculate"} 2', text)
+		self.assertIn('financial_calculator_calculation_seconds_bucket{entry="run_calculations",le="+Inf"} 2', text)
+
+	def test_tables_reconciled_in_place(self):
+		doc = frappe.get_doc(dict(
+			doctype="Financial Calculator New",
+			main_purchase_price="200000",
+			main_gross_development_value="260000",
+			main_rooms=5,
+			main_rentm_rm_rate_reverse_calc="3000",
+			first_charge_lending_ltv=75,
+			mortgage_percent=6,
+		))
+		doc.calculate()
+		rows = list(doc.returns_table)
+		net_cash_flow = rows[1].value
+
+		doc.recalculate({"mortgage_percent": 5})
+		self.assertEqual([id(row) for row in doc.returns_table], [id(row) for row in rows])
+		self.assertNotEqual(doc.returns_table[1].value, net_cash_flow)
+
+		doc.recalculate({"main_gross_development_value": ""})
+		self.assertEqual(doc.returns_table, [])
+
+	def test_lazy_projection_tables(self):
+		values = dict(
+			doctype="Financial Calculator New",
+			main_purchase_price="200000",
+			main_gross_development_value="260000",
+			main_rooms=5,
+			main_rentm_rm_rate_reverse_calc="3000",
+			first_charge_lending_ltv=75,
+			mortgage_percent=6,
+		)
+		stored = frappe.get_doc(values)
+		stored.calculate()
+
+		frappe.conf.financial_calculator_lazy_projection_tables = 1
+		try:
+			doc = frappe.get_doc(values)
+			doc.calculate()
+			self.assertEqual(doc.net_cash_flow_pa, stored.net_cash_flow_pa)
+			self.assertFalse(doc.get("returns_table"))
+			self.assertEqual(doc.recalculate({"mortgage_percent": 5}).get("returns_table"), None)
+
+			# Rows sent back by the form are not saved
+			doc.recalculate({"mortgage_percent": 6})
+			doc.append("returns_table", {"metric": "Retained Capital"})
+			doc.validate()
+			self.assertEqual(doc.returns_table, [])
+
+			tables = projection_tables(doc)
+			doc.before_print()
+		finally:
+			del frappe.conf["financial_calculator_lazy_projection_tables"]
+
+		for table in TABLE_COLUMNS:
+			self.assertEqual(tables[table], [
+				{column: row.get(column) for column in TABLE_COLUMNS[table]} for row in stored.get(table)])
+			self.assertEqual(len(doc.get(table)), len(stored.get(table)))
+
+	def test_unchanged_inputs_skip_calculation(self):
+		doc = frappe.get_doc(dict(
+			doctype="Financial Calculator New",
+			main_purchase_price="200000",
+			main_gross_development_value="260000",
+			main_rooms=5,
+			main_rentm_rm_rate_reverse_calc="3000",
+			first_charge_lending_ltv=75,
+			mortgage_percent=6,
+		))
+		doc.validate()
+		fingerprint = doc.calculation_fingerprint
+		self.assertTrue(fingerprint)
+
+		# Metadata-only edits keep the fingerprint and skip the pipeline
+		doc.forecast_name = "Renamed"
+		doc.returns_table = []
+		doc.validate()
+		self.assertEqual(doc.returns_table, [])
+
+		doc.flags.force_calculation = True
+		doc.validate()
+		self.assertEqual(len(doc.returns_table), 7)
+
+		doc.flags.force_calculation = False
+		doc.mortgage_percent = 5
+		doc.validate()
+		self.assertNotEqual(doc.calculation_fingerprint, fingerprint)
+
+	def test_stale_fingerprint_recalculates(self):
+		doc = frappe.get_doc(dict(
+			doctype="Financial Calculator New",
+			main_purchase_price="200000",
+			main_gross_development_value="260000",
+			main_rooms=5,
+			main_rentm_rm_rate_reverse_calc="3000",
+			main_sdlt="Resi",
+			first_charge_lending_ltv=75,
+			mortgage_percent=6,
+		))
+		doc.validate()
+		sdlt_amount, capital_in = doc.sdlt_amount, doc.capital_in
+
+		# Saved under an older calculation version, with no field changed since
+		for stored_fingerprint in ("stale", None):
+			doc.sdlt_amount = 999
+			doc.capital_in = 1
+			doc.calculation_fingerprint = stored_fingerprint
+			doc._doc_before_save = frappe.get_doc(doc.as_dict())
+			doc.validate()
+			self.assertEqual(doc.sdlt_amount, sdlt_amount)
+			self.assertEqual(doc.capital_in, capital_in)
+			self.assertEqual(doc.calculation_fingerprint, doc.get_calculation_fingerprint())
+
+	def test_result_cache(self):
+		cache = ResultCache(maxsize=2)
+		inputs = make_deal_inputs()
+
+		first = cache.evaluate(inputs)
+		self.assertIs(cache.evaluate(make_deal_inputs()), first)
+		self.assertEqual(cache.evaluate(inputs, kernel.INT_PROFILE).sdlt_amount, 15500)
+		self.assertEqual((cache.hits, cache.misses), (1, 2))
+
+		# Least recently used entry goes first
+		cache.evaluate(make_deal_inputs(rooms=6))
+		self.assertEqual(cache.evictions, 1)
+		self.assertEqual(len(cache), 2)
+
+		# A different projection is a different key
+		self.assertNotEqual(result_key(inputs), result_key(inputs, projection=growth.get_projection(years=5)))
+
+		# So is a profile with the same name and different settings
+		edited = kernel.InvestorProfile("uk", kernel.UK_INPUT_FIELDS, kernel.UK_RESULT_FIELDS,
+			kernel.UK_PROFILE.sdlt_schedules, sdlt_default=sdlt.NON_RESIDENTIAL)
+		self.assertNotEqual(result_key(inputs), result_key(inputs, edited))
+		self.assertEqual(result_key(inputs), result_key(inputs, kernel.InvestorProfile("uk", {}, {},
+			kernel.UK_PROFILE.sdlt_schedules)))
+
+		expired = ResultCache(ttl=0)
+		expired.evaluate(inputs)
+		expired.evaluate(inputs)
+		self.assertEqual(expired.misses, 2)
+
+	def test_bulk_recalculation_matches_save(self):
+		values = dict(
+			main_purchase_price="350000",
+			main_renovation="40000",
+			main_gross_development_value="480000",
+			main_rooms="6",
+			main_rentm_rm_rate_reverse_calc="4200",
+			main_sdlt="Resi",
+			main_project_management_percentage=10,
+			first_charge_lending_ltv=75,
+			mortgage_percent=6,
+			int_first_charge_lending_ltv=75,
+			int_mortgage_percent=7.5,
+		)
+		doc = frappe.get_doc(dict(doctype="Financial Calculator New", **values))
+		doc.calculate()
+
+		updates, tables = evaluate_chunk([frappe._dict(name="FC-0001", **values)])
+		self.assertEqual(updates["FC-0001"]["summary_int_annualised_roi"], doc.summary_int_annualised_roi)
+		for fieldname, value in updates["FC-0001"].items():
+			self.assertEqual(value, doc.get(fieldname), fieldname)
+		for table, columns in TABLE_COLUMNS.items():
+			self.assertEqual(
+				tables["FC-0001"][table],
+				[{column: row.get(column) for column in columns} for row in doc.get(table)],
+			)
+
+		# Values read back as stored, numbers in Data fields as text, are not rewritten
+		stored = dict(values, **{
+			fieldname: str(value) if isinstance(value, float) and fieldname in kernel.UK_RESULT_FIELDS.values() else value
+			for fieldname, value in updates["FC-0001"].items()
+		})
+		self.assertEqual(evaluate_chunk([frappe._dict(name="FC-0001", **stored)])[0], {})
+
+		# Stored table rows matching the recalculated ones are left alone
+		for table, columns in TABLE_COLUMNS.items():
+			rows = tables["FC-0001"][table]
+			stored_rows = [frappe._dict(row) for row in rows]
+			self.assertFalse(table_changed(stored_rows, rows, columns))
+			self.assertTrue(table_changed(stored_rows[:-1], rows, columns))
+		column = next(column for column in TABLE_COLUMNS["returns_table"] if column not in TEXT_COLUMNS)
+		stored_rows = [frappe._dict(row) for row in tables["FC-0001"]["returns_table"]]
+		stored_rows[0][column] = (stored_rows[0][column] or 0) + 1
+		self.assertTrue(table_changed(stored_rows, tables["FC-0001"]["returns_table"], TABLE_COLUMNS["returns_table"]))
+
+	def test_bulk_import_rows(self):
+		meta = frappe.get_meta("Financial Calculator New")
+		columns, ignored = map_columns([
+			"Forecast Type", "Purchase Price", "asking_price", "main_gross_development_value", "Rooms",
+			"Rent/m (RM Rate Reverse Calc)", "SDLT", "Renovation", "Mortgage%", "int_mortgage_percent", "Notes",
+		])
+		self.assertEqual(columns[1], "main_purchase_price")
+		self.assertEqual(columns[8], "mortgage_percent")
+		self.assertEqual(ignored, ["Notes"])
+
+		row = ["Proposed", "£200,000", "210000", "260000", "5", "3000", "Resi", "20000", "6%", "7.5", "x"]
+		values, error = parse_row(row, columns, meta)
+		self.assertIsNone(error)
+		self.assertEqual(values["main_purchase_price"], 200000)
+		self.assertEqual(values["mortgage_percent"], 6)
+
+		values, error = parse_row(["Proposed", "n/a"] + row[2:], columns, meta)
+		self.assertIn("Purchase Price", error)
+		values, error = parse_row(row[:3] + [""] + row[4:], columns, meta)
+		self.assertIn("required", error)
+
+		# A chunk parses its amounts a column at a time in the sheet's locale
+		german = row[:1] + ["200.000,50"] + row[2:9] + ["7,5"] + row[10:]
+		parsed = parse_chunk([(2, german), (3, row)], columns, meta, "de_DE")
+		self.assertEqual(parsed[0][1]["main_purchase_price"], 200000.5)
+		self.assertEqual(parsed[0][1]["int_mortgage_percent"], 7.5)
+		# The UK row's 7.5 is not an amount in German notation
+		self.assertIn("is not a number: 7.5", parsed[1][2])
+
+	def test_import_file_permission(self):
+		file = frappe.get_doc(dict(
+			doctype="File", file_name="deals.csv", content="Purchase Price\n200000", is_private=1,
+		)).insert()
+		self.assertEqual(get_import_file(file.file_url).name, file.name)
+
+		# Another user's private sheet cannot be imported or have its rejected rows read
+		frappe.set_user("Guest")
+		try:
+			with self.assertRaises(frappe.PermissionError):
+				get_import_file(file.file_url)
+		finally:
+			frappe.set_user("Administrator")
+
+	def test_currency_parsing(self):
+		self.assertEqual(currency.parse_amount("£1,250,000.50"), 1250000.5)
+		self.assertEqual(currency.parse_amount("(1,250)"), -1250)
+		self.assertEqual(currency.parse_amount("-£1,250"), -1250)
+		self.assertEqual(currency.parse_amount("1.250.000,50", "de_DE"), 1250000.5)
+		self.assertEqual(currency.parse_amount("1.250", "de_DE"), 1250)
+		self.assertEqual(currency.parse_amount("1\u00a0250,50 €", "fr_FR"), 1250.5)
+		self.assertIsNone(currency.parse_amount("£"))
+		with self.assertRaises(ValueError):
+			currency.parse_amount("1.250,00")
+		with self.assertRaises(ValueError):
+			currency.parse_amount("12,34,567")
+
+		# clean_currency infers the separators and keeps the sign
+		self.assertEqual(kernel.clean_currency("1.250.000,00"), 1250000)
+		self.assertEqual(kernel.clean_currency("-1,250.00"), -1250)
+		self.assertEqual(kernel.clean_currency("n/a"), 0)
+		# Amounts that are not well formed fall back to the digits typed
+		self.assertEqual(kernel.clean_currency("1,25,000"), 125000)
+		self.assertEqual(kernel.clean_currency("-12,34,567"), -1234567)
+
+		values = ["£1,250", "(2,500.50)", "1.250,5", None, 3.5, "£1,250", "x"]
+		amounts = currency.parse_amounts(values, currency.AUTO)
+		np.testing.assert_array_equal(amounts, [1250, -2500.5, 1250.5, np.nan, 3.5, 1250, np.nan])
+		for value, amount in zip(values, currency.parse_amounts(values)):
+			try:
+				expected = currency.parse_amount(value, default=np.nan)
+			except ValueError:
+				expected = np.nan
+			np.testing.assert_equal(amount, expected)
+
+	def test_columnar_export_batch(self):
+		rows = [
+			frappe._dict(name="FC-0001", forecast_type="Proposed", capital_left_in="36500.0", npv=1200),
+			frappe._dict(name="FC-0002", forecast_type="Actual", capital_left_in="-1,250", npv=None),
+		]
+		batch = forecast_columns(rows)
+		self.assertEqual(batch["capital_left_in"], [36500.0, -1250.0])
+		self.assertEqual(batch["npv"], [1200.0, None])
+
+		with tempfile.TemporaryDirectory() as directory:
+			path = os.path.join(directory, "forecasts.csv")
+			writer = CSVWriter(path, FORECAST_COLUMNS)
+			writer.write(batch)
+			writer.close()
+			with open(path) as f:
+				written = list(csv.DictReader(f))
+		self.assertEqual([row["name"] for row in written], ["FC-0001", "FC-0002"])
+		self.assertEqual(written[0]["capital_left_in"], "36500.0")
+
+	def test_sensitivity_grid(self):
+		inputs = make_deal_inputs()
+		axes = [
+			sensitivity.make_axis({"field": "purchase_price", "start": 180000, "stop": 220000, "steps": 5}),
+			sensitivity.make_axis({"field": "rentm_rm_rate_reverse_calc", "values": [2800, 3000]}),
+			sensitivity.make_axis({"field": "growth_rate", "values": [2, 3.5]}),
+		]
+		grid = sensitivity.sensitivity_grid(inputs, axes)
+		self.assertEqual(grid["lifetime_roi"].shape, (5, 2, 2))
+
+		# The base deal sits at the centre of the purchase price axis
+		result = kernel.evaluate_uk(inputs)
+		self.assertEqual(grid["net_cash_flow_pa"][2, 1, 1], result.net_cash_flow_pa)
+		self.assertAlmostEqual(grid["lifetime_roi"][2, 1, 1], result.lifetime_roi)
+		self.assertEqual(grid["net_cash_flow_pa"][0, 0, 0], kernel.evaluate_uk(make_deal_inputs(
+			purchase_price=180000, rent_per_month=2800)).net_cash_flow_pa)
+		self.assertLess(grid["lifetime_roi"][2, 1, 0], grid["lifetime_roi"][2, 1, 1])
+
+		with self.assertRaises(ValueError):
+			sensitivity.make_axis({"field": "forecast_name", "values": [1]})
+
+	def test_simulation(self):
+		inputs = make_deal_inputs()
+		summary = simulation.simulate(inputs, paths=20000, seed=1)
+		gain = summary["capital_gain"]
+		self.assertLess(gain["p5"], gain["p50"])
+		self.assertLess(gain["p50"], gain["p95"])
+
+		# Without any randomness every path is the deterministic projection
+		fixed = simulation.SimulationAssumptions(
+			growth_volatility=0, rent_inflation_volatility=0, void_mean=0, mortgage_rate_volatility=0)
+		summary = simulation.simulate(inputs, paths=100, assumptions=fixed, seed=1)
+		result = kernel.evaluate_uk(inputs)
+		self.assertAlmostEqual(summary["capital_gain"]["p50"], result.capital_gain, places=4)
+		self.assertAlmostEqual(summary["lifetime_profit"]["p95"], result.total_return, delta=5)
+
+		# Runs inside the request, so the paths are capped
+		with self.assertRaises(ValueError):
+			simulation.simulate(inputs, paths=simulation.MAX_PATHS + 1)
+
+	def test_quantile_sketch(self):
+		values = np.random.default_rng(0).normal(size=200000)
+		sketch = simulation.QuantileSketch(resolution=501, max_summaries=4)
+		for chunk in np.array_split(values, 40):
+			sketch.add(chunk)
+
+		self.assertLessEqual(len(sketch.summaries), 4)
+		for q in (0.05, 0.5, 0.95):
+			self.assertAlmostEqual(sketch.quantile(q), np.quantile(values, q), delta=0.02)
+
+	def test_goal_seek(self):
+		inputs = make_deal_inputs()
+
+		answer = solver.goal_seek(inputs, "purchase_price", "annualised_roi", 25)
+		self.assertGreaterEqual(answer["achieved"], 25)
+		self.assertLess(kernel.evaluate_uk(make_deal_inputs(purchase_price=answer["value"] + 0.02)).annualised_roi, 25)
+		self.assertLess(answer["evaluations"], 50)
+
+		# Reporting the achieved metric does not count towards the search's budget
+		seek = solver.GoalSeek(inputs, "purchase_price", "annualised_roi", 25)
+		seek.solve()
+		self.assertEqual(answer["evaluations"], seek.evaluations)
+		with patch.object(solver, "MAX_EVALUATIONS", seek.evaluations):
+			self.assertEqual(solver.goal_seek(inputs, "purchase_price", "annualised_roi", 25), answer)
+
+		answer = solver.goal_seek(inputs, "rentm_rm_rate_reverse_calc", "annualised_roi", 30, international=True)
+		self.assertGreaterEqual(answer["achieved"], 30)
+		self.assertLess(kernel.evaluate_int(make_deal_inputs(rent_per_month=answer["value"] - 0.02)).annualised_roi, 30)
+
+		answer = solver.goal_seek(inputs, "purchase_price", "capital_left_in", 50000)
+		self.assertLessEqual(answer["achieved"], 50000)
+
+		# Answers above the top SDLT band widen the search
+		inputs = make_deal_inputs(purchase_price=1390000, gross_development_value=133000, rooms=4,
+			rent_per_month=14451, mortgage_percent=3, sdlt_type="Non-Resi")
+		answer = solver.goal_seek(inputs, "purchase_price", "annualised_roi", 5)
+		self.assertGreater(answer["value"], 3000000)
+		self.assertGreaterEqual(answer["achieved"], 5)
+
+		# A feasible range a few thousand pounds wide is still found when the first guess is off
+		inputs = make_deal_inputs(purchase_price=1543000, gross_development_value=728000, rooms=4,
+			rent_per_month=1598, mortgage_percent=3, sdlt_type="Non-Resi")
+		answer = solver.goal_seek(inputs, "purchase_price", "annualised_roi", 90, international=True)
+		self.assertGreaterEqual(answer["achieved"], 90)
+		self.assertLess(kernel.evaluate_int(make_deal_inputs(**dict(inputs.as_dict(),
+			purchase_price=answer["value"] + 0.02))).annualised_roi, 90)
+
+		with self.assertRaises(ValueError):
+			solver.goal_seek(inputs, "purchase_price", "net_cash_flow_pa", 1000)
+
+	def test_cash_flow(self):
+		inputs = make_deal_inputs()
+		result = kernel.evaluate_uk(inputs)
+
+		# Interest only with flat rent and no voids earns the headline net cash flow every month
+		flows = cashflow.equity_cash_flows(
+			result.capital_left_in, result.gross_rent_pa, 0, result.first_charge_lending, 0.06, 0)
+		self.assertAlmostEqual(flows[0, 1:13].sum(), result.net_cash_flow_pa)
+		self.assertAlmostEqual(flows[0, -1], result.net_cash_flow_pa / 12 - result.first_charge_lending)
+
+		# A repayment mortgage is cleared at the end of its term
+		payments, balance = cashflow.mortgage_schedule(100000, 0.06, 300, True, 25, 2, 0.08)
+		self.assertAlmostEqual(balance[0], 0)
+		self.assertGreater(payments[0, 24], payments[0, 23])
+
+		rates = cashflow.irr(np.array([[-100, 110, 0], [-100, 0, 0], [-100, 50, 60]], dtype=float))
+		self.assertAlmostEqual(rates[0], 1.1 ** 12 - 1)
+		self.assertTrue(np.isnan(rates[1]))
+		monthly = (1 + rates[2]) ** (1 / 12) - 1
+		self.assertAlmostEqual(-100 + 50 / (1 + monthly) + 60 / (1 + monthly) ** 2, 0)
+
+		cash_flow_metrics = cashflow.evaluate(inputs, result)
+		stressed = cashflow.evaluate(inputs, result, cashflow.CashFlowAssumptions(void_rate=0.1))
+		self.assertLess(stressed["irr"], cash_flow_metrics["irr"])
+		self.assertLess(stressed["npv"], cash_flow_metrics["npv"])
+
+	def test_portfolio_summary_query(self):
+		forecast = frappe.qb.DocType("Financial Calculator New")
+		filters = frappe._dict(forecast_type="Actual", sdlt_type="Resi", to_date="2026-01-31")
+		owner = "`tabFinancial Calculator New`.`owner` = 'test@example.com'"
+		with patch.object(portfolio_summary, "build_match_conditions", return_value=owner):
+			conditions = get_conditions(forecast, filters)
+		sql = frappe.qb.from_(forecast).select(*get_aggregates(forecast, "International")).where(conditions).get_sql()
+
+		self.assertIn("'Resi'", sql)
+		self.assertIn("'2026-02-01'", sql)
+		# The user's permission conditions restrict the totals
+		self.assertIn(owner, sql)
+		self.assertIn("summary_int_net_cash_flow_pa", sql)
+
+	def test_link_details(self):
+		if "erpnext" not in frappe.get_installed_apps():
+			self.skipTest("Project is an ERPNext doctype")
+
+		project = frappe.get_doc(dict(doctype="Project", project_name="Forecast Link Test")).insert()
+		details = get_link_details("Project", project.name, ["name"])
+		self.assertEqual(details, {"name": project.name})
+		self.assertIsNone(get_link_details("Project", "No Such Project"))
+		self.assertRaises(frappe.ValidationError, get_link_details, "Project", project.name, ["owner"])
+		self.assertRaises(frappe.ValidationError, get_link_details, "User", "Administrator")
+
+		# Saving the record drops its cached lookups
+		self.assertTrue(frappe.cache().hget(link_details.cache_key("Project", project.name), frappe.session.user))
+		project.save()
+		self.assertIsNone(frappe.cache().hget(link_details.cache_key("Project", project.name), frappe.session.user))
+
+		batch_details = get_link_details_batch("Project", [project.name, "No Such Project"])
+		self.assertEqual(list(batch_details), [project.name])
+
+	def test_inputs_from_fields(self):
+		inputs = kernel.DealInputs.from_fields(
+			{"purchase_price": "£250,000", "rooms": "4", "sdlt": "Land"},
+			kernel.UK_INPUT_FIELDS,
+		)
+
+		self.assertEqual(inputs.purchase_price, 250000)
+		self.assertEqual(inputs.rooms, 4)
+		self.assertEqual(inputs.sdlt_type, "Land")
+		self.assertEqual(inputs.mortgage_percent, 0)
+
+	def test_batch_matches_kernel(self):
+		deals = [
+			make_deal_inputs(),
+			make_deal_inputs(purchase_price=1750000, gross_development_value=2100000, sdlt_type="Non-Resi"),
+			make_deal_inputs(purchase_price=35000, rooms=0, sdlt_type="Exempt", project_management=2000),
+		]
+		columns = {name: [getattr(deal, name) for deal in deals] for name in kernel.DealInputs.__slots__}
+
+		for evaluate, evaluate_batch in (
+			(kernel.evaluate_uk, batch.evaluate_uk_batch),
+			(kernel.evaluate_int, batch.evaluate_int_batch),
+		):
+			results = evaluate_batch(columns)
+			for i, deal in enumerate(deals):
+				expected = evaluate(deal)
+				for name in batch.BATCH_RESULTS:
+					self.assertEqual(results[name][i], getattr(expected, name), name)
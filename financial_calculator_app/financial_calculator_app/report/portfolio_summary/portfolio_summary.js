@@ -0,0 +1,57 @@
+// Copyright (c) 2026, Zikpro and contributors
+// For license information, please see license.txt
+
+frappe.query_reports['Portfolio Summary'] = {
+    filters: [
+        {
+            fieldname: 'group_by',
+            label: __('Group By'),
+            fieldtype: 'Select',
+            options: 'Forecast Type\nOpportunity\nProject\nSDLT Type\nMonth\nYear',
+            default: 'Forecast Type',
+            reqd: 1
+        },
+        {
+            fieldname: 'investor',
+            label: __('Investor'),
+            fieldtype: 'Select',
+            options: 'UK\nInternational',
+            default: 'UK',
+            reqd: 1
+        },
+        {
+            fieldname: 'forecast_type',
+            label: __('Forecast Type'),
+            fieldtype: 'Select',
+            options: '\nProposed\nActual'
+        },
+        {
+            fieldname: 'opportunity',
+            label: __('Opportunity'),
+            fieldtype: 'Link',
+            options: 'Opportunity'
+        },
+        {
+            fieldname: 'project',
+            label: __('Project'),
+            fieldtype: 'Link',
+            options: 'Project'
+        },
+        {
+            fieldname: 'sdlt_type',
+            label: __('SDLT Type'),
+            fieldtype: 'Select',
+            options: '\nResi\nNon-Resi\nMixed-Use\nLand\nChain-Break\nExempt'
+        },
+        {
+            fieldname: 'from_date',
+            label: __('From Date'),
+            fieldtype: 'Date'
+        },
+        {
+            fieldname: 'to_date',
+            label: __('To Date'),
+            fieldtype: 'Date'
+        }
+    ]
+};
@@ -0,0 +1,164 @@
+# Copyright (c) 2026, Zikpro and contributors
+# For license information, please see license.txt
+
+"""Portfolio totals across every Financial Calculator New.
+
+Capital in, capital left in, net cash flow and yield are summed in a single
+GROUP BY over the numeric summary columns of the forecast table, so the
+summary never loads a document or parses a figure. The query is built with
+frappe.qb so it runs on MariaDB and Postgres alike, and carries the
+doctype's user permission and permission query conditions, so a user only
+sees totals over the forecasts they can read. The filter and grouping
+columns are indexed by on_doctype_update in the controller.
+"""
+import frappe
+from frappe import _
+from frappe.desk.reportview import build_match_conditions
+from frappe.query_builder import Case, Criterion, DatePart
+from frappe.query_builder.functions import Avg, Count, Extract, Sum
+from frappe.utils import add_days, cint, getdate
+from pypika.terms import PseudoColumn
+
+from financial_calculator_app.financial_calculator_app.doctype.financial_calculator_new.financial_calculator_new import (
+    SUMMARY_FIELDS,
+)
+
+DOCTYPE = "Financial Calculator New"
+PAGE_LENGTH = 100
+MAX_PAGE_LENGTH = 1000
+REPORT_PAGE_LENGTH = 1000
+
+# Group by option -> the group value of a forecast
+GROUP_BY = {
+    "Forecast Type": lambda forecast: forecast.forecast_type,
+    "Opportunity": lambda forecast: forecast.opportunity,
+    "Project": lambda forecast: forecast.project,
+    "SDLT Type": lambda forecast: forecast.main_sdlt,
+    # yyyymm, as MariaDB's extract(year_month ...) gives it
+    "Month": lambda forecast: (
+        Extract(DatePart.year, forecast.creation) * 100 + Extract(DatePart.month, forecast.creation)),
+    "Year": lambda forecast: Extract(DatePart.year, forecast.creation),
+}
+
+# Report filter -> the column it matches
+FILTER_COLUMNS = {
+    "forecast_type": "forecast_type",
+    "opportunity": "opportunity",
+    "project": "project",
+    "sdlt_type": "main_sdlt",
+}
+
+# Investor view -> the summary columns it reads
+INVESTOR_SUMMARY_FIELDS = {
+    "UK": SUMMARY_FIELDS[False],
+    "International": SUMMARY_FIELDS[True],
+}
+
+
+def execute(filters=None):
+    filters = frappe._dict(filters or {})
+    summary = get_summary(filters, filters.group_by or "Forecast Type", 0, REPORT_PAGE_LENGTH)
+
+    message = None
+    if summary["total_groups"] > len(summary["groups"]):
+        message = _("Showing the first {0} of {1} groups").format(len(summary["groups"]), summary["total_groups"])
+    return get_columns(filters.group_by or "Forecast Type"), summary["groups"], message
+
+
+@frappe.whitelist()
+def get_portfolio_summary(filters=None, group_by="Forecast Type", start=0, page_length=PAGE_LENGTH):
+    """One page of portfolio groups, with the group count and the totals over every group"""
+    frappe.has_permission(DOCTYPE, "report", throw=True)
+    filters = frappe._dict(frappe.parse_json(filters) or {})
+    page_length = min(cint(page_length) or PAGE_LENGTH, MAX_PAGE_LENGTH)
+    return get_summary(filters, group_by, max(cint(start), 0), page_length)
+
+
+def get_summary(filters, group_by, start, page_length):
+    if group_by not in GROUP_BY:
+        frappe.throw(_("Cannot group forecasts by {0}").format(group_by))
+
+    forecast = frappe.qb.DocType(DOCTYPE)
+    group = GROUP_BY[group_by](forecast)
+    conditions = get_conditions(forecast, filters)
+    aggregates = get_aggregates(forecast, filters.investor or "UK")
+
+    groups = (
+        frappe.qb.from_(forecast)
+        .select(group.as_("group_value"), *aggregates)
+        .where(conditions)
+        .groupby(group)
+        .orderby(group)
+        .limit(page_length)
+        .offset(start)
+    ).run(as_dict=True)
+    grouped = frappe.qb.from_(forecast).select(group).where(conditions).groupby(group)
+    total_groups = cint(frappe.qb.from_(grouped).select(Count("*")).run()[0][0])
+    totals = frappe.qb.from_(forecast).select(*aggregates).where(conditions).run(as_dict=True)[0]
+
+    return {
+        "groups": groups,
+        "totals": totals,
+        "total_groups": total_groups,
+        "start": start,
+        "page_length": page_length,
+    }
+
+
+def get_conditions(forecast, filters):
+    """Criterion of the report filters and the user's permissions on forecasts"""
+    conditions = [forecast.docstatus < 2]
+    for fieldname, column in FILTER_COLUMNS.items():
+        if filters.get(fieldname):
+            conditions.append(forecast[column] == filters[fieldname])
+    if filters.get("from_date"):
+        conditions.append(forecast.creation >= getdate(filters.from_date))
+    if filters.get("to_date"):
+        # creation is a datetime, so include the whole of the last day
+        conditions.append(forecast.creation < add_days(getdate(filters.to_date), 1))
+
+    # User permissions and permission query conditions, as a list view applies them
+    match_conditions = build_match_conditions(DOCTYPE)
+    if match_conditions:
+        conditions.append(PseudoColumn("({0})".format(match_conditions)))
+    return Criterion.all(conditions)
+
+
+def get_aggregates(forecast, investor):
+    """Summary columns of one investor view"""
+    if investor not in INVESTOR_SUMMARY_FIELDS:
+        frappe.throw(_("Unknown investor view {0}").format(investor))
+    fields = INVESTOR_SUMMARY_FIELDS[investor]
+    capital_in = forecast[fields['capital_in']]
+    capital_left_in = forecast[fields['capital_left_in']]
+    net_cash_flow = forecast[fields['net_cash_flow_pa']]
+    invested = capital_left_in > 0
+
+    return [
+        Count("*").as_("forecasts"),
+        Sum(capital_in).as_("capital_in"),
+        Sum(capital_left_in).as_("capital_left_in"),
+        Sum(net_cash_flow).as_("net_cash_flow_pa"),
+        # Mean of each forecast's own yield, and the yield of the portfolio as a whole
+        Avg(Case().when(invested, forecast[fields['annualised_roi']])).as_("average_yield"),
+        (Sum(Case().when(invested, net_cash_flow)) * 100 / Sum(Case().when(invested, capital_left_in))).as_(
+            "portfolio_yield"),
+    ]
+
+
+def get_columns(group_by):
+    group_column = {"label": _(group_by), "fieldname": "group_value", "width": 200}
+    if group_by in ("Opportunity", "Project"):
+        group_column.update(fieldtype="Link", options=group_by)
+    else:
+        group_column["fieldtype"] = "Data"
+
+    return [
+        group_column,
+        {"label": _("Forecasts"), "fieldname": "forecasts", "fieldtype": "Int", "width": 100},
+        {"label": _("Capital In"), "fieldname": "capital_in", "fieldtype": "Currency", "width": 140},
+        {"label": _("Capital Left In"), "fieldname": "capital_left_in", "fieldtype": "Currency", "width": 140},
+        {"label": _("Net Cash Flow p.a."), "fieldname": "net_cash_flow_pa", "fieldtype": "Currency", "width": 140},
+        {"label": _("Average Yield"), "fieldname": "average_yield", "fieldtype": "Percent", "width": 120},
+        {"label": _("Portfolio Yield"), "fieldname": "portfolio_yield", "fieldtype": "Percent", "width": 120},
+    ]
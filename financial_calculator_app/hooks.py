@@ -137,6 +137,20 @@ app_license = "mit"
 # 	}
 # }
 
+# Cached Opportunity and Project lookups of the forecast form
+doc_events = {
+	"Opportunity": {
+		"on_update": "financial_calculator_app.financial_calculator_app.doctype.financial_calculator_new.link_details.clear_link_details",
+		"after_rename": "financial_calculator_app.financial_calculator_app.doctype.financial_calculator_new.link_details.clear_link_details",
+		"on_trash": "financial_calculator_app.financial_calculator_app.doctype.financial_calculator_new.link_details.clear_link_details",
+	},
+	"Project": {
+		"on_update": "financial_calculator_app.financial_calculator_app.doctype.financial_calculator_new.link_details.clear_link_details",
+		"after_rename": "financial_calculator_app.financial_calculator_app.doctype.financial_calculator_new.link_details.clear_link_details",
+		"on_trash": "financial_calculator_app.financial_calculator_app.doctype.financial_calculator_new.link_details.clear_link_details",
+	},
+}
+
 # Scheduled Tasks
 # ---------------
 
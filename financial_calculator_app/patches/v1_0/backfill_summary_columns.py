@@ -0,0 +1,56 @@
+"""Fill the numeric summary columns of existing forecasts.
+
+Annualised ROI, lifetime return, capital gain and net cash flow of both
+investor views now have numeric, indexed copies on the forecast itself, so
+lists can sort and filter on them. They are filled from the results each
+forecast already stores, with only the growth projections worked out again,
+so no stored result changes; recalculating forecasts under the current rules
+is the separate bulk recalculation job.
+"""
+import frappe
+from frappe.utils import flt
+
+from financial_calculator_app.calculator import growth, kernel
+from financial_calculator_app.financial_calculator_app.doctype.financial_calculator_new.financial_calculator_new import (
+    PROFILES,
+    SUMMARY_FIELDS,
+)
+
+DOCTYPE = "Financial Calculator New"
+CHUNK_SIZE = 1000
+
+# Every field the summaries are worked out from
+SOURCE_FIELDS = tuple(sorted({
+    fieldname
+    for profile in PROFILES.values()
+    for fieldname in list(profile.input_fields.values()) + list(profile.result_fields.values())
+}))
+
+
+def execute():
+    projection = growth.get_projection()
+    last_name = None
+    while True:
+        filters = {"name": (">", last_name)} if last_name else None
+        rows = frappe.get_all(DOCTYPE, filters=filters, fields=("name",) + SOURCE_FIELDS,
+                              order_by="name asc", limit_page_length=CHUNK_SIZE)
+        if not rows:
+            break
+        for row in rows:
+            frappe.db.set_value(DOCTYPE, row.name, summary_values(row, projection), update_modified=False)
+        frappe.db.commit()
+        last_name = rows[-1].name
+
+
+def summary_values(row, projection):
+    """Summary columns of both investor views from the results a forecast stores"""
+    values = {}
+    for international, profile in PROFILES.items():
+        inputs = kernel.DealInputs.from_fields(row, profile.input_fields)
+        result = kernel.InvestorResult()
+        for name, fieldname in profile.result_fields.items():
+            setattr(result, name, kernel.stored_number(row.get(fieldname)))
+        kernel.projections(inputs, result, projection)
+        for name, fieldname in SUMMARY_FIELDS[international].items():
+            values[fieldname] = flt(getattr(result, name), 2)
+    return values
@@ -0,0 +1,46 @@
+"""Convert formatted figures left in the projection tables to plain numbers.
+
+The capital growth, capital gain and returns tables used to be filled with
+whole-pound strings such as "260,000". Frappe parses those on save, so most
+cells already hold numbers; any cell still holding text is stripped of its
+formatting and stored as a number in place, a chunk of rows at a time.
+
+Stored results are left as they were calculated. Recalculating forecasts
+under the current rules is the separate bulk recalculation job.
+"""
+import frappe
+
+from financial_calculator_app.calculator import kernel
+from financial_calculator_app.financial_calculator_app.doctype.financial_calculator_new.financial_calculator_new import (
+    TABLE_COLUMNS,
+    TEXT_COLUMNS,
+)
+
+DOCTYPE = "Financial Calculator New"
+CHUNK_SIZE = 10000
+
+
+def execute():
+    meta = frappe.get_meta(DOCTYPE)
+    for table, columns in TABLE_COLUMNS.items():
+        child_doctype = meta.get_field(table).options
+        numeric = [column for column in columns if column not in TEXT_COLUMNS]
+        last_name = None
+        while True:
+            filters = {"name": (">", last_name)} if last_name else None
+            rows = frappe.get_all(child_doctype, filters=filters, fields=["name"] + numeric,
+                                  order_by="name asc", limit_page_length=CHUNK_SIZE)
+            if not rows:
+                break
+            for row in rows:
+                values = {
+                    column: to_number(row[column]) for column in numeric if isinstance(row[column], str)
+                }
+                if values:
+                    frappe.db.set_value(child_doctype, row.name, values, update_modified=False)
+            last_name = rows[-1].name
+
+
+def to_number(value):
+    """A formatted figure as a float, None when blank"""
+    return kernel.clean_currency(value) if value.strip() else None